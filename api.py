@@ -0,0 +1,418 @@
+import argparse
+import datetime
+import json
+import re
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional, Pattern, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+import psycopg2
+from psycopg2.pool import PoolError
+import instrumentation
+import migrations
+import vote_filter
+from connection_pool import get_connection
+from movies import movie_database
+from polls import poll_database
+from polls.Models.option import Option
+from polls.Models.poll import Poll
+
+
+# -- JSON HTTP API --
+# The movie and poll menu actions over HTTP, for many clients at once. Each request runs on
+# its own thread with a pooled connection, and connections are kept alive between requests.
+#   python -m api [--host 127.0.0.1] [--port 8000]
+#
+#   GET  /movies?upcoming=1&page_size=20&cursor=...     a page of movies, and the next page's cursor
+#   POST /movies                {"title", "release_date": "dd-mm-yyyy", "trailer_url"}
+#   GET  /movies/search?q=...&limit=20
+#   GET  /movies/trailer?title=...
+#   GET  /movies/<id>/reviews?page_size=20&cursor=...  newest first, and the next page's cursor
+#   GET  /movies/<id>/reviews?since=...&limit=20   reviews added after a cursor, and the cursor to poll with
+#   POST /movies/<id>/reviews   {"username", "review"}
+#   POST /users                 {"username"}
+#   GET  /users/<username>/reviews?...             the user's reviews, paged or since a cursor like a movie's
+#   GET  /polls
+#   POST /polls                 {"title", "owner", "options": [...]}
+#   GET  /polls/<id>            the poll and its options
+#   POST /options/<id>/votes    {"username"}, 409 when the user has already voted in the poll
+#   GET  /polls/<id>/results    tally, with an ETag for If-None-Match
+#   GET  /polls/<id>/chart.png  pie chart, with the same ETag
+#   GET  /polls/<id>/winners?winners=1&seed=...&option=...
+#   GET  /polls/trending?window=day&limit=10        window is hour, day, week or month
+#   GET  /polls/<id>/vote-rate.png?window=day       votes per hour or day for each option
+#   GET  /metrics               instrumentation metrics, Prometheus text
+
+HOST = "127.0.0.1"
+PORT = 8000
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class ApiError(Exception):
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+Response = Tuple[HTTPStatus, object, dict]       # status, JSON body (or bytes), extra headers
+
+
+def _movie_json(movie: movie_database.Movie) -> dict:
+    _id, title, release_timestamp, trailer_url = movie
+    return {"id": _id, "title": title, "release_timestamp": release_timestamp, "trailer_url": trailer_url}
+
+
+def _required(body: dict, *fields: str) -> List[str]:
+    """the fields' values, each of which must be a non-empty string"""
+    missing = [field for field in fields if not body.get(field)]
+    if missing:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"missing {', '.join(missing)}")
+    not_strings = [field for field in fields if not isinstance(body[field], str)]
+    if not_strings:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"{', '.join(not_strings)} must be a string")
+    return [body[field] for field in fields]
+
+
+def _int_query(query: dict, name: str, default: Optional[int], minimum: Optional[int] = 1) -> Optional[int]:
+    """a whole number query parameter, at least minimum (a size, count or id) unless that is None"""
+    try:
+        value = int(query[name][0]) if name in query else default
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"{name} must be a whole number")
+    if value is not None and minimum is not None and value < minimum:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"{name} must be at least {minimum}")
+    return value
+
+
+def _review_feed(query: dict, key, get_feed, get_since) -> Response:
+    """a page of a review feed, or with since= the reviews added after that cursor"""
+    try:
+        with get_connection(read_only=True) as connection:
+            if "since" in query:
+                limit = min(_int_query(query, "limit", PAGE_SIZE), MAX_PAGE_SIZE)
+                reviews, cursor = get_since(connection, key, query["since"][0], limit)
+                return HTTPStatus.OK, {"reviews": reviews, "cursor": cursor}, {}
+            page_size = min(_int_query(query, "page_size", PAGE_SIZE), MAX_PAGE_SIZE)
+            reviews, next_cursor = get_feed(connection, key, page_size, query.get("cursor", [None])[0])
+            return HTTPStatus.OK, {"reviews": reviews, "next_cursor": next_cursor}, {}
+    except ValueError:      # a malformed cursor
+        raise ApiError(HTTPStatus.BAD_REQUEST, "cursor must be one returned by this feed")
+
+
+def _get_poll(poll_id: int) -> Poll:
+    with get_connection(read_only=True) as connection:
+        if poll_database.get_poll(connection, poll_id) is None:
+            raise ApiError(HTTPStatus.NOT_FOUND, f"no poll {poll_id}")
+    return Poll.get(poll_id)
+
+
+def _tally_etag(tally: List[poll_database.OptionTally]) -> str:
+    return f'"{poll_database.tally_version(tally)}"'
+
+
+# -- Movies --
+
+def list_movies(request, match, query) -> Response:
+    page_size = min(_int_query(query, "page_size", PAGE_SIZE), MAX_PAGE_SIZE)
+    try:
+        with get_connection(read_only=True) as connection:
+            movies, next_cursor = movie_database.get_movies_page(
+                connection, page_size, query.get("cursor", [None])[0], "upcoming" in query)
+    except ValueError:      # a malformed cursor
+        raise ApiError(HTTPStatus.BAD_REQUEST, "cursor must be one returned by this listing")
+    return HTTPStatus.OK, {"movies": [_movie_json(movie) for movie in movies], "next_cursor": next_cursor}, {}
+
+
+def add_movie(request, match, query) -> Response:
+    title, release_date, trailer_url = _required(request.json_body(), "title", "release_date", "trailer_url")
+    try:
+        timestamp = datetime.datetime.strptime(release_date, "%d-%m-%Y").timestamp()
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "release_date must be dd-mm-yyyy")
+    with get_connection() as connection:
+        movie_database.add_movie(connection, title, timestamp, trailer_url)
+    return HTTPStatus.CREATED, {"title": title, "release_timestamp": timestamp}, {}
+
+
+def search_movies(request, match, query) -> Response:
+    search_input = query.get("q", [""])[0]
+    if not search_input:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "missing q")
+    limit = min(_int_query(query, "limit", movie_database.SEARCH_LIMIT), MAX_PAGE_SIZE)
+    with get_connection(read_only=True) as connection:
+        movies = movie_database.search_movie(connection, search_input, limit)
+    return HTTPStatus.OK, {"movies": [_movie_json(movie) for movie in movies]}, {}
+
+
+def movie_trailer(request, match, query) -> Response:
+    title = query.get("title", [""])[0]
+    with get_connection(read_only=True) as connection:
+        url = movie_database.get_trailer_url(connection, title)
+        if url is None:
+            suggestions = movie_database.autocomplete_movie(connection, title) if title else []
+            return HTTPStatus.NOT_FOUND, {"error": f"no movie called '{title}'",
+                                          "suggestions": [movie[1] for movie in suggestions]}, {}
+    return HTTPStatus.OK, {"title": title, "trailer_url": url[0]}, {}
+
+
+def movie_reviews(request, match, query) -> Response:
+    status, body, headers = _review_feed(query, int(match.group("movie_id")),
+                                         movie_database.get_movie_review_feed, movie_database.get_movie_reviews_since)
+    body["reviews"] = [{"id": _id, "created_at": created_at, "username": username, "review": review}
+                       for _id, created_at, username, review in body["reviews"]]
+    return status, body, headers
+
+
+def review_movie(request, match, query) -> Response:
+    username, review = _required(request.json_body(), "username", "review")
+    with get_connection() as connection:
+        movie_database.review_movie(connection, username, int(match.group("movie_id")), review)
+    return HTTPStatus.CREATED, {"username": username, "review": review}, {}
+
+
+def add_user(request, match, query) -> Response:
+    username, = _required(request.json_body(), "username")
+    with get_connection() as connection:
+        movie_database.add_user(connection, username)
+    return HTTPStatus.CREATED, {"username": username}, {}
+
+
+def reviewed_movies(request, match, query) -> Response:
+    status, body, headers = _review_feed(query, unquote(match.group("username")),
+                                         movie_database.get_user_review_feed, movie_database.get_user_reviews_since)
+    body["reviews"] = [{"id": _id, "created_at": created_at, "movie_id": movie_id, "title": title, "review": review}
+                       for _id, created_at, movie_id, title, review in body["reviews"]]
+    return status, body, headers
+
+
+# -- Polls --
+
+def list_polls(request, match, query) -> Response:
+    return HTTPStatus.OK, {"polls": [{"id": poll.id, "title": poll.title, "owner": poll.owner}
+                                     for poll in Poll.all()]}, {}
+
+
+def create_poll(request, match, query) -> Response:
+    body = request.json_body()
+    title, owner = _required(body, "title", "owner")
+    options = body.get("options", [])
+    # checked before the poll is saved, so a bad option can't leave a poll without the rest
+    if not isinstance(options, list) or not all(isinstance(option, str) and option for option in options):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "options must be a list of non-empty strings")
+    poll = Poll(title, owner)
+    poll.save()
+    for option_text in options:
+        poll.add_option(option_text)
+    return HTTPStatus.CREATED, {"id": poll.id, "title": poll.title, "owner": poll.owner}, {}
+
+
+def get_poll(request, match, query) -> Response:
+    poll = _get_poll(int(match.group("poll_id")))
+    return HTTPStatus.OK, {"id": poll.id, "title": poll.title, "owner": poll.owner,
+                           "options": [{"id": option.id, "text": option.text} for option in poll.options]}, {}
+
+
+def vote(request, match, query) -> Response:
+    username, = _required(request.json_body(), "username")
+    with get_connection() as connection:
+        if poll_database.get_option(connection, int(match.group("option_id"))) is None:
+            raise ApiError(HTTPStatus.NOT_FOUND, f"no option {match.group('option_id')}")
+    if not Option.get(int(match.group("option_id"))).vote(username):
+        raise ApiError(HTTPStatus.CONFLICT, f"{username} has already voted in this poll")
+    return HTTPStatus.CREATED, {"option_id": int(match.group("option_id")), "username": username}, {}
+
+
+def poll_results(request, match, query) -> Response:
+    poll_id = int(match.group("poll_id"))
+    _get_poll(poll_id)
+    with get_connection(read_only=True) as connection:
+        tally = poll_database.get_poll_tally(connection, poll_id)
+    etag = _tally_etag(tally)
+    if request.headers.get("If-None-Match") == etag:
+        return HTTPStatus.NOT_MODIFIED, None, {"ETag": etag}
+    total_votes = tally[0][3] if tally else 0
+    return HTTPStatus.OK, {
+        "poll_id": poll_id,
+        "total_votes": total_votes,
+        "options": [{"id": option_id, "text": option_text, "votes": votes,
+                     "percentage": votes / total_votes * 100 if total_votes else 0}
+                    for option_id, option_text, votes, _ in tally],
+    }, {"ETag": etag}
+
+
+def poll_chart(request, match, query) -> Response:
+    from polls import charts
+
+    poll = _get_poll(int(match.group("poll_id")))
+    with get_connection(read_only=True) as connection:
+        tally = poll_database.get_poll_tally(connection, poll.id)
+    etag = _tally_etag(tally)
+    if request.headers.get("If-None-Match") == etag:
+        return HTTPStatus.NOT_MODIFIED, None, {"ETag": etag}
+    image = charts.render_poll_chart(poll.id, poll.title, tally)
+    if image is None:
+        raise ApiError(HTTPStatus.NOT_FOUND, "this poll has no votes to chart yet")
+    return HTTPStatus.OK, image, {"ETag": etag, "Content-Type": "image/png"}
+
+
+def poll_winners(request, match, query) -> Response:
+    poll = _get_poll(int(match.group("poll_id")))
+    winners = _int_query(query, "winners", 1)
+    seed = _int_query(query, "seed", None, minimum=None)
+    option_id = _int_query(query, "option", None)
+    if option_id is None:
+        drawn, seed = poll.draw_winners(winners, seed)
+    else:
+        with get_connection(read_only=True) as connection:
+            option = poll_database.get_option(connection, option_id)
+        if option is None or option[2] != poll.id:
+            raise ApiError(HTTPStatus.NOT_FOUND, f"no option {option_id} in poll {poll.id}")
+        drawn, seed = Option(None, poll.id, option_id).draw_winners(winners, seed)
+    return HTTPStatus.OK, {"seed": seed, "winners": [{"username": username, "option_id": winner_option_id}
+                                                     for username, winner_option_id in drawn]}, {}
+
+
+def _window(query: dict) -> str:
+    window = query.get("window", ["day"])[0]
+    if window not in poll_database.WINDOWS:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"window must be one of {', '.join(poll_database.WINDOWS)}")
+    return window
+
+
+def trending_polls(request, match, query) -> Response:
+    window = _window(query)
+    limit = min(_int_query(query, "limit", poll_database.TRENDING_LIMIT), MAX_PAGE_SIZE)
+    with get_connection(read_only=True) as connection:
+        trending = poll_database.get_trending_polls(connection, window, limit)
+    return HTTPStatus.OK, {"window": window, "polls": [{"id": poll_id, "title": title, "votes": votes}
+                                                       for poll_id, title, votes in trending]}, {}
+
+
+def vote_rate_chart(request, match, query) -> Response:
+    from polls import charts
+
+    poll = _get_poll(int(match.group("poll_id")))
+    window = _window(query)
+    with get_connection(read_only=True) as connection:
+        rates = poll_database.get_poll_vote_rate(connection, poll.id, window)
+    bucket_starts, series = charts.vote_rate_series(rates, window)
+    option_texts = {option.id: option.text for option in poll.options}
+    image = charts.render_vote_rate_chart(bucket_starts, series, option_texts, poll.title, window)
+    return HTTPStatus.OK, image, {"Content-Type": "image/png"}
+
+
+def metrics(request, match, query) -> Response:
+    text = instrumentation.prometheus_text() + vote_filter.prometheus_text()
+    return HTTPStatus.OK, text.encode(), {"Content-Type": "text/plain; version=0.0.4"}
+
+
+ROUTES: List[Tuple[str, Pattern, Callable]] = [
+    ("GET", re.compile(r"/movies"), list_movies),
+    ("POST", re.compile(r"/movies"), add_movie),
+    ("GET", re.compile(r"/movies/search"), search_movies),
+    ("GET", re.compile(r"/movies/trailer"), movie_trailer),
+    ("GET", re.compile(r"/movies/(?P<movie_id>\d+)/reviews"), movie_reviews),
+    ("POST", re.compile(r"/movies/(?P<movie_id>\d+)/reviews"), review_movie),
+    ("POST", re.compile(r"/users"), add_user),
+    ("GET", re.compile(r"/users/(?P<username>[^/]+)/reviews"), reviewed_movies),
+    ("GET", re.compile(r"/polls"), list_polls),
+    ("POST", re.compile(r"/polls"), create_poll),
+    ("GET", re.compile(r"/polls/(?P<poll_id>\d+)"), get_poll),
+    ("POST", re.compile(r"/options/(?P<option_id>\d+)/votes"), vote),
+    ("GET", re.compile(r"/polls/(?P<poll_id>\d+)/results"), poll_results),
+    ("GET", re.compile(r"/polls/(?P<poll_id>\d+)/chart\.png"), poll_chart),
+    ("GET", re.compile(r"/polls/(?P<poll_id>\d+)/winners"), poll_winners),
+    ("GET", re.compile(r"/polls/trending"), trending_polls),
+    ("GET", re.compile(r"/polls/(?P<poll_id>\d+)/vote-rate\.png"), vote_rate_chart),
+    ("GET", re.compile(r"/metrics"), metrics),
+]
+
+
+class ApiRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"       # keep-alive; every response sets Content-Length
+    server_version = "MovieReviewPollAPI"
+
+    def json_body(self) -> dict:
+        try:
+            body = json.loads(self.body or b"{}")
+        except ValueError:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "body must be JSON")
+        if not isinstance(body, dict):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "body must be a JSON object")
+        return body
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method: str):
+        # read whatever happens next, so an unread body can't be taken for the next request
+        self.body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        try:
+            for route_method, pattern, handler in ROUTES:
+                match = pattern.fullmatch(url.path.rstrip("/") or "/")
+                if match and route_method == method:
+                    with instrumentation.action(f"api:{handler.__name__}"):
+                        status, body, headers = handler(self, match, query)
+                    break
+            else:
+                raise ApiError(HTTPStatus.NOT_FOUND, f"no route for {method} {url.path}")
+        except ApiError as error:
+            status, body, headers = error.status, {"error": str(error)}, {}
+        except psycopg2.IntegrityError as error:        # e.g. reviewing a movie or as a user that doesn't exist
+            status, body, headers = HTTPStatus.CONFLICT, {"error": error.pgerror or str(error)}, {}
+        except PoolError as error:      # every connection busy for the whole pool timeout
+            status, body, headers = HTTPStatus.SERVICE_UNAVAILABLE, {"error": str(error)}, {"Retry-After": "1"}
+        except Exception:
+            self.log_error("error handling %s %s", method, self.path)
+            status, body, headers = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "internal server error"}, {}
+        self._respond(status, body, headers)
+
+    def _respond(self, status: HTTPStatus, body, headers: dict):
+        if body is None:
+            payload = b""
+        elif isinstance(body, bytes):
+            payload = body
+        else:
+            payload = json.dumps(body).encode()
+            headers.setdefault("Content-Type", "application/json")
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        if payload and self.command != "HEAD":
+            self.wfile.write(payload)
+
+    def log_request(self, code="-", size="-"):
+        pass        # one line per request would swamp the terminal under load; errors are still logged
+
+
+def make_server(host: str = HOST, port: int = PORT) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), ApiRequestHandler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the movie and poll database as a JSON API")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+
+    migrations.ensure_schema()
+    with get_connection(read_only=True) as warm_connection:
+        print(f"Vote filter warmed up with {poll_database.warm_vote_filter(warm_connection)} recent voters")
+    server = make_server(args.host, args.port)
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,3 +1,5 @@
+import sys
+from typing import List, Optional
 from movies import movie_functions
 from polls import poll_functions
 
@@ -5,22 +7,34 @@ WELCOME = "Welcome to my movie review and poll database"
 
 START_MENU = """
 Would you like to look up movies reviews or on movie polls:
-    
+
     1) Look up a movie to read/write a movie review, or watch trailer
     2) Answer a movie poll and view results
-    
+
     Or press Enter to exit
-    
+
 Your selection:
 """
 
 
-while len(menu_option := input(START_MENU)) != 0:
-    if menu_option == "1":
-        movie_functions.menu_movie()
-    elif menu_option == "2":
-        poll_functions.menu_poll()
-    else:
-        print("Invalid command, please try again")
+def main(argv: Optional[List[str]] = None) -> int:
+    """the interactive menus, or with arguments a command from commands.py (see --help)"""
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        import commands
+        return commands.main(argv)
+
+    while len(menu_option := input(START_MENU)) != 0:
+        if menu_option == "1":
+            movie_functions.menu_movie()
+        elif menu_option == "2":
+            poll_functions.menu_poll()
+        else:
+            print("Invalid command, please try again")
+
+    print("Exiting movie database")
+    return 0
+
 
-print("Exiting movie database")
+if __name__ == "__main__":
+    sys.exit(main())
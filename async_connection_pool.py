@@ -0,0 +1,53 @@
+import os
+from contextlib import asynccontextmanager
+from typing import Optional
+from psycopg_pool import AsyncConnectionPool
+from dotenv import load_dotenv
+
+
+# -- Setting the PostGreSQL connection --
+load_dotenv()     # DATABASE_URI is read when the pool is first opened, like connection_pool's
+
+ASYNC_POOL_MIN_CONNECTIONS = int(os.environ.get("DATABASE_ASYNC_POOL_MIN", 1))
+ASYNC_POOL_MAX_CONNECTIONS = int(os.environ.get("DATABASE_ASYNC_POOL_MAX", 10))
+ASYNC_POOL_TIMEOUT = float(os.environ.get("DATABASE_POOL_TIMEOUT", 30))
+ASYNC_POOL_MAX_LIFETIME = float(os.environ.get("DATABASE_POOL_MAX_LIFETIME", 1800))
+
+
+#  -- Connections Setup --
+
+# The async pool lets thousands of in-flight coroutines share a few connections: a coroutine
+# waiting for a connection or a query result yields to the event loop instead of blocking it.
+# It is opened on first use, as it has to be created inside a running event loop.
+pool: Optional[AsyncConnectionPool] = None
+
+
+async def get_async_pool() -> AsyncConnectionPool:
+    global pool
+    if pool is None:
+        pool = AsyncConnectionPool(
+            os.environ["DATABASE_URI"],
+            min_size=ASYNC_POOL_MIN_CONNECTIONS,
+            max_size=ASYNC_POOL_MAX_CONNECTIONS,
+            timeout=ASYNC_POOL_TIMEOUT,
+            max_lifetime=ASYNC_POOL_MAX_LIFETIME,
+            open=False,
+        )
+    await pool.open()
+    return pool
+
+
+# allows a connection using an 'async with' statement.
+# On leaving the block the pool commits (or rolls back on error) and takes the connection back
+@asynccontextmanager
+async def get_async_connection():
+    async_pool = await get_async_pool()
+    async with async_pool.connection() as connection:
+        yield connection
+
+
+async def close_async_pool():
+    global pool
+    if pool is not None:
+        await pool.close()
+        pool = None
@@ -0,0 +1,123 @@
+import argparse
+import io
+import statistics
+import time
+from typing import Callable, Dict, List, Tuple
+import cache
+import migrations
+import storage
+from connection_pool import get_connection
+from movies import movie_database
+from polls import poll_database
+
+
+# Times the same data module calls on each storage backend. tests/test_data_modules.py checks
+# that they behave the same on both.
+#   BENCHMARK_DATABASE_URI=... python -m benchmarks.backend_comparison [--backends postgres sqlite]
+#       [--repeat 10] [--sqlite-path :memory:]
+# Every workload makes its own rows, named after the run, so they can run on a seeded database;
+# PostGreSQL only runs against BENCHMARK_DATABASE_URI.
+
+REPEAT = 10
+BACKENDS = ["postgres", "sqlite"]
+
+
+def movies(connection, tag: str):
+    titles = [f"{tag} Alpha", f"{tag} Beta", f"{tag} Gamma"]
+    movie_database.import_movies(connection, [(title, 2_000_000_000 + number, f"https://example.com/{tag}/{number}")
+                                              for number, title in enumerate(titles)])
+    movie_database.add_movie(connection, f"{tag} Delta", 2_000_000_003, f"https://example.com/{tag}/3")
+    found = movie_database.search_movie(connection, tag.upper(), limit=10)
+    movie_database.autocomplete_movie(connection, f"{tag} b".lower())
+    movie_database.get_trailer_url(connection, titles[2].upper())
+    movie_database.get_movie_title(connection, found[0][0])
+
+
+def reviews(connection, tag: str):
+    username = f"{tag}-reviewer"
+    movie_database.add_user(connection, username)
+    movie_database.import_movies(connection, [(f"{tag} Review {number}", 2_000_000_000 + number, "")
+                                              for number in range(3)])
+    movie_ids = [movie[0] for movie in movie_database.search_movie(connection, f"{tag} Review", limit=10)
+                 if tag in movie[1]]
+    for movie_id in sorted(movie_ids):
+        movie_database.review_movie(connection, username, movie_id, f"review of {movie_id}")
+    movie_database.get_reviewed_movies(connection, username)
+    page, cursor_token = movie_database.get_user_review_feed(connection, username, page_size=2)
+    movie_database.get_user_review_feed(connection, username, 2, cursor_token)
+    movie_database.get_user_reviews_since(connection, username, movie_database.review_cursor_token(page[-1]))
+    movie_database.get_movie_reviews(connection, movie_ids[0])
+
+
+def polls(connection, tag: str):
+    poll_id = poll_database.create_poll(connection, f"{tag} poll", f"{tag}-owner")
+    option_ids = [poll_database.add_option(connection, text, poll_id) for text in ("A", "B", "C")]
+    poll_database.get_poll(connection, poll_id)
+    poll_database.get_poll_options(connection, poll_id)
+    poll_database.get_existing_option_ids(connection, option_ids)
+
+    now = time.time()
+    for number in range(4):
+        poll_database.add_vote(connection, f"{tag}-voter{number}", now, option_ids[number % 2])
+    poll_database.add_vote(connection, f"{tag}-voter0", now, option_ids[2])       # a repeat vote
+    poll_database.copy_votes(connection, [(f"{tag}-voter{number}", option_ids[1], int(now)) for number in (4, 5)])
+    cache.poll_tallies.invalidate(poll_id)
+
+    poll_database.get_poll_tally(connection, poll_id)
+    poll_database.get_votes_for_option(connection, option_ids[0])
+    poll_database.draw_winners(connection, poll_id, 3, seed=7)
+    poll_database.get_poll_vote_rate(connection, poll_id, "day")
+    cache.trending_polls.clear()
+    poll_database.get_trending_polls(connection, "hour")
+    poll_database.export_poll_vote_log(connection, poll_id, io.StringIO())
+    list(poll_database.iter_poll_vote_log(connection, poll_id))
+    poll_database.get_vote_count_drift(connection)
+
+
+WORKLOADS: List[Tuple[str, Callable]] = [
+    ("movies", movies),
+    ("reviews", reviews),
+    ("polls", polls),
+]
+
+
+def use_backend(backend: str, sqlite_path: str):
+    storage.BACKEND = backend
+    storage.SQLITE_PATH = sqlite_path
+    if backend == "postgres":
+        from benchmarks.seed import benchmark_database_uri
+        benchmark_database_uri()
+    for named_cache in cache.CACHES.values():     # rows cached from the other backend
+        named_cache.clear()
+    with get_connection() as connection:
+        migrations.migrate(connection)
+
+
+def run(backends: List[str], repeat: int = REPEAT, sqlite_path: str = ":memory:") -> Dict[str, Dict[str, float]]:
+    """{workload: {backend: median ms}}"""
+    timings: Dict[str, Dict[str, float]] = {name: {} for name, _ in WORKLOADS}
+    run_tag = f"bc{time.time_ns()}"
+    for backend in backends:
+        use_backend(backend, sqlite_path)
+        for name, workload in WORKLOADS:
+            durations = []
+            for number in range(repeat):
+                with get_connection() as connection:
+                    started = time.perf_counter()
+                    workload(connection, f"{run_tag}{backend[0]}{number}")
+                    durations.append((time.perf_counter() - started) * 1000)
+            timings[name][backend] = statistics.median(durations)
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the same data module calls on each storage backend")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=BACKENDS)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--sqlite-path", default=":memory:")
+    args = parser.parse_args()
+
+    results = run(args.backends, args.repeat, args.sqlite_path)
+    print(f"{'workload':<10}" + "".join(f"{backend + ' ms':>16}" for backend in args.backends))
+    for workload_name, by_backend in results.items():
+        print(f"{workload_name:<10}" + "".join(f"{by_backend[backend]:>16.2f}" for backend in args.backends))
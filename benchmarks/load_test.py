@@ -0,0 +1,157 @@
+import argparse
+import http.client
+import json
+import random
+import statistics
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+
+# Sustained load against the JSON API (api.py), each client thread on one kept-alive connection.
+#   python -m api &
+#   python -m benchmarks.load_test [--host 127.0.0.1 --port 8000] [--clients 16] [--duration 30]
+# or --serve to start the API in this process first. Seed the database with benchmarks.seed
+# for realistic data. The mix is mostly result reads (revalidated with If-None-Match, as
+# a browser would), then poll and movie reads, searches and votes.
+
+CLIENTS = 16
+DURATION = 30
+MIX = [     # (weight, request kind)
+    (40, "results"),
+    (15, "poll"),
+    (15, "movies"),
+    (10, "search"),
+    (10, "reviews"),
+    (10, "vote"),
+]
+SEARCH_WORDS = ["silent", "river", "night", "storm", "kingdom", "shadow", "summer", "garden"]
+
+
+class Client(threading.Thread):
+    def __init__(self, host: str, port: int, deadline: float, poll_ids: List[int],
+                 option_ids: Dict[int, List[int]], rng_seed: int):
+        super().__init__(daemon=True)
+        self.connection = http.client.HTTPConnection(host, port, timeout=30)
+        self.deadline = deadline
+        self.poll_ids = poll_ids
+        self.option_ids = option_ids
+        self.rng = random.Random(rng_seed)
+        self.etags: Dict[str, str] = {}
+        self.latencies: Dict[str, List[float]] = {kind: [] for _, kind in MIX}
+        self.statuses = Counter()
+        self.failures = 0
+
+    def _request(self, method: str, path: str, body: Optional[dict] = None) -> Tuple[int, bytes]:
+        headers = {"If-None-Match": self.etags[path]} if path in self.etags else {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        self.connection.request(method, path, payload, headers)
+        response = self.connection.getresponse()
+        data = response.read()
+        if response.getheader("ETag"):
+            self.etags[path] = response.getheader("ETag")
+        return response.status, data
+
+    def _next_request(self) -> Tuple[str, str, str, Optional[dict]]:
+        kind = self.rng.choices([kind for _, kind in MIX], [weight for weight, _ in MIX])[0]
+        poll_id = self.poll_ids[min(int(self.rng.paretovariate(1.2)) - 1, len(self.poll_ids) - 1)]
+        if kind == "results":
+            return kind, "GET", f"/polls/{poll_id}/results", None
+        if kind == "poll":
+            return kind, "GET", f"/polls/{poll_id}", None
+        if kind == "movies":
+            return kind, "GET", "/movies?page_size=20", None
+        if kind == "search":
+            return kind, "GET", f"/movies/search?q={self.rng.choice(SEARCH_WORDS)}", None
+        if kind == "reviews":
+            return kind, "GET", f"/movies/{self.rng.randint(1, 100)}/reviews", None
+        option_id = self.rng.choice(self.option_ids[poll_id])
+        return kind, "POST", f"/options/{option_id}/votes", {"username": f"load{self.rng.randint(1, 1000)}"}
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            kind, method, path, body = self._next_request()
+            started = time.perf_counter()
+            try:
+                status, _ = self._request(method, path, body)
+            except (OSError, http.client.HTTPException):
+                self.failures += 1
+                self.connection.close()     # reconnects on the next request
+                continue
+            self.latencies[kind].append((time.perf_counter() - started) * 1000)
+            self.statuses[status] += 1
+        self.connection.close()
+
+
+def _get_json(host: str, port: int, path: str):
+    connection = http.client.HTTPConnection(host, port, timeout=30)
+    try:
+        connection.request("GET", path)
+        return json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(host: str, port: int, clients: int = CLIENTS, duration: float = DURATION) -> dict:
+    poll_ids = [poll["id"] for poll in _get_json(host, port, "/polls")["polls"]]
+    option_ids = {poll_id: [option["id"] for option in _get_json(host, port, f"/polls/{poll_id}")["options"]]
+                  for poll_id in poll_ids[:50]}
+    poll_ids = [poll_id for poll_id in poll_ids[:50] if option_ids[poll_id]]
+    if not poll_ids:
+        raise SystemExit("The database has no polls with options; seed it with python -m benchmarks.seed")
+
+    started = time.monotonic()
+    workers = [Client(host, port, started + duration, poll_ids, option_ids, number) for number in range(clients)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - started
+
+    statuses = sum((worker.statuses for worker in workers), Counter())
+    failures = sum(worker.failures for worker in workers)
+    total = sum(statuses.values())
+    print(f"{total} requests in {elapsed:.1f}s from {clients} clients: {total / elapsed:.1f} requests/sec")
+    print(f"statuses: {dict(sorted(statuses.items()))}, connection failures: {failures}")
+    print(f"{'request':<10}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    report = {"requests_per_second": total / elapsed, "statuses": dict(statuses), "failures": failures, "kinds": {}}
+    for _, kind in MIX:
+        latencies = [latency for worker in workers for latency in worker.latencies[kind]]
+        if latencies:
+            p50, p95, p99 = (_percentile(latencies, fraction) for fraction in (0.5, 0.95, 0.99))
+            print(f"{kind:<10}{len(latencies):>8}{p50:>10.2f}{p95:>10.2f}{p99:>10.2f}")
+            report["kinds"][kind] = {"count": len(latencies), "p50_ms": p50, "p95_ms": p95, "p99_ms": p99,
+                                     "mean_ms": statistics.mean(latencies)}
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the JSON API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--clients", type=int, default=CLIENTS)
+    parser.add_argument("--duration", type=float, default=DURATION, help="seconds")
+    parser.add_argument("--serve", action="store_true", help="start the API in this process first")
+    parser.add_argument("--output", default=None, help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    if args.serve:
+        import api
+        import migrations
+        migrations.ensure_schema()
+        server = api.make_server(args.host, args.port)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    result = run(args.host, args.port, args.clients, args.duration)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=2)
@@ -0,0 +1,61 @@
+import argparse
+import time
+from connection_pool import get_connection
+from movies import movie_database
+from polls import poll_database
+import prepared_statements
+
+
+# Compares per-call latency of the vote and lookup hot paths sent as plain query text
+# against the same queries run as prepared statements, on one pooled connection.
+#   python -m benchmarks.prepared_statements [--calls 5000]
+# Everything runs inside one transaction that is rolled back, so no data is left behind.
+
+CALLS = 5000
+
+
+def _time_calls(cursor, query: str, params: tuple, calls: int) -> float:
+    """average microseconds per call"""
+    started = time.perf_counter()
+    for _ in range(calls):
+        prepared_statements.execute(cursor, query, params)
+        if cursor.description:      # results are fetched as the data modules would
+            cursor.fetchall()
+    return (time.perf_counter() - started) / calls * 1_000_000
+
+
+def run(calls: int = CALLS):
+    with get_connection() as connection:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(poll_database.INSERT_POLL_RETURN_ID, ("benchmark poll", "benchmark"))
+                poll_id = cursor.fetchone()[0]
+                cursor.execute(poll_database.INSERT_OPTION_RETURN_ID, ("benchmark option", poll_id))
+                option_id = cursor.fetchone()[0]
+
+                hot_paths = [
+                    ("add_vote", poll_database.INSERT_VOTE, ("benchmark", option_id, int(time.time()))),
+                    ("get_option", poll_database.SELECT_OPTION, (option_id, )),
+                    ("get_poll", poll_database.SELECT_POLL, (poll_id, )),
+                    ("get_poll_tally", poll_database.SELECT_POLL_TALLY, (poll_id, )),
+                    ("get_trailer_url", movie_database.SELECT_MOVIE_TRAILER_URL, ("benchmark", )),
+                ]
+
+                print(f"{'query':<20}{'text (us)':>12}{'prepared (us)':>16}{'saved':>10}")
+                for name, query, params in hot_paths:
+                    prepared_statements.set_enabled(False)
+                    text_time = _time_calls(cursor, query, params, calls)
+                    prepared_statements.set_enabled(True)
+                    _time_calls(cursor, query, params, 1)       # PREPARE outside the timing
+                    prepared_time = _time_calls(cursor, query, params, calls)
+                    saved = (text_time - prepared_time) / text_time * 100
+                    print(f"{name:<20}{text_time:>12.1f}{prepared_time:>16.1f}{saved:>9.1f}%")
+        finally:
+            connection.rollback()
+            prepared_statements.set_enabled(prepared_statements.PREPARED_BY_DEFAULT)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark prepared statements against plain query text")
+    parser.add_argument("--calls", type=int, default=CALLS)
+    run(parser.parse_args().calls)
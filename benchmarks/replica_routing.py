@@ -0,0 +1,59 @@
+import argparse
+import sys
+import threading
+import time
+from collections import Counter
+import connection_pool
+from connection_pool import get_connection
+from movies import movie_database
+
+
+# Compares read throughput with reads spread over the streaming replicas against every read on
+# the primary. tests/test_replica_routing.py checks the routing itself.
+#   DATABASE_URI=... DATABASE_REPLICA_URIS=...,... python -m benchmarks.replica_routing [--threads 16]
+
+THREADS = 16
+DURATION = 10
+
+
+def server(connection) -> str:
+    return f"{connection.info.host}:{connection.info.port}"
+
+
+def run_reads(threads: int, duration: float, read_only: bool) -> Counter:
+    """get_movies_page from each thread for duration seconds; reads served by each server"""
+    deadline = time.monotonic() + duration
+    served = Counter()
+    lock = threading.Lock()
+
+    def reader():
+        counts = Counter()
+        while time.monotonic() < deadline:
+            with get_connection(read_only=read_only) as connection:
+                movie_database.get_movies_page(connection, 20)
+                counts[server(connection)] += 1
+        with lock:
+            served.update(counts)
+
+    workers = [threading.Thread(target=reader) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return served
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare read throughput on the primary and on the replicas")
+    parser.add_argument("--threads", type=int, default=THREADS)
+    parser.add_argument("--duration", type=float, default=DURATION, help="seconds per throughput run")
+    args = parser.parse_args()
+
+    if not connection_pool.get_replica_pools():
+        sys.exit("Set DATABASE_REPLICA_URIS to the replicas' DSNs")
+
+    print(f"{'reads on':<12}{'reads/sec':>12}  served by ({connection_pool.REPLICA_SELECTION})")
+    for label, read_only in (("primary", False), ("replicas", True)):
+        served = run_reads(args.threads, args.duration, read_only)
+        shares = ", ".join(f"{name} {count}" for name, count in served.most_common())
+        print(f"{label:<12}{sum(served.values()) / args.duration:>12.1f}  {shares}")
@@ -0,0 +1,190 @@
+import argparse
+import bisect
+import csv
+import io
+import itertools
+import os
+import random
+import time
+from typing import Dict, List, NamedTuple, Sequence
+import migrations
+from connection_pool import get_connection
+from movies import movie_database
+from polls import poll_database
+
+
+# Synthetic data for the benchmarks: movies, users, reviews, polls, options and votes with
+# the skew real traffic has (a few popular movies, polls, options and voters get most of the
+# activity). The same --seed always generates the same rows.
+#   python -m benchmarks.seed [--size small|medium|large] [--movies N --votes N ...] [--seed 1]
+# Seeding EMPTIES every app table first, so it only runs against BENCHMARK_DATABASE_URI,
+# never the DATABASE_URI the app uses.
+
+SEED = 1
+SKEW = 1.1      # zipf exponent; higher puts more of the activity on the most popular rows
+YEAR = 365 * 24 * 3600
+TIMESTAMP_SPAN = 90 * 24 * 3600        # votes are spread over the last 90 days
+BATCH_SIZE = 50_000
+
+
+class DatasetSize(NamedTuple):
+    movies: int
+    users: int
+    reviews: int
+    polls: int
+    options_per_poll: int
+    votes: int
+
+
+SIZES: Dict[str, DatasetSize] = {
+    "small": DatasetSize(movies=1_000, users=200, reviews=2_000, polls=50, options_per_poll=4, votes=10_000),
+    "medium": DatasetSize(movies=10_000, users=2_000, reviews=20_000, polls=500, options_per_poll=4, votes=100_000),
+    "large": DatasetSize(movies=100_000, users=20_000, reviews=200_000, polls=5_000, options_per_poll=5,
+                         votes=1_000_000),
+}
+
+TRUNCATE_TABLES = """TRUNCATE movies, users, reviews, polls, options, votes, option_vote_counts, poll_vote_counts,
+    vote_rollups_hourly, vote_rollups_daily, poll_voters RESTART IDENTITY CASCADE;"""
+COPY_VOTES = "COPY votes (username, option_id, vote_timestamp) FROM STDIN WITH (FORMAT csv);"
+COPY_USERS = "COPY users (username) FROM STDIN WITH (FORMAT csv);"
+COPY_REVIEWS = "COPY reviews (user_username, movie_id, review, created_at) FROM STDIN WITH (FORMAT csv);"
+COPY_POLLS = "COPY polls (title, owner) FROM STDIN WITH (FORMAT csv);"
+COPY_OPTIONS = "COPY options (option_text, poll_id) FROM STDIN WITH (FORMAT csv);"
+ANALYZE = "ANALYZE;"
+
+TITLE_WORDS = [
+    "Silent", "River", "Night", "Storm", "Last", "Kingdom", "Shadow", "Summer", "Iron", "Garden",
+    "Broken", "Star", "Hidden", "City", "Ghost", "Winter", "Golden", "Road", "Lost", "Empire",
+    "Dark", "Ocean", "Secret", "Fire", "Wild", "Heart", "Red", "Mountain", "Glass", "Dream",
+]
+OPTION_WORDS = ["Yes", "No", "Maybe", "Red", "Blue", "Green", "Cats", "Dogs", "Tea", "Coffee", "Books", "Films"]
+
+
+def benchmark_database_uri() -> str:
+    """BENCHMARK_DATABASE_URI, also set as DATABASE_URI so the connection pool uses it"""
+    database_uri = os.environ.get("BENCHMARK_DATABASE_URI")
+    if not database_uri:
+        raise SystemExit("Set BENCHMARK_DATABASE_URI to a scratch database; seeding empties every app table")
+    os.environ["DATABASE_URI"] = database_uri
+    return database_uri
+
+
+class Zipf:
+    """Draws indexes 0..n-1 where index k is picked in proportion to 1 / (k + 1) ** skew"""
+
+    def __init__(self, n: int, rng: random.Random, skew: float = SKEW):
+        self.rng = rng
+        self.cumulative = list(itertools.accumulate(1 / (k + 1) ** skew for k in range(n)))
+
+    def __call__(self) -> int:
+        return bisect.bisect(self.cumulative, self.rng.random() * self.cumulative[-1])
+
+
+def _copy(cursor, query: str, rows: Sequence[Sequence]):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(query, buffer)
+
+
+def usernames(size: DatasetSize) -> List[str]:
+    return [f"user{number}" for number in range(1, size.users + 1)]
+
+
+def movie_rows(size: DatasetSize, rng: random.Random, now: float):
+    """(title, release_timestamp, trailer_url); a tenth are still to be released"""
+    for number in range(1, size.movies + 1):
+        title = f"{rng.choice(TITLE_WORDS)} {rng.choice(TITLE_WORDS)} {number}"
+        release_timestamp = now + rng.uniform(-40 * YEAR, 4.5 * YEAR)
+        yield title, release_timestamp, f"https://example.com/trailers/{number}"
+
+
+def seed(connection, size: DatasetSize, rng_seed: int = SEED) -> Dict[str, float]:
+    """Empties the app tables and loads a synthetic dataset of the given size.
+    Returns the seconds each table took to load"""
+    rng = random.Random(rng_seed)
+    now = time.time()
+    timings = {}
+    names = usernames(size)
+    pick_user = Zipf(size.users, rng)
+
+    migrations.migrate(connection)
+    poll_database.create_vote_partitions(connection)
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute(TRUNCATE_TABLES)
+
+    started = time.perf_counter()
+    movies = list(movie_rows(size, rng, now))
+    for start in range(0, len(movies), BATCH_SIZE):
+        movie_database.import_movies(connection, movies[start:start + BATCH_SIZE])
+    timings["movies"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    pick_movie = Zipf(size.movies, rng)
+    with connection:
+        with connection.cursor() as cursor:
+            _copy(cursor, COPY_USERS, [(name, ) for name in names])
+            _copy(cursor, COPY_REVIEWS, [       # written in order over the last year
+                (names[pick_user()], pick_movie() + 1, f"Review {number}: {rng.choice(TITLE_WORDS).lower()} enough",
+                 now - YEAR + YEAR * number / size.reviews)
+                for number in range(size.reviews)
+            ])
+    timings["users_and_reviews"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with connection:
+        with connection.cursor() as cursor:
+            _copy(cursor, COPY_POLLS, [(f"Poll {number}", names[pick_user()]) for number in range(1, size.polls + 1)])
+            _copy(cursor, COPY_OPTIONS, [
+                (f"{rng.choice(OPTION_WORDS)} {option}", poll_id)
+                for poll_id in range(1, size.polls + 1)
+                for option in range(1, size.options_per_poll + 1)
+            ])
+    timings["polls_and_options"] = time.perf_counter() - started
+
+    # options are numbered poll by poll, so a poll's k-th option has id (poll - 1) * per_poll + k.
+    # Votes are copied straight into votes, as history from before one vote per user per poll
+    # (popular users vote many times in popular polls), and poll_voters is filled in from them
+    started = time.perf_counter()
+    pick_poll = Zipf(size.polls, rng)
+    pick_option = Zipf(size.options_per_poll, rng, skew=0.8)
+    for start in range(0, size.votes, BATCH_SIZE):
+        with connection:
+            with connection.cursor() as cursor:
+                _copy(cursor, COPY_VOTES, [
+                    (names[pick_user()], pick_poll() * size.options_per_poll + pick_option() + 1,
+                     int(now - TIMESTAMP_SPAN * rng.random() ** 2))     # recent days are busier
+                    for _ in range(min(BATCH_SIZE, size.votes - start))
+                ])
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute(poll_database.INSERT_POLL_VOTERS_FROM_VOTES)
+    timings["votes"] = time.perf_counter() - started
+
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute(ANALYZE)     # plans for the new row counts
+    return timings
+
+
+def size_from_args(args) -> DatasetSize:
+    base = SIZES[args.size]
+    return base._replace(**{field: getattr(args, field) for field in DatasetSize._fields
+                            if getattr(args, field) is not None})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed BENCHMARK_DATABASE_URI with a synthetic dataset")
+    parser.add_argument("--size", choices=list(SIZES), default="small")
+    for field in DatasetSize._fields:
+        parser.add_argument(f"--{field.replace('_', '-')}", dest=field, type=int, default=None)
+    parser.add_argument("--seed", type=int, default=SEED)
+    args = parser.parse_args()
+
+    benchmark_database_uri()       # the pool connects lazily, so this is in time
+    dataset_size = size_from_args(args)
+    with get_connection() as connection:
+        for table, seconds in seed(connection, dataset_size, args.seed).items():
+            print(f"{table:<20}{seconds:>8.2f}s")
+    print(f"Seeded {dataset_size}")
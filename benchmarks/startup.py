@@ -0,0 +1,80 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Optional
+
+
+# Measures how long the app takes to import its menus, in a fresh interpreter each run,
+# and checks nothing slow is loaded or connected before the user picks an option.
+#   python -m benchmarks.startup [--runs 5] [--budget-ms 500] [--baseline startup.json] [--save startup.json]
+# Exits with 1 when the import time is over budget, more than 20% slower than the baseline,
+# or a deferred module/connection pool was created at import.
+
+RUNS = 5
+REGRESSION_TOLERANCE = 1.2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# run in the child interpreter; prints the import time and what got loaded as JSON
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import movies.movie_functions, polls.poll_functions
+elapsed = time.perf_counter() - started
+import connection_pool
+print(json.dumps({
+    "import_ms": elapsed * 1000,
+    "loaded": [name for name in ("matplotlib", "pytz", "webbrowser") if name in sys.modules],
+    "pool_created": connection_pool.pool is not None,
+}))
+"""
+
+
+def _probe() -> dict:
+    environment = dict(os.environ)
+    environment.setdefault("DATABASE_URI", "postgresql://localhost/startup-benchmark")     # never connected to
+    output = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=environment,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output)
+
+
+def run(runs: int = RUNS, budget_ms: Optional[float] = None, baseline: Optional[str] = None,
+        save: Optional[str] = None) -> bool:
+    results = [_probe() for _ in range(runs)]
+    best = min(result["import_ms"] for result in results)
+    passed = True
+
+    print(f"menu import time: {best:.1f}ms (best of {runs})")
+    loaded = sorted({name for result in results for name in result["loaded"]})
+    if loaded:
+        print(f"FAIL: loaded at import: {', '.join(loaded)}")
+        passed = False
+    if any(result["pool_created"] for result in results):
+        print("FAIL: connection pool created at import")
+        passed = False
+    if budget_ms is not None and best > budget_ms:
+        print(f"FAIL: over the {budget_ms:.0f}ms budget")
+        passed = False
+    if baseline is not None:
+        with open(baseline) as file:
+            baseline_ms = json.load(file)["import_ms"]
+        print(f"baseline: {baseline_ms:.1f}ms")
+        if best > baseline_ms * REGRESSION_TOLERANCE:
+            print(f"FAIL: more than {(REGRESSION_TOLERANCE - 1) * 100:.0f}% slower than the baseline")
+            passed = False
+    if save is not None:
+        with open(save, "w") as file:
+            json.dump({"import_ms": best}, file)
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the app's startup import time")
+    parser.add_argument("--runs", type=int, default=RUNS)
+    parser.add_argument("--budget-ms", type=float, default=None)
+    parser.add_argument("--baseline", default=None, help="JSON file saved by an earlier --save")
+    parser.add_argument("--save", default=None, help="write this run's result as a baseline")
+    args = parser.parse_args()
+    sys.exit(0 if run(args.runs, args.budget_ms, args.baseline, args.save) else 1)
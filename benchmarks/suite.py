@@ -0,0 +1,240 @@
+import argparse
+import datetime
+import io
+import itertools
+import json
+import platform
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+import cache
+from benchmarks import seed
+from connection_pool import get_connection
+from movies import movie_database
+from polls import poll_database
+from polls.Models.option import Option
+from polls.Models.poll import Poll
+
+
+# Times every public function in movie_database and poll_database, and every Poll / Option
+# model method, against synthetic datasets of several sizes seeded by benchmarks.seed.
+#   python -m benchmarks.suite [--sizes small,medium] [--repeat 20] [--output results.json]
+#                              [--baseline results.json] [--tolerance 1.25]
+# Caches are cleared before every timed call, so the numbers are database round trips;
+# the "(cached)" cases time the same reads served from the caches.
+# With --baseline, exits with 1 if any case's median is over tolerance times the baseline's.
+# Runs against BENCHMARK_DATABASE_URI, which is emptied and reseeded for each size.
+
+REPEAT = 20
+WARMUP = 2
+TOLERANCE = 1.25
+
+Case = Tuple[str, Callable[[], object], bool]       # name, call, served from cache
+
+
+def _consume(result):
+    """generators only run their query once iterated"""
+    return list(result) if hasattr(result, "__next__") else result
+
+
+def cases(connection, size: seed.DatasetSize) -> List[Case]:
+    """Every function and model method, with arguments that hit the popular rows the way
+    the seeded traffic does. Write cases add a few rows per call on top of the dataset"""
+    numbers = itertools.count(1)
+    popular_poll, popular_option = 1, 1
+    popular_movie, popular_user = 1, "user1"
+    popular_title = movie_database.get_movie_title(connection, popular_movie)
+    search_word = seed.TITLE_WORDS[0]
+    poll, option = Poll.get(popular_poll), Option.get(popular_option)
+
+    def new_movies():
+        return [(f"Benchmark Import {next(numbers)}", time.time(), "https://example.com") for _ in range(100)]
+
+    def new_votes():
+        return [(f"benchmark{next(numbers)}", popular_option, int(time.time())) for _ in range(100)]
+
+    return [
+        # movie_database
+        ("movie_database.add_movie", lambda: movie_database.add_movie(
+            connection, f"Benchmark Movie {next(numbers)}", time.time(), "https://example.com"), False),
+        ("movie_database.import_movies[100]", lambda: movie_database.import_movies(connection, new_movies()), False),
+        ("movie_database.add_user", lambda: movie_database.add_user(connection, f"benchmark{next(numbers)}"), False),
+        ("movie_database.review_movie", lambda: movie_database.review_movie(
+            connection, popular_user, popular_movie, "benchmark review"), False),
+        ("movie_database.get_movies", lambda: movie_database.get_movies(connection), False),
+        ("movie_database.get_movies[upcoming]", lambda: movie_database.get_movies(connection, upcoming=True), False),
+        ("movie_database.iter_movies", lambda: movie_database.iter_movies(connection), False),
+        ("movie_database.get_movies_page", lambda: movie_database.get_movies_page(connection, 20), False),
+        ("movie_database.get_reviewed_movies", lambda: movie_database.get_reviewed_movies(
+            connection, popular_user), False),
+        ("movie_database.get_movie_reviews", lambda: movie_database.get_movie_reviews(
+            connection, popular_movie), False),
+        ("movie_database.get_user_review_feed", lambda: movie_database.get_user_review_feed(
+            connection, popular_user), False),
+        ("movie_database.get_user_reviews_since", lambda: movie_database.get_user_reviews_since(
+            connection, popular_user, f"{time.time() - 86400!r}:0"), False),
+        ("movie_database.get_movie_review_feed", lambda: movie_database.get_movie_review_feed(
+            connection, popular_movie), False),
+        ("movie_database.get_movie_reviews_since", lambda: movie_database.get_movie_reviews_since(
+            connection, popular_movie, f"{time.time() - 86400!r}:0"), False),
+        ("movie_database.get_movie_title", lambda: movie_database.get_movie_title(connection, popular_movie), False),
+        ("movie_database.get_movie_title (cached)", lambda: movie_database.get_movie_title(
+            connection, popular_movie), True),
+        ("movie_database.get_trailer_url", lambda: movie_database.get_trailer_url(
+            connection, popular_title), False),
+        ("movie_database.get_trailer_url (cached)", lambda: movie_database.get_trailer_url(
+            connection, popular_title), True),
+        ("movie_database.search_movie", lambda: movie_database.search_movie(connection, search_word), False),
+        ("movie_database.autocomplete_movie", lambda: movie_database.autocomplete_movie(
+            connection, search_word[:3]), False),
+        ("movie_database.iter_search_movie", lambda: movie_database.iter_search_movie(connection, search_word), False),
+
+        # poll_database
+        ("poll_database.create_poll", lambda: poll_database.create_poll(connection, "Benchmark", popular_user), False),
+        ("poll_database.get_polls", lambda: poll_database.get_polls(connection), False),
+        ("poll_database.get_poll", lambda: poll_database.get_poll(connection, popular_poll), False),
+        ("poll_database.get_poll (cached)", lambda: poll_database.get_poll(connection, popular_poll), True),
+        ("poll_database.get_poll_title", lambda: poll_database.get_poll_title(connection, popular_poll), False),
+        ("poll_database.get_latest_poll", lambda: poll_database.get_latest_poll(connection), False),
+        ("poll_database.get_poll_options", lambda: poll_database.get_poll_options(connection, popular_poll), False),
+        ("poll_database.get_option", lambda: poll_database.get_option(connection, popular_option), False),
+        ("poll_database.add_option", lambda: poll_database.add_option(connection, "Benchmark", size.polls), False),
+        ("poll_database.get_existing_option_ids[100]", lambda: poll_database.get_existing_option_ids(
+            connection, range(1, 101)), False),
+        ("poll_database.add_vote", lambda: poll_database.add_vote(
+            connection, f"benchmark{next(numbers)}", time.time(), popular_option), False),
+        ("poll_database.add_vote (repeat)", lambda: poll_database.add_vote(
+            connection, popular_user, time.time(), popular_option), False),
+        ("poll_database.copy_votes[100]", lambda: poll_database.copy_votes(connection, new_votes()), False),
+        ("poll_database.get_votes_for_option", lambda: poll_database.get_votes_for_option(
+            connection, popular_option), False),
+        ("poll_database.get_poll_tally", lambda: poll_database.get_poll_tally(connection, popular_poll), False),
+        ("poll_database.get_poll_tally (cached)", lambda: poll_database.get_poll_tally(connection, popular_poll), True),
+        ("poll_database.iter_poll_vote_log", lambda: poll_database.iter_poll_vote_log(connection, popular_poll), False),
+        ("poll_database.export_poll_vote_log", lambda: poll_database.export_poll_vote_log(
+            connection, popular_poll, io.StringIO()), False),
+        ("poll_database.draw_winners[10]", lambda: poll_database.draw_winners(connection, popular_poll, 10, 1), False),
+        ("poll_database.get_polls_vote_count", lambda: poll_database.get_polls_vote_count(connection), False),
+        ("poll_database.get_poll_option_votes", lambda: poll_database.get_poll_option_votes(
+            connection, popular_poll), False),
+        ("poll_database.get_trending_polls[day]", lambda: poll_database.get_trending_polls(connection, "day"), False),
+        ("poll_database.get_trending_polls[week]", lambda: poll_database.get_trending_polls(
+            connection, "week"), False),
+        ("poll_database.get_poll_vote_rate[day]", lambda: poll_database.get_poll_vote_rate(
+            connection, popular_poll, "day"), False),
+        ("poll_database.get_poll_vote_rate[month]", lambda: poll_database.get_poll_vote_rate(
+            connection, popular_poll, "month"), False),
+        ("poll_database.get_vote_count_drift", lambda: poll_database.get_vote_count_drift(connection), False),
+        ("poll_database.rebuild_vote_counts", lambda: poll_database.rebuild_vote_counts(connection), False),
+
+        # models, which check out their own pooled connections
+        ("Poll.save", lambda: Poll("Benchmark", popular_user).save(), False),
+        ("Poll.add_option", lambda: Poll.get(size.polls).add_option("Benchmark"), False),
+        ("Poll.options", lambda: poll.options, False),
+        ("Poll.options (cached)", lambda: poll.options, True),
+        ("Poll.tally", lambda: poll.tally(), False),
+        ("Poll.tally (cached)", lambda: poll.tally(), True),
+        ("Poll.draw_winners[10]", lambda: poll.draw_winners(10, seed=1), False),
+        ("Poll.get", lambda: Poll.get(popular_poll), False),
+        ("Poll.get (cached)", lambda: Poll.get(popular_poll), True),
+        ("Poll.all", lambda: Poll.all(), False),
+        ("Poll.latest", lambda: Poll.latest(), False),
+        ("Option.save", lambda: Option("Benchmark", size.polls).save(), False),
+        ("Option.get", lambda: Option.get(popular_option), False),
+        ("Option.get (cached)", lambda: Option.get(popular_option), True),
+        ("Option.vote", lambda: option.vote(f"benchmark{next(numbers)}"), False),
+        ("Option.draw_winners[10]", lambda: option.draw_winners(10, seed=1), False),
+        ("Option.votes", lambda: option.votes, False),
+    ]
+
+
+def _clear_caches():
+    for named_cache in cache.CACHES.values():
+        named_cache.clear()
+
+
+def time_case(call: Callable[[], object], cached: bool, repeat: int = REPEAT) -> Dict[str, float]:
+    """milliseconds per call over repeat calls, after WARMUP untimed ones"""
+    timings = []
+    for run in range(WARMUP + repeat):
+        if not cached:
+            _clear_caches()
+        started = time.perf_counter()
+        _consume(call())
+        if run >= WARMUP:
+            timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        "median_ms": statistics.median(timings),
+        "mean_ms": statistics.mean(timings),
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "min_ms": timings[0],
+        "calls": repeat,
+    }
+
+
+def run(sizes: List[str], repeat: int = REPEAT, rng_seed: int = seed.SEED) -> dict:
+    results = {
+        "created_at": datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "seed": rng_seed,
+        "repeat": repeat,
+        "sizes": {},
+    }
+    for size_name in sizes:
+        size = seed.SIZES[size_name]
+        with get_connection() as connection:
+            print(f"-- {size_name}: seeding {size}")
+            seed.seed(connection, size, rng_seed)
+            _clear_caches()
+            size_results = {"dataset": size._asdict(), "cases": {}}
+            for name, call, cached in cases(connection, size):
+                timing = time_case(call, cached, repeat)
+                size_results["cases"][name] = timing
+                print(f"{name:<48}{timing['median_ms']:>10.3f}ms{timing['p95_ms']:>10.3f}ms p95")
+        results["sizes"][size_name] = size_results
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> List[str]:
+    """Cases whose median is more than tolerance times the baseline's, at sizes both ran"""
+    regressions = []
+    for size_name, size_results in results["sizes"].items():
+        baseline_cases = baseline["sizes"].get(size_name, {}).get("cases", {})
+        for name, timing in size_results["cases"].items():
+            before = baseline_cases.get(name)
+            if before and timing["median_ms"] > before["median_ms"] * tolerance:
+                regressions.append(f"{size_name} {name}: {before['median_ms']:.3f}ms -> {timing['median_ms']:.3f}ms")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the data modules and models at several dataset sizes")
+    parser.add_argument("--sizes", default="small,medium", help=f"comma separated, from {', '.join(seed.SIZES)}")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--seed", type=int, default=seed.SEED)
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="results JSON from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args(argv)
+
+    seed.benchmark_database_uri()
+    results = run(args.sizes.split(","), args.repeat, args.seed)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No case slower than {args.tolerance:.2f}x the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
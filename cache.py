@@ -0,0 +1,95 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, NamedTuple
+
+
+# -- Read-through caches for data that rarely changes once created --
+# Each cache is a bounded LRU with its own TTL. Write paths invalidate the entries they
+# change; the TTL bounds how stale an entry can get when another process does the write.
+
+CACHE_ENABLED = os.environ.get("CACHE_ENABLED", "1") != "0"
+
+
+class CacheStats(NamedTuple):
+    size: int
+    hits: int
+    misses: int
+    evictions: int      # least recently used entries dropped to stay within maxsize
+    expirations: int    # entries found past their TTL
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire ttl seconds after being stored"""
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize if CACHE_ENABLED else 0
+        self.ttl = ttl
+        self._entries = OrderedDict()       # key -> (expires at, value), least recently used first
+        self._lock = threading.Lock()
+        self._hits = self._misses = self._evictions = self._expirations = 0
+        CACHES[name] = self
+
+    def get(self, key: Hashable, default=None, count_miss: bool = True):
+        """count_miss=False is for callers that follow a miss with a read-through
+        load, which counts the miss itself"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                self._expirations += 1
+                entry = None
+            if entry is None:
+                self._misses += count_miss
+                return default
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def get_or_load(self, key: Hashable, load: Callable[[], Any]):
+        """Cached value for key, calling load() on a miss. None results aren't cached"""
+        value = self.get(key)
+        if value is None:
+            value = load()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(len(self._entries), self._hits, self._misses, self._evictions, self._expirations)
+
+
+CACHES: Dict[str, TTLCache] = {}
+
+polls = TTLCache("polls", maxsize=1024, ttl=600)                # poll id -> poll row
+options = TTLCache("options", maxsize=4096, ttl=600)            # option id -> option row
+poll_options = TTLCache("poll_options", maxsize=1024, ttl=600)  # poll id -> option rows
+poll_tallies = TTLCache("poll_tallies", maxsize=1024, ttl=5)    # poll id -> tally rows, votes change them
+trending_polls = TTLCache("trending_polls", maxsize=64, ttl=30)     # (window, limit) -> trending poll rows
+movie_titles = TTLCache("movie_titles", maxsize=4096, ttl=3600)     # movie id -> title
+trailer_urls = TTLCache("trailer_urls", maxsize=4096, ttl=3600)     # lower case title -> trailer url row
+
+
+def get_cache_stats() -> Dict[str, CacheStats]:
+    return {name: cache.stats() for name, cache in CACHES.items()}
@@ -0,0 +1,390 @@
+import argparse
+import contextlib
+import datetime
+import os
+import secrets
+import shlex
+import sys
+import time
+from typing import Dict, Iterable, List, Optional
+import cache
+import instrumentation
+import migrations
+import vote_filter
+from connection_pool import get_connection
+from movies import movie_database
+from polls import poll_database
+
+
+# -- Non-interactive commands --
+# Every menu action as a subcommand, for automation instead of piping answers into input():
+#   python app.py vote 3 alice
+#   python app.py create-poll "Best film of 2020" alice --option Tenet --option Soul
+# and a script mode that runs a file of commands (one per line, shell quoting, # comments)
+# over one connection, committing every --batch-size commands:
+#   python app.py script votes.txt --batch-size 500 [--continue-on-error] [--quiet]
+# Script mode ends with each command's throughput.
+
+BATCH_SIZE = 100
+
+
+class BatchConnection:
+    """Stands in for the connection in the data modules, whose `with connection:` blocks
+    would otherwise commit after every call, so the script runner decides when to commit"""
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __getattr__(self, attribute):
+        return getattr(self._connection, attribute)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+# -- Movie commands --
+
+def add_movie(connection, args):
+    timestamp = datetime.datetime.strptime(args.release_date, "%d-%m-%Y").timestamp()
+    movie_database.add_movie(connection, args.title, timestamp, args.trailer_url)
+
+
+def list_movies(connection, args):
+    for _id, title, release_timestamp, _ in movie_database.iter_movies(connection, args.upcoming):
+        print(f"{_id}\t{title}\t{datetime.datetime.fromtimestamp(release_timestamp):%Y-%m-%d}")
+
+
+def search_movie(connection, args):
+    for _id, title, release_timestamp, _ in movie_database.iter_search_movie(connection, args.text, args.limit):
+        print(f"{_id}\t{title}\t{datetime.datetime.fromtimestamp(release_timestamp):%Y-%m-%d}")
+
+
+def movie_reviews(connection, args):
+    for _, username, review in movie_database.get_movie_reviews(connection, args.movie_id):
+        print(f"{username}\t{review}")
+
+
+def review_movie(connection, args):
+    movie_database.review_movie(connection, args.username, args.movie_id, args.review)
+
+
+def reviewed_movies(connection, args):
+    for title, _, review in movie_database.get_reviewed_movies(connection, args.username):
+        print(f"{title}\t{review}")
+
+
+def trailer_url(connection, args):
+    url = movie_database.get_trailer_url(connection, args.title)
+    if url is None:
+        raise LookupError(f"No movie called '{args.title}'")
+    print(url[0])
+    if args.open:
+        import webbrowser
+        webbrowser.open(url[0], new=0, autoraise=True)
+
+
+def add_user(connection, args):
+    movie_database.add_user(connection, args.username)
+
+
+# -- Poll commands --
+
+def create_poll(connection, args):
+    poll_id = poll_database.create_poll(connection, args.title, args.owner)
+    for option_text in args.option:
+        poll_database.add_option(connection, option_text, poll_id)
+    print(poll_id)
+
+
+def list_polls(connection, args):
+    for poll_id, title, owner in poll_database.get_polls(connection):
+        print(f"{poll_id}\t{title}\t{owner}")
+
+
+def vote(connection, args):
+    option = poll_database.get_option(connection, args.option_id)      # cached, and add_vote needs its poll too
+    if option is None:
+        raise LookupError(f"No option {args.option_id}")
+    if not poll_database.add_vote(connection, args.username, time.time(), args.option_id, option[2]):
+        raise ValueError(f"{args.username} has already voted in this poll")
+    cache.poll_tallies.invalidate(option[2])
+
+
+def poll_votes(connection, args):
+    for _, option_text, votes, total_votes in poll_database.get_poll_tally(connection, args.poll_id):
+        percentage = votes / total_votes * 100 if total_votes else 0
+        print(f"{option_text}\t{votes}\t{percentage:.2f}%")
+    if args.export:
+        with open(args.export, "w", newline="") as file:
+            poll_database.export_poll_vote_log(connection, args.poll_id, file)
+    elif args.log:
+        for option_text, username, voted_at in poll_database.iter_poll_vote_log(connection, args.poll_id):
+            print(f"{option_text}\t{username}\t{voted_at}")
+
+
+def draw_winners(connection, args):
+    seed = secrets.randbits(32) if args.seed is None else args.seed
+    for username, option_id in poll_database.draw_winners(connection, args.poll_id, args.winners, seed, args.option):
+        print(f"{username}\t{option_id}")
+    print(f"seed\t{seed}")
+
+
+def polls_bar_chart(connection, args):
+    from polls import charts
+    image = charts.render_polls_bar_chart(poll_database.get_polls_vote_count(connection), _image_format(args.output))
+    with open(args.output, "wb") as file:
+        file.write(image)
+
+
+def poll_chart(connection, args):
+    from polls import charts
+    title = poll_database.get_poll_title(connection, args.poll_id)
+    tally = poll_database.get_poll_tally(connection, args.poll_id)
+    image = charts.render_poll_chart(args.poll_id, title, tally, _image_format(args.output))
+    if image is None:
+        raise ValueError("This poll has no votes to chart yet")
+    with open(args.output, "wb") as file:
+        file.write(image)
+
+
+def trending_polls(connection, args):
+    for poll_id, title, votes in poll_database.get_trending_polls(connection, args.window, args.limit):
+        print(f"{poll_id}\t{title}\t{votes}")
+
+
+def vote_rate_chart(connection, args):
+    from polls import charts
+    title = poll_database.get_poll_title(connection, args.poll_id)
+    option_texts = {option[0]: option[1] for option in poll_database.get_poll_options(connection, args.poll_id)}
+    rates = poll_database.get_poll_vote_rate(connection, args.poll_id, args.window)
+    bucket_starts, series = charts.vote_rate_series(rates, args.window)
+    image = charts.render_vote_rate_chart(bucket_starts, series, option_texts, title, args.window,
+                                          _image_format(args.output))
+    with open(args.output, "wb") as file:
+        file.write(image)
+
+
+def _image_format(path: str) -> str:
+    return "svg" if path.endswith(".svg") else "png"
+
+
+# -- Parsing --
+
+class ScriptLineParser(argparse.ArgumentParser):
+    """Raises ValueError for a malformed script line instead of exiting, so the line fails
+    like any other command"""
+
+    def exit(self, status=0, message=None):
+        raise ValueError((message or f"exited with status {status}").strip())
+
+    def error(self, message):
+        raise ValueError(message)
+
+
+def build_parser(parser_class=argparse.ArgumentParser) -> argparse.ArgumentParser:
+    parser = parser_class(prog="app.py", description="Movie review and poll database")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("add-movie", help="movie menu 1")
+    command.add_argument("title")
+    command.add_argument("release_date", help="dd-mm-yyyy")
+    command.add_argument("trailer_url")
+    command.set_defaults(run=add_movie)
+
+    command = commands.add_parser("movies", help="movie menu 2 and 3")
+    command.add_argument("--upcoming", action="store_true")
+    command.set_defaults(run=list_movies)
+
+    command = commands.add_parser("search-movie", help="movie menu 4")
+    command.add_argument("text")
+    command.add_argument("--limit", type=int, default=movie_database.SEARCH_LIMIT)
+    command.set_defaults(run=search_movie)
+
+    command = commands.add_parser("movie-reviews", help="movie menu 5")
+    command.add_argument("movie_id", type=int)
+    command.set_defaults(run=movie_reviews)
+
+    command = commands.add_parser("review-movie", help="movie menu 6")
+    command.add_argument("username")
+    command.add_argument("movie_id", type=int)
+    command.add_argument("review")
+    command.set_defaults(run=review_movie)
+
+    command = commands.add_parser("reviewed-movies", help="movie menu 7")
+    command.add_argument("username")
+    command.set_defaults(run=reviewed_movies)
+
+    command = commands.add_parser("trailer-url", help="movie menu 8")
+    command.add_argument("title")
+    command.add_argument("--open", action="store_true", help="open it in the browser")
+    command.set_defaults(run=trailer_url)
+
+    command = commands.add_parser("add-user", help="movie menu 9")
+    command.add_argument("username")
+    command.set_defaults(run=add_user)
+
+    command = commands.add_parser("create-poll", help="poll menu 1")
+    command.add_argument("title")
+    command.add_argument("owner")
+    command.add_argument("--option", action="append", default=[], help="repeat for each option")
+    command.set_defaults(run=create_poll)
+
+    command = commands.add_parser("polls", help="poll menu 2")
+    command.set_defaults(run=list_polls)
+
+    command = commands.add_parser("vote", help="poll menu 3")
+    command.add_argument("option_id", type=int)
+    command.add_argument("username")
+    command.set_defaults(run=vote)
+
+    command = commands.add_parser("poll-votes", help="poll menu 4")
+    command.add_argument("poll_id", type=int)
+    command.add_argument("--log", action="store_true", help="also print the vote log")
+    command.add_argument("--export", default=None, help="write the vote log to this CSV file")
+    command.set_defaults(run=poll_votes)
+
+    command = commands.add_parser("draw-winners", help="poll menu 5")
+    command.add_argument("poll_id", type=int)
+    command.add_argument("--option", type=int, default=None, help="draw from this option only")
+    command.add_argument("--winners", type=int, default=1)
+    command.add_argument("--seed", type=int, default=None)
+    command.set_defaults(run=draw_winners)
+
+    command = commands.add_parser("polls-bar-chart", help="poll menu 6, saved to a .png or .svg file")
+    command.add_argument("output")
+    command.set_defaults(run=polls_bar_chart)
+
+    command = commands.add_parser("poll-chart", help="poll menu 7, saved to a .png or .svg file")
+    command.add_argument("poll_id", type=int)
+    command.add_argument("output")
+    command.set_defaults(run=poll_chart)
+
+    command = commands.add_parser("trending", help="poll menu 8")
+    command.add_argument("--window", choices=list(poll_database.WINDOWS), default="day")
+    command.add_argument("--limit", type=int, default=poll_database.TRENDING_LIMIT)
+    command.set_defaults(run=trending_polls)
+
+    command = commands.add_parser("vote-rate-chart", help="poll menu 9, saved to a .png or .svg file")
+    command.add_argument("poll_id", type=int)
+    command.add_argument("output")
+    command.add_argument("--window", choices=list(poll_database.WINDOWS), default="day")
+    command.set_defaults(run=vote_rate_chart)
+
+    command = commands.add_parser("script", help="run a file of commands over one connection")
+    command.add_argument("file", help="- reads the commands from stdin")
+    command.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="commands per transaction")
+    command.add_argument("--continue-on-error", action="store_true",
+                         help="skip failing commands instead of stopping (each runs in a savepoint)")
+    command.add_argument("--quiet", action="store_true", help="don't print command output")
+    return parser
+
+
+# -- Script mode --
+
+class CommandStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+
+def _script_lines(lines: Iterable[str]) -> Iterable[List[str]]:
+    for line in lines:
+        words = shlex.split(line, comments=True)
+        if words:
+            yield words
+
+
+def run_script(connection, lines: Iterable[str], batch_size: int = BATCH_SIZE,
+               continue_on_error: bool = False) -> Dict[str, CommandStats]:
+    """Runs each line as a command on the one connection, committing every batch_size
+    commands. Returns each command's count, errors and time spent"""
+    parser = build_parser(ScriptLineParser)
+    batch_connection = BatchConnection(connection)
+    stats: Dict[str, CommandStats] = {}
+    pending = 0
+
+    try:
+        for line_number, words in enumerate(_script_lines(lines), start=1):
+            if words[0] == "script":
+                raise ValueError(f"line {line_number}: scripts can't run other scripts")
+            command_stats = stats.setdefault(words[0], CommandStats())
+
+            started = time.perf_counter()
+            in_savepoint = False
+            try:
+                args = parser.parse_args(words)     # a malformed line fails here, as its command
+                with instrumentation.action(args.command):
+                    if continue_on_error:
+                        with connection.cursor() as cursor:
+                            cursor.execute("SAVEPOINT script_command;")
+                        in_savepoint = True
+                    args.run(batch_connection, args)
+                    if continue_on_error:
+                        with connection.cursor() as cursor:
+                            cursor.execute("RELEASE SAVEPOINT script_command;")
+            except Exception as error:
+                command_stats.errors += 1
+                print(f"line {line_number}: {words[0]} failed: {error}", file=sys.stderr)
+                if not continue_on_error:
+                    raise
+                if in_savepoint:
+                    with connection.cursor() as cursor:
+                        cursor.execute("ROLLBACK TO SAVEPOINT script_command;")
+            finally:
+                command_stats.count += 1
+                command_stats.seconds += time.perf_counter() - started
+
+            pending += 1
+            if pending >= batch_size:
+                connection.commit()
+                pending = 0
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        for named_cache in cache.CACHES.values():      # may hold rows from the rolled back batch
+            named_cache.clear()
+        vote_filter.recent_voters.clear()       # and voters whose votes were rolled back
+        raise
+    return stats
+
+
+def print_throughput(stats: Dict[str, CommandStats], elapsed: float):
+    print(f"{'command':<20}{'runs':>8}{'errors':>8}{'per sec':>12}{'avg ms':>10}", file=sys.stderr)
+    for name, command_stats in sorted(stats.items()):
+        per_second = command_stats.count / command_stats.seconds if command_stats.seconds else 0
+        average_ms = command_stats.seconds / command_stats.count * 1000
+        print(f"{name:<20}{command_stats.count:>8}{command_stats.errors:>8}{per_second:>12.1f}{average_ms:>10.2f}",
+              file=sys.stderr)
+    total = sum(command_stats.count for command_stats in stats.values())
+    print(f"{total} commands in {elapsed:.2f}s ({total / elapsed if elapsed else 0:.1f}/s)", file=sys.stderr)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    migrations.ensure_schema()
+    with get_connection() as connection:
+        try:
+            if args.command != "script":
+                with instrumentation.action(args.command):
+                    args.run(connection, args)
+                return 0
+
+            started = time.perf_counter()
+            with contextlib.ExitStack() as stack:
+                file = sys.stdin if args.file == "-" else stack.enter_context(open(args.file))
+                if args.quiet:
+                    stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+                stats = run_script(connection, file, args.batch_size, args.continue_on_error)
+            print_throughput(stats, time.perf_counter() - started)
+            return 0
+        except (LookupError, ValueError) as error:
+            print(f"Error: {error}", file=sys.stderr)
+            return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
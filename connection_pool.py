@@ -1,27 +1,313 @@
+import itertools
 import os
+import threading
+import time
+from collections import deque
 from contextlib import contextmanager
-from psycopg2.pool import SimpleConnectionPool
+from contextvars import ContextVar
+from typing import List, NamedTuple, Optional
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.pool import PoolError
 from dotenv import load_dotenv
+import instrumentation
+import storage
 
 
 # -- Setting the PostGreSQL connection --
 load_dotenv()
-database_uri = os.environ["DATABASE_URI"]
+
+POOL_MIN_CONNECTIONS = int(os.environ.get("DATABASE_POOL_MIN", 1))
+POOL_MAX_CONNECTIONS = int(os.environ.get("DATABASE_POOL_MAX", 10))
+POOL_TIMEOUT = float(os.environ.get("DATABASE_POOL_TIMEOUT", 30))     # seconds to wait for a free connection
+POOL_MAX_LIFETIME = float(os.environ.get("DATABASE_POOL_MAX_LIFETIME", 1800))      # seconds before a connection is replaced
+POOL_VALIDATE_AFTER = float(os.environ.get("DATABASE_POOL_VALIDATE_AFTER", 30))    # idle seconds before a checkout pings it
+
+RATE_WINDOW = 60       # seconds of checkouts averaged for checkouts_per_second
+
+# Read-only work can go to replicas: DATABASE_REPLICA_URIS is a comma separated list of their DSNs.
+# Each read picks the replica with the fewest connections in use ("least_busy") or the next one in
+# turn ("round_robin"). After a session (a thread, e.g. one API client connection) uses the
+# primary, its reads stay on the primary for DATABASE_READ_YOUR_WRITES seconds (0 turns it off)
+# so it sees what it just wrote despite replication lag.
+REPLICA_SELECTION = os.environ.get("DATABASE_REPLICA_SELECTION", "least_busy")
+READ_YOUR_WRITES = float(os.environ.get("DATABASE_READ_YOUR_WRITES", 5))
+REPLICA_RETRY_AFTER = 30       # seconds a replica that refused a connection is skipped for
+
+
+class PoolStats(NamedTuple):
+    in_use: int
+    idle: int
+    waiting: int
+    checkouts: int
+    checkouts_per_second: float
+    total_wait_seconds: float
+    max_wait_seconds: float
+    timeouts: int
+    replaced: int       # stale connections found on checkout and reconnected
+    recycled: int       # connections closed for reaching the max lifetime
 
 
 #  -- Connections Setup --
 
+class ConnectionPool:
+    """Thread-safe pool of PostGreSQL connections.
+
+    When every connection is in use a checkout waits (up to timeout seconds) for one to be
+    put back, rather than failing straight away. Connections idle for a while are pinged
+    before being handed out and connections older than max_lifetime are closed on return,
+    so a database restart or failover doesn't leave dead connections in the pool."""
+
+    def __init__(self, dsn: str, minconn: int = POOL_MIN_CONNECTIONS, maxconn: int = POOL_MAX_CONNECTIONS,
+                 timeout: float = POOL_TIMEOUT, max_lifetime: float = POOL_MAX_LIFETIME,
+                 validate_after: float = POOL_VALIDATE_AFTER):
+        self.dsn = dsn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.validate_after = validate_after
+
+        self._condition = threading.Condition()
+        self._idle = deque()        # (connection, returned at), most recently returned last
+        self._in_use = set()
+        self._created_at = {}       # connection -> time it was opened
+        self._opening = 0           # connections being opened outside the lock
+        self._waiting = 0
+        self._closed = False
+
+        self._checkouts = 0
+        self._checkouts_per_second = deque()       # [second, checkouts] for the last RATE_WINDOW seconds
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._timeouts = 0
+        self._replaced = 0
+        self._recycled = 0
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        connection = psycopg2.connect(self.dsn)
+        self._created_at[connection] = time.monotonic()
+        return connection
+
+    def _discard(self, connection):
+        self._created_at.pop(connection, None)
+        if not connection.closed:
+            connection.close()
+
+    def _is_expired(self, connection) -> bool:
+        return time.monotonic() - self._created_at.get(connection, 0) > self.max_lifetime
+
+    @staticmethod
+    def _is_alive(connection) -> bool:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self, timeout: Optional[float] = None):
+        """Checks out a connection, waiting up to timeout seconds for one to be free"""
+        started = time.monotonic()
+        deadline = started + (self.timeout if timeout is None else timeout)
+        connection, returned_at = None, None
+
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise PoolError("connection pool is closed")
+                if self._idle:
+                    connection, returned_at = self._idle.pop()
+                    break
+                if len(self._in_use) + self._opening < self.maxconn:
+                    self._opening += 1      # open a new one once the lock is released
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolError(f"no connection free after waiting {time.monotonic() - started:.1f}s")
+                self._waiting += 1
+                self._condition.wait(remaining)
+                self._waiting -= 1
+
+        replaced = False
+        try:
+            if connection is None:
+                connection = self._connect()
+            elif connection.closed or self._is_expired(connection) or (
+                    time.monotonic() - returned_at > self.validate_after and not self._is_alive(connection)):
+                self._discard(connection)
+                connection = self._connect()
+                replaced = True
+        except Exception:
+            with self._condition:
+                if returned_at is None:
+                    self._opening -= 1
+                self._condition.notify()
+            raise
+
+        waited = time.monotonic() - started
+        with self._condition:
+            if returned_at is None:
+                self._opening -= 1
+            self._in_use.add(connection)
+            self._replaced += replaced
+            self._record_checkout(waited)
+        return connection
+
+    def _record_checkout(self, waited: float):
+        self._checkouts += 1
+        self._total_wait += waited
+        self._max_wait = max(self._max_wait, waited)
+
+        second = int(time.monotonic())
+        if self._checkouts_per_second and self._checkouts_per_second[-1][0] == second:
+            self._checkouts_per_second[-1][1] += 1
+        else:
+            self._checkouts_per_second.append([second, 1])
+        while self._checkouts_per_second[0][0] <= second - RATE_WINDOW:
+            self._checkouts_per_second.popleft()
+
+    def putconn(self, connection):
+        """Returns a connection, rolling back anything left open and closing it if it's too old"""
+        keep = not connection.closed and not self._closed
+        if keep and connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                keep = False
+        expired = keep and self._is_expired(connection)
+
+        with self._condition:
+            self._in_use.discard(connection)
+            self._recycled += expired
+            if keep and not expired:
+                self._idle.append((connection, time.monotonic()))
+            else:
+                self._discard(connection)
+            self._condition.notify()
+
+    def closeall(self):
+        with self._condition:
+            self._closed = True
+            while self._idle:
+                self._discard(self._idle.pop()[0])
+            for connection in list(self._in_use):
+                self._discard(connection)
+            self._in_use.clear()
+            self._condition.notify_all()
+
+    def busy(self) -> int:
+        """connections in use or being opened, plus checkouts waiting for one"""
+        with self._condition:
+            return len(self._in_use) + self._opening + self._waiting
+
+    def stats(self) -> PoolStats:
+        with self._condition:
+            window_start = int(time.monotonic()) - RATE_WINDOW
+            recent = sum(count for second, count in self._checkouts_per_second if second > window_start)
+            return PoolStats(
+                in_use=len(self._in_use),
+                idle=len(self._idle),
+                waiting=self._waiting,
+                checkouts=self._checkouts,
+                checkouts_per_second=recent / RATE_WINDOW,
+                total_wait_seconds=self._total_wait,
+                max_wait_seconds=self._max_wait,
+                timeouts=self._timeouts,
+                replaced=self._replaced,
+                recycled=self._recycled,
+            )
+
+
 # Sets up a connection pool for transactions to get and put back.
-# This means ew don't have to create a new transaction for every PostGreSQL query
-pool = SimpleConnectionPool(minconn=1, maxconn=10, dsn=database_uri)
+# This means we don't have to create a new connection for every PostGreSQL query.
+# The pool is only created (and connects) on the first get_connection, not at import.
+pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global pool
+    if pool is None:
+        with _pool_lock:
+            if pool is None:
+                pool = ConnectionPool(os.environ["DATABASE_URI"])
+    return pool
+
+
+# One pool per replica, also created on first use. Replica pools don't open connections up
+# front, so a replica that is down only costs the reads that try it.
+replica_pools: Optional[List[ConnectionPool]] = None
+_replica_down_until = {}       # replica pool -> time.monotonic() it is tried again after
+_next_replica = itertools.count()
+_primary_until: ContextVar[float] = ContextVar("primary_until", default=0.0)
+
+
+def get_replica_pools() -> List[ConnectionPool]:
+    global replica_pools
+    if replica_pools is None:
+        with _pool_lock:
+            if replica_pools is None:
+                replica_uris = os.environ.get("DATABASE_REPLICA_URIS", "").split(",")
+                replica_pools = [ConnectionPool(uri.strip(), minconn=0) for uri in replica_uris if uri.strip()]
+    return replica_pools
+
+
+def _replicas_to_try() -> List[ConnectionPool]:
+    """the replicas in the order a read should try them; none while the session is pinned to the primary"""
+    if time.monotonic() < _primary_until.get():
+        return []
+    now = time.monotonic()
+    replicas = [replica for replica in get_replica_pools() if _replica_down_until.get(replica, 0) <= now]
+    if not replicas:
+        return []
+    turn = next(_next_replica) % len(replicas)
+    replicas = replicas[turn:] + replicas[:turn]        # ties in load go to each replica in turn
+    if REPLICA_SELECTION == "least_busy":
+        replicas.sort(key=ConnectionPool.busy)
+    return replicas
+
+
+def _checkout(timeout: Optional[float], read_only: bool):
+    """(pool, connection): a replica's for read_only work when one is up, otherwise the primary's"""
+    for replica in _replicas_to_try() if read_only else []:
+        try:
+            return replica, replica.getconn(timeout)
+        except psycopg2.OperationalError:       # unreachable; the next replica or the primary serves the read
+            _replica_down_until[replica] = time.monotonic() + REPLICA_RETRY_AFTER
+    primary = get_pool()
+    return primary, primary.getconn(timeout)
 
 
 # allows a connection using a 'with statement'.
-# yield connection to return results. And when done puts the connection back in the pool
+# yield connection to return results. And when done puts the connection back in the pool.
+# read_only connections may come from a replica, so they must not be written to.
+# With STORAGE_BACKEND=sqlite the connection is to the embedded database instead (see storage.py).
 @contextmanager
-def get_connection():
-    connection = pool.getconn()
+def get_connection(timeout: Optional[float] = None, read_only: bool = False):
+    if storage.BACKEND == "sqlite":
+        with storage.get_sqlite_connection(timeout) as connection:
+            yield connection
+        return
+    started = time.perf_counter()
+    connection_pool, connection = _checkout(timeout, read_only)
+    instrumentation.record_pool_wait(time.perf_counter() - started)
     try:
         yield connection
     finally:
-        pool.putconn(connection)
\ No newline at end of file
+        connection_pool.putconn(connection)
+        if connection_pool is pool and not read_only and READ_YOUR_WRITES:
+            _primary_until.set(time.monotonic() + READ_YOUR_WRITES)
+
+
+def get_pool_stats() -> PoolStats:
+    return get_pool().stats()
+
+
+def get_replica_pool_stats() -> List[PoolStats]:
+    return [replica.stats() for replica in get_replica_pools()]
@@ -0,0 +1,288 @@
+import atexit
+import bisect
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+import prepared_statements
+
+
+# -- Query and connection pool instrumentation --
+# get_cursor in the data modules wraps every cursor it hands out, and get_connection times
+# how long each checkout waited for the pool. Everything is labelled with the menu action
+# that was running, so the metrics show which action is eating the database.
+#   INSTRUMENTATION_ENABLED=0       switches it all off
+#   SLOW_QUERY_MS=200               statements slower than this are logged with their parameters
+#   SLOW_QUERY_EXPLAIN=1            slow SELECTs are also run through EXPLAIN ANALYZE
+#   SLOW_QUERY_LOG=slow.log         file the slow-query log is written to
+#   METRICS_FILE=metrics.prom       written on exit; Prometheus text, or a JSON snapshot for .json
+
+ENABLED = os.environ.get("INSTRUMENTATION_ENABLED", "1") != "0"
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 200))
+SLOW_QUERY_EXPLAIN = os.environ.get("SLOW_QUERY_EXPLAIN", "0") != "0"
+SLOW_QUERY_LOG = os.environ.get("SLOW_QUERY_LOG")
+METRICS_FILE = os.environ.get("METRICS_FILE")
+
+# seconds; the Prometheus default buckets with finer steps below 5ms, where most queries land
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_QUERIES_KEPT = 100
+PARAMS_LENGTH = 500        # longest parameter repr kept in a slow-query record
+
+NO_ACTION = "none"
+current_action = contextvars.ContextVar("current_action", default=NO_ACTION)
+
+slow_query_log = logging.getLogger("slow_queries")
+if SLOW_QUERY_LOG:
+    _handler = logging.FileHandler(SLOW_QUERY_LOG)
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    slow_query_log.addHandler(_handler)
+    slow_query_log.setLevel(logging.INFO)
+else:
+    slow_query_log.addHandler(logging.NullHandler())     # kept in memory for snapshot() only
+
+_PREPARED_NAME = re.compile(r"(EXECUTE|PREPARE)\s+(\w+)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class Histogram:
+    """Prometheus style histogram: a count per bucket upper bound, plus the sum and count"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)     # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        counts, total = [], 0
+        for bound, count in zip([*map(str, BUCKETS), "+Inf"], self.buckets):
+            total += count
+            counts.append((bound, total))
+        return counts
+
+
+_lock = threading.Lock()
+_query_seconds: Dict[Tuple[str, str], Histogram] = {}          # (statement, action) ->
+_query_rows: Dict[Tuple[str, str], int] = {}                    # (statement, action) -> rows returned or changed
+_slow_query_counts: Dict[Tuple[str, str], int] = {}
+_transaction_seconds: Dict[str, Histogram] = {}                 # action ->
+_pool_wait_seconds: Dict[str, Histogram] = {}                   # action ->
+slow_queries = deque(maxlen=SLOW_QUERIES_KEPT)
+
+
+@contextmanager
+def action(name: str):
+    """Labels the queries run inside the with block, e.g. with the menu action's name"""
+    token = current_action.set(name)
+    try:
+        yield
+    finally:
+        current_action.reset(token)
+
+
+def _observe(histograms: Dict, key, seconds: float):
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = Histogram()
+    histogram.observe(seconds)
+
+
+def record_pool_wait(seconds: float):
+    if ENABLED:
+        with _lock:
+            _observe(_pool_wait_seconds, current_action.get(), seconds)
+
+
+@contextmanager
+def timed_transaction():
+    """Times the get_cursor block, which is one transaction"""
+    if not ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        with _lock:
+            _observe(_transaction_seconds, current_action.get(), seconds)
+
+
+def statement_label(query: str) -> str:
+    """the prepared statement name when the query has one, otherwise its shortened text"""
+    name = prepared_statements.statement_name(query)
+    if name is None:
+        match = _PREPARED_NAME.match(query)
+        if match:
+            name = match.group(2) if match.group(1) == "EXECUTE" else f"prepare:{match.group(2)}"
+        else:
+            name = _WHITESPACE.sub(" ", query).strip()[:60]
+    return name
+
+
+class InstrumentedCursor:
+    """Wraps a cursor, timing execute and copy_expert; everything else goes to the cursor"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, attribute):
+        return getattr(self._cursor, attribute)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, query, params=None):
+        started = time.perf_counter()
+        result = self._cursor.execute(query, params)
+        self._record(query, params, time.perf_counter() - started)
+        return result
+
+    def copy_expert(self, query, file, *args, **kwargs):
+        started = time.perf_counter()
+        result = self._cursor.copy_expert(query, file, *args, **kwargs)
+        self._record(query, None, time.perf_counter() - started)
+        return result
+
+    def _record(self, query, params, seconds: float):
+        """failed statements aren't recorded; the error is what gets reported for them"""
+        query = query.decode() if isinstance(query, bytes) else str(query)
+        label = statement_label(query)
+        key = (label, current_action.get())
+        rows = max(self._cursor.rowcount, 0)
+        slow = seconds * 1000 >= SLOW_QUERY_MS
+        with _lock:
+            _observe(_query_seconds, key, seconds)
+            _query_rows[key] = _query_rows.get(key, 0) + rows
+            if slow:
+                _slow_query_counts[key] = _slow_query_counts.get(key, 0) + 1
+        if slow:
+            self._log_slow_query(label, query, params, seconds)
+
+    def _log_slow_query(self, label: str, query: str, params, seconds: float):
+        record = {
+            "statement": label,
+            "action": current_action.get(),
+            "duration_ms": round(seconds * 1000, 3),
+            "query": query,
+            "params": repr(params)[:PARAMS_LENGTH],
+        }
+        if SLOW_QUERY_EXPLAIN and _is_select(label, query):
+            record["plan"] = self._explain_analyze(query, params)
+        slow_queries.append(record)
+        slow_query_log.info(json.dumps(record))
+
+    def _explain_analyze(self, query: str, params) -> Optional[str]:
+        """Runs the statement again under EXPLAIN ANALYZE, on its own cursor so the caller's
+        results are untouched. Only used for SELECTs, which are safe to run twice"""
+        with self._cursor.connection.cursor() as explain_cursor:
+            # inside a savepoint, so a failed EXPLAIN doesn't abort the caller's transaction
+            explain_cursor.execute("SAVEPOINT explain_slow_query;")
+            try:
+                explain_cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {query}", params)
+                return "\n".join(row[0] for row in explain_cursor.fetchall())
+            except Exception as error:      # the plan is a nice to have; the query itself succeeded
+                explain_cursor.execute("ROLLBACK TO SAVEPOINT explain_slow_query;")
+                return f"EXPLAIN failed: {error}"
+            finally:
+                explain_cursor.execute("RELEASE SAVEPOINT explain_slow_query;")
+
+
+def _is_select(label: str, query: str) -> bool:
+    registered = prepared_statements.registered_query(label)
+    return (registered or query).lstrip().upper().startswith("SELECT")
+
+
+def wrap_cursor(cursor):
+    return InstrumentedCursor(cursor) if ENABLED else cursor
+
+
+# -- Export --
+
+def snapshot() -> dict:
+    """Every metric as plain JSON-friendly data"""
+    def histogram(value: Histogram) -> dict:
+        return {"count": value.count, "sum_seconds": value.sum, "buckets": dict(value.cumulative())}
+
+    with _lock:
+        return {
+            "queries": [
+                {"statement": statement, "action": action_name, "rows": _query_rows.get((statement, action_name), 0),
+                 "slow": _slow_query_counts.get((statement, action_name), 0), **histogram(value)}
+                for (statement, action_name), value in sorted(_query_seconds.items())
+            ],
+            "transactions": {name: histogram(value) for name, value in sorted(_transaction_seconds.items())},
+            "pool_wait": {name: histogram(value) for name, value in sorted(_pool_wait_seconds.items())},
+            "slow_queries": list(slow_queries),
+        }
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _histogram_lines(metric: str, labels: str, value: Histogram) -> List[str]:
+    lines = [f'{metric}_bucket{{{labels},le="{bound}"}} {count}' for bound, count in value.cumulative()]
+    lines.append(f"{metric}_sum{{{labels}}} {value.sum}")
+    lines.append(f"{metric}_count{{{labels}}} {value.count}")
+    return lines
+
+
+def prometheus_text() -> str:
+    """Every metric in the Prometheus text exposition format"""
+    lines = [
+        "# HELP app_query_duration_seconds Statement latency.",
+        "# TYPE app_query_duration_seconds histogram",
+    ]
+    with _lock:
+        for (statement, action_name), value in sorted(_query_seconds.items()):
+            labels = f'statement="{_escape(statement)}",action="{_escape(action_name)}"'
+            lines.extend(_histogram_lines("app_query_duration_seconds", labels, value))
+
+        lines += ["# HELP app_query_rows_total Rows returned or changed by statements.",
+                  "# TYPE app_query_rows_total counter"]
+        for (statement, action_name), rows in sorted(_query_rows.items()):
+            lines.append(f'app_query_rows_total{{statement="{_escape(statement)}",action="{_escape(action_name)}"}} {rows}')
+
+        lines += ["# HELP app_slow_queries_total Statements slower than SLOW_QUERY_MS.",
+                  "# TYPE app_slow_queries_total counter"]
+        for (statement, action_name), count in sorted(_slow_query_counts.items()):
+            lines.append(f'app_slow_queries_total{{statement="{_escape(statement)}",action="{_escape(action_name)}"}} {count}')
+
+        for metric, help_text, histograms in (
+                ("app_transaction_duration_seconds", "get_cursor transaction duration.", _transaction_seconds),
+                ("app_pool_wait_seconds", "Time spent waiting for a pooled connection.", _pool_wait_seconds)):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+            for action_name, value in sorted(histograms.items()):
+                lines.extend(_histogram_lines(metric, f'action="{_escape(action_name)}"', value))
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path: str):
+    """Prometheus text, or a JSON snapshot when path ends in .json"""
+    with open(path, "w") as file:
+        if path.endswith(".json"):
+            json.dump(snapshot(), file, indent=2)
+        else:
+            file.write(prometheus_text())
+
+
+def reset():
+    with _lock:
+        for metrics in (_query_seconds, _query_rows, _slow_query_counts, _transaction_seconds, _pool_wait_seconds):
+            metrics.clear()
+        slow_queries.clear()
+
+
+if METRICS_FILE and ENABLED:
+    atexit.register(write_metrics, METRICS_FILE)
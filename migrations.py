@@ -0,0 +1,330 @@
+import argparse
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+import storage
+from connection_pool import get_connection
+from movies import movie_database
+from polls import poll_database
+
+
+# -- Versioned schema migrations --
+# Each migration runs once, in order, and its version is recorded in schema_migrations.
+#   python migrations.py            applies any pending migrations
+#   python migrations.py status     shows the applied and pending versions
+#   python migrations.py check      reports missing indexes with EXPLAIN plans as evidence
+
+CREATE_SCHEMA_MIGRATIONS_TABLE = """CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    description TEXT,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);"""
+# stops two app instances starting at once from running the same migration twice
+LOCK_SCHEMA_MIGRATIONS = "SELECT pg_advisory_xact_lock(hashtext('schema_migrations'));"
+SELECT_SCHEMA_VERSION = "SELECT COALESCE(MAX(version), 0) FROM schema_migrations;"
+INSERT_SCHEMA_VERSION = "INSERT INTO schema_migrations (version, description) VALUES (%s, %s);"
+
+storage.register_sqlite({
+    CREATE_SCHEMA_MIGRATIONS_TABLE: """CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );""",
+    LOCK_SCHEMA_MIGRATIONS: None,       # the migration's write transaction already runs alone
+})
+
+
+# -- Migrations --
+
+def _create_tables(cursor):
+    """movies, users, reviews, polls, options, votes and vote counters"""
+    cursor.execute(movie_database.CREATE_MOVIES_TABLE)
+    cursor.execute(movie_database.CREATE_USERS_TABLE)
+    cursor.execute(movie_database.CREATE_REVIEWS_TABLE)
+    cursor.execute(movie_database.CREATE_RELEASE_INDEX)
+    cursor.execute(movie_database.CREATE_TITLE_RELEASE_INDEX)
+
+    cursor.execute(poll_database.CREATE_POLLS_TABLE)
+    cursor.execute(poll_database.CREATE_POLL_OPTIONS_TABLE)
+    cursor.execute(poll_database.CREATE_VOTES_TABLE)
+    cursor.execute(poll_database.CREATE_OPTION_VOTE_COUNTS_TABLE)
+    cursor.execute(poll_database.CREATE_POLL_VOTE_COUNTS_TABLE)
+    cursor.execute(poll_database.CREATE_COUNT_VOTES_FUNCTION)
+    cursor.execute(poll_database.CREATE_COUNT_VOTES_TRIGGER)
+
+    # votes cast before the counters existed are counted once
+    cursor.execute(poll_database.SELECT_VOTE_COUNTS_EXIST)
+    if not cursor.fetchone()[0]:
+        cursor.execute(poll_database.INSERT_OPTION_VOTE_COUNTS_FROM_VOTES)
+        cursor.execute(poll_database.INSERT_POLL_VOTE_COUNTS_FROM_VOTES)
+
+
+def _add_primary_keys(cursor):
+    """surrogate primary keys on reviews and votes"""
+    cursor.execute("ALTER TABLE reviews ADD COLUMN IF NOT EXISTS id SERIAL PRIMARY KEY;")
+    cursor.execute("ALTER TABLE votes ADD COLUMN IF NOT EXISTS id BIGSERIAL PRIMARY KEY;")
+
+
+def _add_hot_path_indexes(cursor):
+    """indexes on the columns the data modules filter and join on"""
+    # movies.title lookups use the leading column of idx_movies_title_release
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_reviews_movie_id ON reviews (movie_id);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_reviews_user_username ON reviews (user_username);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_options_poll_id ON options (poll_id);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_votes_option_id ON votes (option_id, id);")
+
+
+def _add_title_search_indexes(cursor):
+    """trigram and prefix indexes for movie title search"""
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_movies_title_trgm ON movies USING gist (title gist_trgm_ops);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_movies_title_lower ON movies (lower(title) text_pattern_ops);")
+
+
+def _add_release_keyset_index(cursor):
+    """(release_timestamp, id) index for keyset-paginated movie listings"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_movies_release_id ON movies (release_timestamp, id);")
+    cursor.execute("DROP INDEX IF EXISTS idx_movies_release;")     # covered by the new index
+
+
+def _add_vote_rollups(cursor):
+    """hourly and daily vote rollups, kept up to date by the vote counting trigger"""
+    cursor.execute(poll_database.CREATE_VOTE_ROLLUPS_HOURLY_TABLE)
+    cursor.execute(poll_database.CREATE_VOTE_ROLLUPS_DAILY_TABLE)
+    cursor.execute(poll_database.CREATE_VOTE_ROLLUPS_HOURLY_BUCKET_INDEX)
+    cursor.execute(poll_database.CREATE_VOTE_ROLLUPS_DAILY_BUCKET_INDEX)
+    cursor.execute(poll_database.LOCK_VOTES)        # no votes between the backfill and the new trigger body
+    cursor.execute(poll_database.CREATE_COUNT_VOTES_FUNCTION)
+    cursor.execute(poll_database.INSERT_VOTE_ROLLUPS_HOURLY_FROM_VOTES, (0, ))
+    cursor.execute(poll_database.INSERT_VOTE_ROLLUPS_DAILY_FROM_VOTES, (0, ))
+
+
+def _partition_votes(cursor):
+    """votes range partitioned by month, with a default partition"""
+    cursor.execute("LOCK TABLE votes IN ACCESS EXCLUSIVE MODE;")
+    cursor.execute("ALTER TABLE votes RENAME TO votes_unpartitioned;")
+    cursor.execute("ALTER SEQUENCE votes_id_seq OWNED BY NONE;")       # kept for the new table's ids
+    cursor.execute(poll_database.CREATE_PARTITIONED_VOTES_TABLE)
+    cursor.execute("ALTER SEQUENCE votes_id_seq OWNED BY votes.id;")
+    cursor.execute(poll_database.CREATE_DEFAULT_VOTE_PARTITION)
+
+    # a partition for every month that has votes, up to the months ahead
+    cursor.execute("SELECT MIN(vote_timestamp) FROM votes_unpartitioned WHERE vote_timestamp > 0;")
+    first_timestamp = cursor.fetchone()[0] or time.time()
+    poll_database.create_vote_partitions_in(
+        cursor, first_timestamp, time.time() + poll_database.PARTITION_MONTHS_AHEAD * 31 * poll_database.DAY)
+
+    # copied before the counting trigger exists, so the counters aren't added to twice.
+    # Votes without a time go to the default partition as 0
+    cursor.execute("""INSERT INTO votes (id, username, option_id, vote_timestamp)
+        SELECT id, username, option_id, COALESCE(vote_timestamp, 0) FROM votes_unpartitioned;""")
+    cursor.execute("DROP TABLE votes_unpartitioned;")
+    cursor.execute(poll_database.CREATE_VOTES_OPTION_INDEX)
+    cursor.execute(poll_database.CREATE_COUNT_VOTES_TRIGGER)
+
+
+def _add_review_feeds(cursor):
+    """review created_at times and (user, created_at) and (movie, created_at) feed indexes"""
+    # reviews written before now get the migration time; their ids keep them in order
+    cursor.execute("""ALTER TABLE reviews ADD COLUMN IF NOT EXISTS created_at DOUBLE PRECISION NOT NULL
+        DEFAULT extract(epoch FROM clock_timestamp());""")
+    # the review text is left out of the indexes, as long reviews would go over the index row size limit
+    cursor.execute("""CREATE INDEX IF NOT EXISTS idx_reviews_user_created
+        ON reviews (user_username, created_at, id) INCLUDE (movie_id);""")
+    cursor.execute("""CREATE INDEX IF NOT EXISTS idx_reviews_movie_created
+        ON reviews (movie_id, created_at, id) INCLUDE (user_username);""")
+    cursor.execute("DROP INDEX IF EXISTS idx_reviews_movie_id;")        # covered by the new indexes
+    cursor.execute("DROP INDEX IF EXISTS idx_reviews_user_username;")
+
+
+def _add_poll_voters(cursor):
+    """poll_voters, holding votes to one per user per poll"""
+    cursor.execute(poll_database.CREATE_POLL_VOTERS_TABLE)
+    cursor.execute(poll_database.LOCK_VOTES)        # no votes between the backfill and the new INSERT_VOTE
+    cursor.execute(poll_database.INSERT_POLL_VOTERS_FROM_VOTES)
+
+
+MIGRATIONS: List[Tuple[int, Callable]] = [
+    (1, _create_tables),
+    (2, _add_primary_keys),
+    (3, _add_hot_path_indexes),
+    (4, _add_title_search_indexes),
+    (5, _add_release_keyset_index),
+    (6, _add_vote_rollups),
+    (7, _partition_votes),
+    (8, _add_review_feeds),
+    (9, _add_poll_voters),
+]
+
+# what each version after SQLite support changed, for SQLite databases made before it
+SQLITE_MIGRATIONS: Dict[int, List[str]] = {
+    9: poll_database.SQLITE_POLL_VOTERS_SCHEMA,
+}
+
+
+def migrate(connection) -> List[int]:
+    """Applies pending migrations in one transaction and returns their versions"""
+    applied = []
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute(CREATE_SCHEMA_MIGRATIONS_TABLE)
+            cursor.execute(LOCK_SCHEMA_MIGRATIONS)
+            cursor.execute(SELECT_SCHEMA_VERSION)
+            current_version = cursor.fetchone()[0]
+
+            if storage.is_sqlite(connection):
+                # an SQLite database is created at the latest version, and brought up to it
+                # from an earlier one by SQLITE_MIGRATIONS
+                if current_version == 0:
+                    statements = movie_database.SQLITE_SCHEMA + poll_database.SQLITE_SCHEMA
+                else:
+                    statements = [statement for version, upgrade in sorted(SQLITE_MIGRATIONS.items())
+                                  if version > current_version for statement in upgrade]
+                for statement in statements:
+                    cursor.execute(statement)
+                for version, migration in MIGRATIONS:
+                    if version > current_version:
+                        cursor.execute(INSERT_SCHEMA_VERSION, (version, migration.__doc__))
+                        applied.append(version)
+                return applied
+
+            for version, migration in MIGRATIONS:
+                if version > current_version:
+                    migration(cursor)
+                    cursor.execute(INSERT_SCHEMA_VERSION, (version, migration.__doc__))
+                    applied.append(version)
+    return applied
+
+
+_schema_checked = False
+
+
+def ensure_schema():
+    """Migrates the database and creates the coming months' vote partitions the first time
+    it's called in a process, and does nothing after"""
+    global _schema_checked
+    if not _schema_checked:
+        with get_connection() as connection:
+            migrate(connection)
+            if not storage.is_sqlite(connection):
+                poll_database.create_vote_partitions(connection)
+        _schema_checked = True
+
+
+def get_schema_version(connection) -> int:
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute(CREATE_SCHEMA_MIGRATIONS_TABLE)
+            cursor.execute(SELECT_SCHEMA_VERSION)
+            return cursor.fetchone()[0]
+
+
+# -- Index check --
+
+EXPECTED_INDEXES = [
+    "idx_movies_release_id",
+    "idx_movies_title_release",
+    "idx_reviews_user_created",
+    "idx_reviews_movie_created",
+    "idx_options_poll_id",
+    "idx_votes_option_id",
+    "idx_movies_title_trgm",
+    "idx_movies_title_lower",
+    "idx_vote_rollups_hourly_bucket",
+    "idx_vote_rollups_daily_bucket",
+]
+SELECT_EXISTING_INDEXES = "SELECT indexname FROM pg_indexes WHERE indexname = ANY(%s);"
+
+# planner is told to avoid sequential scans, so one only shows up when no index can serve the query
+DISABLE_SEQSCAN = "SET LOCAL enable_seqscan = off;"
+
+# (query name, query, sample parameters) for every lookup the data modules run.
+# Two read every row they're after by design and aren't checked: listing all polls, and the
+# recent voters (poll_database.SELECT_RECENT_POLL_VOTERS) read once at startup to warm the
+# vote filter. That one has no vote_timestamp index to use; partition pruning keeps its scan
+# to the months since VOTE_FILTER_WARM_DAYS ago, and an index would cost every vote insert.
+CHECKED_QUERIES = [
+    ("movie_database.SELECT_MOVIES", movie_database.SELECT_MOVIES, ()),
+    ("movie_database.SELECT_UPCOMING_MOVIES", movie_database.SELECT_UPCOMING_MOVIES, (0, )),
+    ("movie_database.SELECT_MOVIES_PAGE", movie_database.SELECT_MOVIES_PAGE, (0, 0, 0, 1)),
+    ("movie_database.SELECT_REVIEWED_MOVIES", movie_database.SELECT_REVIEWED_MOVIES, ("", )),
+    ("movie_database.SELECT_MOVIE_REVIEWS", movie_database.SELECT_MOVIE_REVIEWS, (0, )),
+    ("movie_database.SELECT_MOVIE_TRAILER_URL", movie_database.SELECT_MOVIE_TRAILER_URL, ("", )),
+    ("movie_database.SEARCH_MOVIE", movie_database.SEARCH_MOVIE, ("a", "%a%", "a", 1)),
+    ("movie_database.AUTOCOMPLETE_MOVIE", movie_database.AUTOCOMPLETE_MOVIE, ("a%", 1)),
+    ("movie_database.GET_MOVIE_TITLE", movie_database.GET_MOVIE_TITLE, (0, )),
+    ("movie_database.SELECT_USER_REVIEW_FEED", movie_database.SELECT_USER_REVIEW_FEED, ("", 0, 0, 1)),
+    ("movie_database.SELECT_USER_REVIEWS_SINCE", movie_database.SELECT_USER_REVIEWS_SINCE, ("", 0, 0, 1)),
+    ("movie_database.SELECT_MOVIE_REVIEW_FEED", movie_database.SELECT_MOVIE_REVIEW_FEED, (0, 0, 0, 1)),
+    ("movie_database.SELECT_MOVIE_REVIEWS_SINCE", movie_database.SELECT_MOVIE_REVIEWS_SINCE, (0, 0, 0, 1)),
+    ("poll_database.SELECT_POLL", poll_database.SELECT_POLL, (0, )),
+    ("poll_database.SELECT_POLL_OPTIONS", poll_database.SELECT_POLL_OPTIONS, (0, )),
+    ("poll_database.SELECT_OPTION", poll_database.SELECT_OPTION, (0, )),
+    ("poll_database.SELECT_EXISTING_OPTION_IDS", poll_database.SELECT_EXISTING_OPTION_IDS, ([0], )),
+    ("poll_database.SELECT_LATEST_POLL", poll_database.SELECT_LATEST_POLL, ()),
+    ("poll_database.SELECT_VOTES_FOR_OPTION", poll_database.SELECT_VOTES_FOR_OPTION, (0, )),
+    ("poll_database.SELECT_VOTES_FOR_OPTION_SINCE", poll_database.SELECT_VOTES_FOR_OPTION_SINCE, (0, 0)),
+    ("poll_database.SELECT_POLL_OPTION_VOTES", poll_database.SELECT_POLL_OPTION_VOTES, (0, )),
+    ("poll_database.POLL_VOTE_LOG", poll_database.POLL_VOTE_LOG, ("UTC", 0)),
+    ("poll_database.SELECT_POLL_TALLY", poll_database.SELECT_POLL_TALLY, (0, )),
+    ("poll_database.SELECT_POLL_OPTION_VOTE_COUNTS", poll_database.SELECT_POLL_OPTION_VOTE_COUNTS, (0, )),
+    ("poll_database.SELECT_VOTER_AT_OFFSET", poll_database.SELECT_VOTER_AT_OFFSET, (0, 0)),
+    ("poll_database.GET_POLL_TITLE", poll_database.GET_POLL_TITLE, (0, )),
+    ("poll_database.SELECT_TRENDING_POLLS_HOURLY", poll_database.SELECT_TRENDING_POLLS_HOURLY, (0, 1)),
+    ("poll_database.SELECT_TRENDING_POLLS_DAILY", poll_database.SELECT_TRENDING_POLLS_DAILY, (0, 1)),
+    ("poll_database.SELECT_POLL_VOTE_RATE_HOURLY", poll_database.SELECT_POLL_VOTE_RATE_HOURLY, (0, 0)),
+    ("poll_database.SELECT_POLL_VOTE_RATE_DAILY", poll_database.SELECT_POLL_VOTE_RATE_DAILY, (0, 0)),
+]
+
+
+def check_indexes(connection) -> Tuple[List[str], List[Tuple[str, List[str]]]]:
+    """Returns (missing expected indexes, [(query name, plan lines)] for queries that still seq scan)"""
+    seq_scans = []
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute(SELECT_EXISTING_INDEXES, (EXPECTED_INDEXES, ))
+            existing = {row[0] for row in cursor.fetchall()}
+            missing = [index for index in EXPECTED_INDEXES if index not in existing]
+
+            cursor.execute(DISABLE_SEQSCAN)
+            for name, query, params in CHECKED_QUERIES:
+                cursor.execute("EXPLAIN " + query, params)
+                plan = [row[0] for row in cursor.fetchall()]
+                if any("Seq Scan" in line for line in plan):
+                    seq_scans.append((name, plan))
+    return missing, seq_scans
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply or inspect the database schema migrations")
+    parser.add_argument("command", nargs="?", default="migrate", choices=["migrate", "status", "check"])
+    args = parser.parse_args(argv)
+
+    with get_connection() as connection:
+        if args.command == "migrate":
+            applied = migrate(connection)
+            print(f"Applied migrations {applied}" if applied else "Schema is up to date")
+
+        elif args.command == "status":
+            current_version = get_schema_version(connection)
+            for version, migration in MIGRATIONS:
+                state = "applied" if version <= current_version else "pending"
+                print(f"{version}: {migration.__doc__} ({state})")
+
+        elif storage.is_sqlite(connection):
+            sys.exit("The index check reads PostGreSQL plans; it can't check an SQLite database")
+
+        else:
+            missing, seq_scans = check_indexes(connection)
+            for index in missing:
+                print(f"Missing index: {index}")
+            for name, plan in seq_scans:
+                print(f"\n{name} has no index-backed plan:")
+                print("\n".join(f"    {line}" for line in plan))
+            if missing or seq_scans:
+                sys.exit(1)
+            print("Every checked query has an index-backed plan")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional, Tuple
+from movies.movie_database import (
+    Movie, SEARCH_LIMIT, AUTOCOMPLETE_LIMIT, ITERSIZE,
+    INSERT_USER, INSERT_MOVIES, INSERT_REVIEWED_MOVIE,
+    SELECT_MOVIES, SELECT_UPCOMING_MOVIES, SELECT_MOVIES_PAGE, SELECT_REVIEWED_MOVIES, SELECT_MOVIE_REVIEWS,
+    SELECT_MOVIE_TRAILER_URL, SEARCH_MOVIE, AUTOCOMPLETE_MOVIE,
+    escape_like, movies_page_params, split_movies_page, today_timestamp,
+)
+
+
+# asyncio versions of the movie_database functions, for psycopg 3 async connections
+# (see async_connection_pool). They share movie_database's SQL so both stay in step.
+
+@asynccontextmanager
+async def get_cursor(connection):
+    async with connection.transaction():
+        async with connection.cursor() as cursor:
+            yield cursor
+
+
+async def add_movie(connection, title: str, release_timestamp: float, trailer_url: str):
+    async with get_cursor(connection) as cursor:
+        await cursor.execute(INSERT_MOVIES, (title, release_timestamp, trailer_url))
+
+
+async def add_user(connection, username: str):
+    async with get_cursor(connection) as cursor:
+        await cursor.execute(INSERT_USER, (username, ))
+
+
+async def get_movies(connection, upcoming=False) -> List[Movie]:
+    async with get_cursor(connection) as cursor:
+        if upcoming:
+            await cursor.execute(SELECT_UPCOMING_MOVIES, (today_timestamp(), ))
+        else:
+            await cursor.execute(SELECT_MOVIES)
+        return await cursor.fetchall()
+
+
+async def iter_movies(connection, upcoming: bool = False, itersize: int = ITERSIZE) -> AsyncIterator[Movie]:
+    """Streams movies in release order through a server-side cursor"""
+    async with connection.transaction():
+        async with connection.cursor(name="iter_movies") as cursor:
+            cursor.itersize = itersize
+            if upcoming:
+                await cursor.execute(SELECT_UPCOMING_MOVIES, (today_timestamp(), ))
+            else:
+                await cursor.execute(SELECT_MOVIES)
+            async for movie in cursor:
+                yield movie
+
+
+async def get_movies_page(connection, page_size: int, cursor_token: Optional[str] = None,
+                          upcoming: bool = False) -> Tuple[List[Movie], Optional[str]]:
+    async with get_cursor(connection) as cursor:
+        await cursor.execute(SELECT_MOVIES_PAGE, movies_page_params(page_size, cursor_token, upcoming))
+        return split_movies_page(await cursor.fetchall(), page_size)
+
+
+async def review_movie(connection, username: str, movie_id: int, review: str):
+    async with get_cursor(connection) as cursor:
+        await cursor.execute(INSERT_REVIEWED_MOVIE, (username, movie_id, review))
+
+
+async def get_reviewed_movies(connection, username: str):
+    async with get_cursor(connection) as cursor:
+        await cursor.execute(SELECT_REVIEWED_MOVIES, (username, ))
+        return await cursor.fetchall()
+
+
+async def get_movie_reviews(connection, movie_id: int):
+    async with get_cursor(connection) as cursor:
+        await cursor.execute(SELECT_MOVIE_REVIEWS, (movie_id, ))
+        return await cursor.fetchall()
+
+
+async def get_trailer_url(connection, title: str):
+    async with get_cursor(connection) as cursor:
+        await cursor.execute(SELECT_MOVIE_TRAILER_URL, (title, ))
+        return await cursor.fetchone()
+
+
+async def search_movie(connection, search_input: str, limit: int = SEARCH_LIMIT) -> List[Movie]:
+    async with get_cursor(connection) as cursor:
+        pattern = f"%{escape_like(search_input)}%"
+        await cursor.execute(SEARCH_MOVIE, (search_input, pattern, search_input, limit))
+        return await cursor.fetchall()
+
+
+async def autocomplete_movie(connection, prefix: str, limit: int = AUTOCOMPLETE_LIMIT) -> List[Movie]:
+    async with get_cursor(connection) as cursor:
+        await cursor.execute(AUTOCOMPLETE_MOVIE, (f"{escape_like(prefix.lower())}%", limit))
+        return await cursor.fetchall()
@@ -0,0 +1,90 @@
+import argparse
+import csv
+import datetime
+import json
+import sys
+import time
+from functools import lru_cache
+from itertools import islice
+from typing import Iterator, List, Optional, Tuple
+from connection_pool import get_connection
+from movies import movie_database
+
+
+# Streams a release calendar into the movies table in batches, one COPY and merge per batch.
+#   python -m movies.catalog_import calendar.csv     (header: title,release_date,trailer_url)
+#   python -m movies.catalog_import calendar.jsonl   (one {"title", "release_date", "trailer_url"} per line)
+# release_date may be dd-mm-yyyy (as typed into the menu), yyyy-mm-dd, or a release_timestamp.
+# Movies already in the database with the same title and release date are skipped.
+
+BATCH_SIZE = 5_000
+MAX_REPORTED_ERRORS = 20
+
+DATE_FORMATS = ("%d-%m-%Y", "%Y-%m-%d")
+
+MovieRow = Tuple[str, float, str]       # movies.title, movies.release_timestamp, movies.trailer_url
+
+
+# calendars repeat the same handful of release dates, so each one is only parsed once
+@lru_cache(maxsize=4096)
+def parse_release_date(value: str) -> float:
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format).timestamp()
+        except ValueError:
+            pass
+    return float(value)
+
+
+def _read_records(path: str) -> Iterator[dict]:
+    with open(path, newline="", encoding="utf-8") as file:
+        if path.endswith((".jsonl", ".ndjson", ".json")):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(file)
+
+
+def read_movies(path: str, errors: List[str]) -> Iterator[MovieRow]:
+    """Yields parsed movie rows, recording unparseable records in errors instead of stopping"""
+    for line_number, record in enumerate(_read_records(path), start=1):
+        try:
+            release_date = record.get("release_date") or record["release_timestamp"]
+            yield record["title"].strip(), parse_release_date(str(release_date).strip()), record.get("trailer_url", "")
+        except (AttributeError, KeyError, ValueError) as e:
+            errors.append(f"record {line_number}: {e!r}")
+
+
+def import_catalog(path: str, batch_size: int = BATCH_SIZE) -> Tuple[int, int, float]:
+    """Imports the file and returns (movies read, movies added, seconds taken)"""
+    errors: List[str] = []
+    read = added = 0
+    started = time.perf_counter()
+
+    movies = read_movies(path, errors)
+    with get_connection() as connection:
+        while batch := list(islice(movies, batch_size)):
+            added += movie_database.import_movies(connection, batch)
+            read += len(batch)
+            elapsed = time.perf_counter() - started
+            print(f"{read} movies read, {added} added ({read / elapsed:,.0f} rows/sec)", file=sys.stderr)
+
+    for error in errors[:MAX_REPORTED_ERRORS]:
+        print(f"Skipped {error}", file=sys.stderr)
+    return read, added, time.perf_counter() - started
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Bulk import a movie release calendar from CSV or JSON lines")
+    parser.add_argument("path")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    read, added, elapsed = import_catalog(args.path, args.batch_size)
+    rate = read / elapsed if elapsed else 0
+    print(f"Added {added} of {read} movies ({read - added} duplicates) in {elapsed:.1f}s ({rate:,.0f} rows/sec)")
+
+
+if __name__ == "__main__":
+    main()
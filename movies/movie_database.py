@@ -1,5 +1,22 @@
 from contextlib import contextmanager
+import csv
 import datetime
+import io
+from typing import Iterable, Iterator, List, Optional, Tuple
+import cache
+import instrumentation
+import prepared_statements
+import storage
+from prepared_statements import execute
+
+
+# -- Function Hints --
+
+Movie = Tuple[int, str, float, str]     # movies.id, movies.title, movies.release_timestamp, movies.trailer_url
+
+UserReview = Tuple[int, float, int, str, str]     # reviews.id, reviews.created_at, movies.id, movies.title, reviews.review
+
+MovieReview = Tuple[int, float, str, str]       # reviews.id, reviews.created_at, reviews.user_username, reviews.review
 
 # -- PostGreSQL Queries --
 
@@ -25,89 +42,402 @@ CREATE_REVIEWS_TABLE = """CREATE TABLE IF NOT EXISTS reviews (
 
 # will make searching for films quicker from from PostGreSQL
 CREATE_RELEASE_INDEX = "CREATE INDEX IF NOT EXISTS idx_movies_release ON movies (release_timestamp)"
+# catalog imports look up existing movies by title and release date to skip duplicates
+CREATE_TITLE_RELEASE_INDEX = "CREATE INDEX IF NOT EXISTS idx_movies_title_release ON movies (title, release_timestamp)"
+
+# session-local table the catalog importer COPYs into before merging into movies
+CREATE_MOVIES_STAGING_TABLE = """CREATE TEMP TABLE IF NOT EXISTS movies_staging (
+    title TEXT,
+    release_timestamp REAL,
+    trailer_url TEXT
+);"""
+COPY_MOVIES_STAGING = "COPY movies_staging (title, release_timestamp, trailer_url) FROM STDIN WITH (FORMAT csv);"
+LOCK_MOVIES = "LOCK TABLE movies IN SHARE ROW EXCLUSIVE MODE;"     # one merge at a time
+MERGE_MOVIES_STAGING = """INSERT INTO movies (title, release_timestamp, trailer_url)
+    SELECT DISTINCT ON (title, release_timestamp) title, release_timestamp, trailer_url
+    FROM movies_staging
+    WHERE NOT EXISTS (
+        SELECT 1 FROM movies
+        WHERE movies.title = movies_staging.title
+        AND movies.release_timestamp = movies_staging.release_timestamp
+    )
+    ORDER BY title, release_timestamp;
+"""
+TRUNCATE_MOVIES_STAGING = "TRUNCATE movies_staging;"
 
 INSERT_USER = "INSERT INTO users (username) VALUES (%s);"
 INSERT_MOVIES = "INSERT INTO movies (title, release_timestamp, trailer_url) VALUES (%s, %s, %s);"
 INSERT_REVIEWED_MOVIE = "INSERT INTO reviews (user_username, movie_id, review) VALUES (%s, %s, %s);"
 
-SELECT_MOVIES = "SELECT * FROM movies;"
-SELECT_UPCOMING_MOVIES = "SELECT * FROM movies WHERE release_timestamp > %s;"
+SELECT_MOVIES = "SELECT id, title, release_timestamp, trailer_url FROM movies ORDER BY release_timestamp, id;"
+SELECT_UPCOMING_MOVIES = """SELECT id, title, release_timestamp, trailer_url FROM movies
+    WHERE release_timestamp > %s
+    ORDER BY release_timestamp, id;
+"""
+# keyset pagination: the page after the (release_timestamp, id) of the last movie shown,
+# so every page is an index range scan on idx_movies_release_id however deep it is.
+# The timestamps are cast to REAL like the column, so a cursor read back from a REAL compares
+# equal to the stored value instead of as the (smaller or larger) double it was printed as
+SELECT_MOVIES_PAGE = """SELECT id, title, release_timestamp, trailer_url FROM movies
+    WHERE release_timestamp > %s::REAL AND (release_timestamp, id) > (%s::REAL, %s)
+    ORDER BY release_timestamp, id
+    LIMIT %s;
+"""
 
-SELECT_REVIEWED_MOVIES = """SELECT movies.title, movies.release_timestamp, reviews.review 
-    FROM movies JOIN reviews ON movies.id = reviews.movie_id
-    JOIN users ON users.username = reviews.user_username
-    WHERE users.username = %s;
+# reviews.user_username is already the username, so users isn't joined
+SELECT_REVIEWED_MOVIES = """SELECT movies.title, movies.release_timestamp, reviews.review
+    FROM reviews JOIN movies ON movies.id = reviews.movie_id
+    WHERE reviews.user_username = %s
+    ORDER BY reviews.created_at DESC, reviews.id DESC;
 """
 
-SELECT_MOVIE_REVIEWS = """SELECT movies.title, users.username, reviews.review 
-    FROM movies JOIN reviews ON movies.id = reviews.movie_id
-    JOIN users on users.username = reviews.user_username
-    WHERE movies.id = %s;
+SELECT_MOVIE_REVIEWS = """SELECT movies.title, reviews.user_username, reviews.review
+    FROM reviews JOIN movies ON movies.id = reviews.movie_id
+    WHERE reviews.movie_id = %s
+    ORDER BY reviews.created_at, reviews.id;
+"""
+
+# Review feeds, keyset paginated on (created_at, id) like the movie pages. A feed page goes
+# back in time from its cursor, newest first, on idx_reviews_user_created or
+# idx_reviews_movie_created. A "since" fetch returns what was added after its cursor, oldest first.
+SELECT_USER_REVIEW_FEED = """SELECT reviews.id, reviews.created_at, movies.id, movies.title, reviews.review
+    FROM reviews JOIN movies ON movies.id = reviews.movie_id
+    WHERE reviews.user_username = %s AND (reviews.created_at, reviews.id) < (%s, %s)
+    ORDER BY reviews.created_at DESC, reviews.id DESC
+    LIMIT %s;
+"""
+SELECT_USER_REVIEWS_SINCE = """SELECT reviews.id, reviews.created_at, movies.id, movies.title, reviews.review
+    FROM reviews JOIN movies ON movies.id = reviews.movie_id
+    WHERE reviews.user_username = %s AND (reviews.created_at, reviews.id) > (%s, %s)
+    ORDER BY reviews.created_at, reviews.id
+    LIMIT %s;
+"""
+SELECT_MOVIE_REVIEW_FEED = """SELECT id, created_at, user_username, review FROM reviews
+    WHERE movie_id = %s AND (created_at, id) < (%s, %s)
+    ORDER BY created_at DESC, id DESC
+    LIMIT %s;
+"""
+SELECT_MOVIE_REVIEWS_SINCE = """SELECT id, created_at, user_username, review FROM reviews
+    WHERE movie_id = %s AND (created_at, id) > (%s, %s)
+    ORDER BY created_at, id
+    LIMIT %s;
 """
 
-SELECT_MOVIE_TRAILER_URL = "SELECT trailer_url FROM movies WHERE title = %s"
-SEARCH_MOVIE = "SELECT * FROM movies WHERE title LIKE %s;"
+SELECT_MOVIE_TRAILER_URL = "SELECT trailer_url FROM movies WHERE lower(title) = lower(%s) ORDER BY id LIMIT 1;"
+
+# Title search uses pg_trgm: "<%" matches titles containing a word similar to the search
+# (so typos still match), ILIKE catches exact substrings, and "<<->" ranks by closeness.
+# Both are served by the idx_movies_title_trgm GiST index.
+SEARCH_MOVIE = """SELECT id, title, release_timestamp, trailer_url FROM movies
+    WHERE %s <%% title OR title ILIKE %s
+    ORDER BY %s <<-> title, id
+    LIMIT %s;
+"""
+# prefix matches served by the lower(title) text_pattern_ops index
+AUTOCOMPLETE_MOVIE = """SELECT id, title, release_timestamp, trailer_url FROM movies
+    WHERE lower(title) LIKE %s
+    ORDER BY lower(title), id
+    LIMIT %s;
+"""
 GET_MOVIE_TITLE = "SELECT title FROM movies WHERE id = %s;"
 
+# -- Prepared Statements --
+
+prepared_statements.register({
+    "insert_movies": INSERT_MOVIES,
+    "insert_user": INSERT_USER,
+    "select_upcoming_movies": SELECT_UPCOMING_MOVIES,
+    "select_movies": SELECT_MOVIES,
+    "select_movies_page": SELECT_MOVIES_PAGE,
+    "insert_reviewed_movie": INSERT_REVIEWED_MOVIE,
+    "select_reviewed_movies": SELECT_REVIEWED_MOVIES,
+    "select_movie_reviews": SELECT_MOVIE_REVIEWS,
+    "select_user_review_feed": SELECT_USER_REVIEW_FEED,
+    "select_user_reviews_since": SELECT_USER_REVIEWS_SINCE,
+    "select_movie_review_feed": SELECT_MOVIE_REVIEW_FEED,
+    "select_movie_reviews_since": SELECT_MOVIE_REVIEWS_SINCE,
+    "get_movie_title": GET_MOVIE_TITLE,
+    "select_movie_trailer_url": SELECT_MOVIE_TRAILER_URL,
+    "search_movie": SEARCH_MOVIE,
+    "autocomplete_movie": AUTOCOMPLETE_MOVIE,
+})
+
+# -- SQLite --
+# The schema the migrations leave on PostGreSQL, for STORAGE_BACKEND=sqlite, and the
+# statements SQLite spells differently (see storage.py)
+
+SQLITE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS movies (
+        id INTEGER PRIMARY KEY,
+        title TEXT,
+        release_timestamp REAL,
+        trailer_url TEXT
+    );""",
+    "CREATE INDEX IF NOT EXISTS idx_movies_release_id ON movies (release_timestamp, id);",
+    "CREATE INDEX IF NOT EXISTS idx_movies_title_release ON movies (title, release_timestamp);",
+    "CREATE INDEX IF NOT EXISTS idx_movies_title_lower ON movies (lower(title));",
+    CREATE_USERS_TABLE,
+    """CREATE TABLE IF NOT EXISTS reviews (
+        id INTEGER PRIMARY KEY,
+        user_username TEXT,
+        movie_id INTEGER,
+        review TEXT,
+        created_at REAL NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
+        FOREIGN KEY (user_username) REFERENCES users (username),
+        FOREIGN KEY (movie_id) REFERENCES movies (id)
+    );""",
+    "CREATE INDEX IF NOT EXISTS idx_reviews_user_created ON reviews (user_username, created_at, id, movie_id);",
+    "CREATE INDEX IF NOT EXISTS idx_reviews_movie_created ON reviews (movie_id, created_at, id, user_username);",
+]
+
+storage.register_sqlite({
+    LOCK_MOVIES: None,      # the merge's write transaction already keeps other writers out
+    MERGE_MOVIES_STAGING: """INSERT INTO movies (title, release_timestamp, trailer_url)
+        SELECT title, release_timestamp, MIN(trailer_url)
+        FROM movies_staging
+        WHERE NOT EXISTS (
+            SELECT 1 FROM movies
+            WHERE movies.title = movies_staging.title
+            AND movies.release_timestamp = movies_staging.release_timestamp
+        )
+        GROUP BY title, release_timestamp
+        ORDER BY title, release_timestamp;
+    """,
+    TRUNCATE_MOVIES_STAGING: "DELETE FROM movies_staging;",
+    # SQLite's REAL is a double, which the cursor token round trips exactly
+    SELECT_MOVIES_PAGE: """SELECT id, title, release_timestamp, trailer_url FROM movies
+        WHERE release_timestamp > %s AND (release_timestamp, id) > (%s, %s)
+        ORDER BY release_timestamp, id
+        LIMIT %s;
+    """,
+    # no trigram matching, so only titles containing the search match, earliest match first
+    SEARCH_MOVIE: """SELECT id, title, release_timestamp, trailer_url FROM movies
+        WHERE title LIKE ?2 ESCAPE '\\'
+        ORDER BY instr(lower(title), lower(?3)), id
+        LIMIT ?4;
+    """,
+    AUTOCOMPLETE_MOVIE: """SELECT id, title, release_timestamp, trailer_url FROM movies
+        WHERE lower(title) LIKE %s ESCAPE '\\'
+        ORDER BY lower(title), id
+        LIMIT %s;
+    """,
+})
+
+SEARCH_LIMIT = 20
+REVIEW_PAGE_SIZE = 20
+AUTOCOMPLETE_LIMIT = 10
+ITERSIZE = 500      # rows fetched per round trip by the streaming listings
+
+
 @contextmanager
 def get_cursor(connection):
-    with connection:
-        with connection.cursor() as cursor:
-            yield cursor
+    """One transaction; its cursor's statements are timed and labelled by instrumentation"""
+    with instrumentation.timed_transaction():
+        with connection:
+            with connection.cursor() as cursor:
+                yield instrumentation.wrap_cursor(cursor)
 
 
-def create_tables(connection):
+def add_movie(connection, title: str, release_timestamp: str, trailer_url: str):
     with get_cursor(connection) as cursor:
-        cursor.execute(CREATE_MOVIES_TABLE)
-        cursor.execute(CREATE_USERS_TABLE)
-        cursor.execute(CREATE_REVIEWS_TABLE)
-        cursor.execute(CREATE_RELEASE_INDEX)
+        execute(cursor, INSERT_MOVIES, (title, release_timestamp, trailer_url))
+    cache.trailer_urls.invalidate(title.lower())
 
 
-def add_movie(connection, title: str, release_timestamp: str, trailer_url: str):
+def import_movies(connection, movies: Iterable[Tuple[str, float, str]]) -> int:
+    """COPYs a batch of (title, release_timestamp, trailer_url) rows into the staging table
+    and merges them into movies, skipping any (title, release date) already there.
+    Returns how many movies were added"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(movies)
+    buffer.seek(0)
     with get_cursor(connection) as cursor:
-        cursor.execute(INSERT_MOVIES, (title, release_timestamp, trailer_url))
+        cursor.execute(CREATE_MOVIES_STAGING_TABLE)
+        cursor.copy_expert(COPY_MOVIES_STAGING, buffer)
+        cursor.execute(LOCK_MOVIES)
+        cursor.execute(MERGE_MOVIES_STAGING)
+        added = cursor.rowcount
+        cursor.execute(TRUNCATE_MOVIES_STAGING)
+    cache.trailer_urls.clear()
+    return added
 
 
 def add_user(connection, username: str):
     with get_cursor(connection) as cursor:
-        cursor.execute(INSERT_USER, (username, ))
+        execute(cursor, INSERT_USER, (username, ))
 
 
 def get_movies(connection, upcoming=False):
     with get_cursor(connection) as cursor:
         if upcoming:
-            today_timestamp = datetime.datetime.today().timestamp()
-            cursor.execute(SELECT_UPCOMING_MOVIES, (today_timestamp, ))
+            execute(cursor, SELECT_UPCOMING_MOVIES, (today_timestamp(), ))
         else:
-            cursor.execute(SELECT_MOVIES)
+            execute(cursor, SELECT_MOVIES)
         return cursor.fetchall()
 
 
+def today_timestamp() -> float:
+    return datetime.datetime.today().timestamp()
+
+
+def iter_movies(connection, upcoming: bool = False, itersize: int = ITERSIZE) -> Iterator[Movie]:
+    """Streams movies in release order through a server-side cursor, so only
+    itersize rows are held in memory at a time. Consume it inside get_connection()"""
+    with connection:
+        with connection.cursor(name="iter_movies") as cursor:
+            cursor.itersize = itersize
+            if upcoming:
+                cursor.execute(SELECT_UPCOMING_MOVIES, (today_timestamp(), ))
+            else:
+                cursor.execute(SELECT_MOVIES)
+            yield from cursor
+
+
+def get_movies_page(connection, page_size: int, cursor_token: Optional[str] = None,
+                    upcoming: bool = False) -> Tuple[List[Movie], Optional[str]]:
+    """One page of movies in release order, and the token for the next page (None on the last page)"""
+    with get_cursor(connection) as cursor:
+        execute(cursor, SELECT_MOVIES_PAGE, movies_page_params(page_size, cursor_token, upcoming))
+        return split_movies_page(cursor.fetchall(), page_size)
+
+
+def movies_page_params(page_size: int, cursor_token: Optional[str], upcoming: bool) -> tuple:
+    """SELECT_MOVIES_PAGE parameters, asking for one extra row to tell if there's a next page"""
+    release_timestamp, movie_id = float("-inf"), 0
+    if cursor_token:        # "<release_timestamp>:<id>" of the last movie on the previous page
+        timestamp_text, id_text = cursor_token.split(":")
+        release_timestamp, movie_id = float(timestamp_text), int(id_text)
+    after = today_timestamp() if upcoming else float("-inf")
+    return after, release_timestamp, movie_id, page_size + 1
+
+
+def split_movies_page(movies: List[Movie], page_size: int) -> Tuple[List[Movie], Optional[str]]:
+    if len(movies) <= page_size:
+        return movies, None
+    last_movie = movies[page_size - 1]
+    return movies[:page_size], f"{last_movie[2]!r}:{last_movie[0]}"
+
+
 def review_movie(connection, username: str, movie_id: str, review: str):
     with get_cursor(connection) as cursor:
-        cursor.execute(INSERT_REVIEWED_MOVIE, (username, movie_id, review))
+        execute(cursor, INSERT_REVIEWED_MOVIE, (username, movie_id, review))
 
 
 def get_reviewed_movies(connection, username: str):
+    """every review the user has written, newest first"""
     with get_cursor(connection) as cursor:
-        cursor.execute(SELECT_REVIEWED_MOVIES, (username, ))
+        execute(cursor, SELECT_REVIEWED_MOVIES, (username, ))
         return cursor.fetchall()
 
 
 def get_movie_reviews(connection, movie_id: str):
+    """every review of the movie, oldest first"""
     with get_cursor(connection) as cursor:
-        cursor.execute(SELECT_MOVIE_REVIEWS, (movie_id, ))
+        execute(cursor, SELECT_MOVIE_REVIEWS, (movie_id, ))
         return cursor.fetchall()
 
 
+# -- Review feeds --
+# Cursor tokens are "<created_at>:<id>" of a review, and feed functions return the token to
+# pass back for the next page or fetch. A review whose transaction commits after a later one
+# can be missed by a since fetch that ran in between; feeds read back in time are unaffected.
+
+def review_cursor_token(review) -> str:
+    return f"{review[1]!r}:{review[0]}"
+
+
+def parse_review_cursor(cursor_token: Optional[str], default: float) -> Tuple[float, int]:
+    if not cursor_token:
+        return default, 0
+    created_at_text, id_text = cursor_token.split(":")
+    return float(created_at_text), int(id_text)
+
+
+def _review_feed(connection, query: str, key, page_size: int, cursor_token: Optional[str]):
+    """One page back in time from cursor_token (from the newest without one), and the
+    token for the next page (None on the last page)"""
+    created_at, review_id = parse_review_cursor(cursor_token, float("inf"))
+    with get_cursor(connection) as cursor:
+        execute(cursor, query, (key, created_at, review_id, page_size + 1))
+        reviews = cursor.fetchall()
+    if len(reviews) <= page_size:
+        return reviews, None
+    return reviews[:page_size], review_cursor_token(reviews[page_size - 1])
+
+
+def _reviews_since(connection, query: str, key, cursor_token: Optional[str], limit: int):
+    """Up to limit reviews added after cursor_token, oldest first, and the token to fetch
+    the next ones with (cursor_token again when there are none)"""
+    created_at, review_id = parse_review_cursor(cursor_token, float("-inf"))
+    with get_cursor(connection) as cursor:
+        execute(cursor, query, (key, created_at, review_id, limit))
+        reviews = cursor.fetchall()
+    return reviews, review_cursor_token(reviews[-1]) if reviews else cursor_token
+
+
+def get_user_review_feed(connection, username: str, page_size: int = REVIEW_PAGE_SIZE,
+                         cursor_token: Optional[str] = None) -> Tuple[List[UserReview], Optional[str]]:
+    return _review_feed(connection, SELECT_USER_REVIEW_FEED, username, page_size, cursor_token)
+
+
+def get_user_reviews_since(connection, username: str, cursor_token: Optional[str] = None,
+                           limit: int = REVIEW_PAGE_SIZE) -> Tuple[List[UserReview], Optional[str]]:
+    return _reviews_since(connection, SELECT_USER_REVIEWS_SINCE, username, cursor_token, limit)
+
+
+def get_movie_review_feed(connection, movie_id: int, page_size: int = REVIEW_PAGE_SIZE,
+                          cursor_token: Optional[str] = None) -> Tuple[List[MovieReview], Optional[str]]:
+    return _review_feed(connection, SELECT_MOVIE_REVIEW_FEED, movie_id, page_size, cursor_token)
+
+
+def get_movie_reviews_since(connection, movie_id: int, cursor_token: Optional[str] = None,
+                            limit: int = REVIEW_PAGE_SIZE) -> Tuple[List[MovieReview], Optional[str]]:
+    return _reviews_since(connection, SELECT_MOVIE_REVIEWS_SINCE, movie_id, cursor_token, limit)
+
+
+def get_movie_title(connection, movie_id: int) -> Optional[str]:
+    def load():
+        with get_cursor(connection) as cursor:
+            execute(cursor, GET_MOVIE_TITLE, (movie_id, ))
+            movie = cursor.fetchone()
+            return movie[0] if movie else None
+    return cache.movie_titles.get_or_load(movie_id, load)
+
+
 def get_trailer_url(connection, title: str):
+    def load():
+        with get_cursor(connection) as cursor:
+            execute(cursor, SELECT_MOVIE_TRAILER_URL, (title, ))
+            return cursor.fetchone()
+    return cache.trailer_urls.get_or_load(title.lower(), load)
+
+
+def escape_like(text: str) -> str:
+    """stops % and _ typed by the user acting as LIKE wildcards"""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_movie(connection, search_input: str, limit: int = SEARCH_LIMIT):
+    """Case-insensitive, typo-tolerant title search, best matches first"""
     with get_cursor(connection) as cursor:
-        cursor.execute(SELECT_MOVIE_TRAILER_URL, (title, ))
-        return cursor.fetchone()
+        pattern = f"%{escape_like(search_input)}%"
+        execute(cursor, SEARCH_MOVIE, (search_input, pattern, search_input, limit))
+        return cursor.fetchall()
 
 
-def search_movie(connection, search_input: str):
+def autocomplete_movie(connection, prefix: str, limit: int = AUTOCOMPLETE_LIMIT):
+    """Movies whose title starts with prefix, ignoring case, in title order"""
     with get_cursor(connection) as cursor:
-        cursor.execute(SEARCH_MOVIE, (f"%{search_input}%", ))
+        execute(cursor, AUTOCOMPLETE_MOVIE, (f"{escape_like(prefix.lower())}%", limit))
         return cursor.fetchall()
+
+
+def iter_search_movie(connection, search_input: str, limit: int = SEARCH_LIMIT,
+                      itersize: int = ITERSIZE) -> Iterator[Movie]:
+    """search_movie results streamed through a server-side cursor"""
+    with connection:
+        with connection.cursor(name="iter_search_movie") as cursor:
+            cursor.itersize = itersize
+            pattern = f"%{escape_like(search_input)}%"
+            cursor.execute(SEARCH_MOVIE, (search_input, pattern, search_input, limit))
+            yield from cursor
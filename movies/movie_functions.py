@@ -1,6 +1,8 @@
-import webbrowser
 import datetime
+from itertools import chain
 from movies import movie_database
+import instrumentation
+import migrations
 from connection_pool import get_connection
 
 MOVIE_MENU = """Please select an option from the following:
@@ -20,6 +22,9 @@ MOVIE_MENU = """Please select an option from the following:
 
 Your selection: """
 
+PAGE_SIZE = 20
+MORE_PROMPT = "Press Enter for more movies, or q to stop: "
+
 
 # -- Functions --
 
@@ -42,24 +47,37 @@ def prompt_add_user():
 
 
 def prompt_upcoming_movies():
-    with get_connection() as connection:
-        movies = movie_database.get_movies(connection, True)
-        print_movie_list("Upcoming", movies)
+    page_movie_list("Upcoming", upcoming=True)
 
 
 def prompt_movies():
-    with get_connection() as connection:
-        movies = movie_database.get_movies(connection)
-        print_movie_list("All", movies)
+    page_movie_list("All")
+
+
+def page_movie_list(heading, upcoming=False):
+    """prints PAGE_SIZE movies at a time, fetching each page only when asked for"""
+    print(f"-- {heading} movies --")
+    cursor_token = None
+    while True:
+        with get_connection(read_only=True) as connection:
+            movies, cursor_token = movie_database.get_movies_page(connection, PAGE_SIZE, cursor_token, upcoming)
+        _print_movies(movies)
+        if cursor_token is None or input(MORE_PROMPT).lower() == "q":
+            break
+    print("----\n")
 
 
 def print_movie_list(heading, movies):
     print(f"-- {heading} movies --")
+    _print_movies(movies)
+    print("----\n")
+
+
+def _print_movies(movies):
     for _id, title, release_date, _ in movies:
         movie_date = datetime.datetime.fromtimestamp(release_date)
         date_string = movie_date.strftime("%b %d %Y")
         print(f"{_id}: {title} ({date_string})")
-    print("----\n")
 
 
 def prompt_review_movie():
@@ -74,14 +92,15 @@ def prompt_review_movie():
 
 
 def prompt_search_movie():
-    """finds any matches in the movie database based on whole
-    or part of words from user input"""
+    """finds the closest matches in the movie database based on whole
+    or part of words from user input, ignoring case and small typos"""
 
     search_input = input("Enter part of a movie title to search: ")
-    with get_connection() as connection:
-        movies = movie_database.search_movie(connection, search_input)
-        if movies:
-            print_movie_list("Found", movies)
+    with get_connection(read_only=True) as connection:
+        movies = movie_database.iter_search_movie(connection, search_input)
+        best_match = next(movies, None)
+        if best_match:
+            print_movie_list("Found", chain([best_match], movies))
         else:
             print(f"No movies found with '{search_input}'")
         print("\n")
@@ -92,7 +111,7 @@ def prompt_movie_reviews():
     """returns all reviews for a movie from different users"""
 
     movie_id = input("Enter the Movie ID# ")
-    with get_connection() as connection:
+    with get_connection(read_only=True) as connection:
         movies = movie_database.get_movie_reviews(connection, movie_id)
         if movies:
             title = movies[0][0]
@@ -105,31 +124,42 @@ def prompt_movie_reviews():
 
 
 def prompt_get_reviewed():
-    """returns multiple reviews of films the user has done"""
+    """returns the reviews of films the user has done, newest first, a page at a time"""
 
     username = input("username: ")
-    with get_connection() as connection:
-        movies = movie_database.get_reviewed_movies(connection, username)
-    if movies:
-        print_reviewed_list(username, movies)
-    else:
-        print(f"{username} has no reviewed movies")
-
-
-def print_reviewed_list(username: str, movies):
-    print(f"-- {username.capitalize()}'s reviewed movies --")
-    for title, _, review in movies:
-        print(f'{title}  - "{review}"')
+    cursor_token = None
+    while True:
+        with get_connection(read_only=True) as connection:
+            reviews, next_token = movie_database.get_user_review_feed(connection, username, PAGE_SIZE, cursor_token)
+        if cursor_token is None:
+            if not reviews:
+                print(f"{username} has no reviewed movies")
+                return
+            print(f"-- {username.capitalize()}'s reviewed movies --")
+        for _, _, _, title, review in reviews:
+            print(f'{title}  - "{review}"')
+        if next_token is None or input("Press Enter for more reviews, or q to stop: ").lower() == "q":
+            break
+        cursor_token = next_token
     print("----\n")
 
 
 def prompt_trailer_url():
     """opens the movie trailer on the default computer browser"""
 
-    with get_connection() as connection:
+    with get_connection(read_only=True) as connection:
         title = input("Enter movie title: ")
         url = movie_database.get_trailer_url(connection, title)
 
+        if url is None:     # suggest titles starting with what was typed
+            suggestions = movie_database.autocomplete_movie(connection, title)
+            print(f"No movie called '{title}'")
+            if suggestions:
+                print("Did you mean: " + ", ".join(movie[1] for movie in suggestions))
+            return
+
+        import webbrowser       # only needed once a trailer is opened
+
         try:
             webbrowser.open(url[0], new=0, autoraise=True)
         except Exception as e:
@@ -152,11 +182,11 @@ MENU_OPTIONS = {
 
 
 def menu_movie():
-    with get_connection() as connection:
-        movie_database.create_tables(connection)
+    migrations.ensure_schema()       # only migrates on the first menu visit
 
     while len(selection := input(MOVIE_MENU)) != 0:
         try:
-            MENU_OPTIONS[selection]()       # turns the menu mapped value into a function()
+            with instrumentation.action(MENU_OPTIONS[selection].__name__):      # labels its queries
+                MENU_OPTIONS[selection]()       # turns the menu mapped value into a function()
         except KeyError:
             print("Invalid command. Please try again.")
@@ -0,0 +1,37 @@
+import datetime
+from typing import List
+
+from polls import async_poll_database
+from polls.poll_database import Vote
+from async_connection_pool import get_async_connection
+
+
+class AsyncOption:
+    """asyncio counterpart of Option, each method awaits a pooled async connection"""
+    def __init__(self, options_text: str, poll_id: int, _id: int = None):
+        self.id = _id
+        self.text = options_text
+        self.poll_id = poll_id
+
+    def __repr__(self):
+        return f"AsyncOption({self.text!r}, {self.poll_id!r}, {self.id!r})"
+
+    async def save(self):
+        async with get_async_connection() as connection:
+            self.id = await async_poll_database.add_option(connection, self.text, self.poll_id)
+
+    @classmethod
+    async def get(cls, option_id: int) -> "AsyncOption":
+        async with get_async_connection() as connection:
+            option = await async_poll_database.get_option(connection, option_id)
+            return cls(option[1], option[2], option[0])
+
+    async def vote(self, username: str) -> bool:
+        current_timestamp = datetime.datetime.now(tz=datetime.timezone.utc).timestamp()
+        async with get_async_connection() as connection:
+            return await async_poll_database.add_vote(connection, username, current_timestamp, self.id)
+
+    #  Retrieves Tuple(votes.username, votes.option_id, votes.vote_timestamp)
+    async def votes(self) -> List[Vote]:
+        async with get_async_connection() as connection:
+            return await async_poll_database.get_votes_for_option(connection, self.id)
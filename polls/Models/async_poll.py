@@ -0,0 +1,53 @@
+from typing import List, Tuple
+from async_connection_pool import get_async_connection
+from polls import async_poll_database
+from polls.Models.async_option import AsyncOption
+
+
+class AsyncPoll:
+    """asyncio counterpart of Poll, each method awaits a pooled async connection"""
+    def __init__(self, title: str, owner: str, _id: int = None):
+        self.title = title
+        self.owner = owner
+        self.id = _id
+
+    def __repr__(self):
+        return f"AsyncPoll({self.title!r}, {self.owner!r}, {self.id!r})"
+
+    async def save(self):
+        async with get_async_connection() as connection:
+            self.id = await async_poll_database.create_poll(connection, self.title, self.owner)
+
+    async def add_option(self, option_text: str):
+        await AsyncOption(option_text, self.id).save()
+
+    async def options(self) -> List[AsyncOption]:
+        async with get_async_connection() as connection:
+            options = await async_poll_database.get_poll_options(connection, self.id)
+            return [AsyncOption(option[1], option[2], option[0]) for option in options]
+
+    async def tally(self) -> Tuple[List[Tuple[AsyncOption, int]], int]:
+        """counts votes for every option (zero-vote options included) and the poll total"""
+        async with get_async_connection() as connection:
+            rows = await async_poll_database.get_poll_tally(connection, self.id)
+        options = [(AsyncOption(row[1], self.id, row[0]), row[2]) for row in rows]
+        total_votes = rows[0][3] if rows else 0
+        return options, total_votes
+
+    @classmethod
+    async def get(cls, poll_id: int) -> "AsyncPoll":
+        async with get_async_connection() as connection:
+            poll = await async_poll_database.get_poll(connection, poll_id)
+            return cls(poll[1], poll[2], poll[0])
+
+    @classmethod
+    async def all(cls) -> List["AsyncPoll"]:
+        async with get_async_connection() as connection:
+            polls = await async_poll_database.get_polls(connection)
+            return [cls(poll[1], poll[2], poll[0]) for poll in polls]
+
+    @classmethod
+    async def latest(cls) -> "AsyncPoll":
+        async with get_async_connection() as connection:
+            poll = await async_poll_database.get_latest_poll(connection)
+            return cls(poll[1], poll[2], poll[0])
@@ -1,7 +1,8 @@
 import datetime
-from typing import List
-import pytz
+import secrets
+from typing import List, Tuple
 
+import cache
 from polls import poll_database
 from connection_pool import get_connection
 
@@ -23,20 +24,34 @@ class Option:
 
     @classmethod
     def get(cls, option_id: int) -> "Option":
+        option = cache.options.get(option_id, count_miss=False)      # skips the pool checkout when cached
+        if option is None:
+            with get_connection(read_only=True) as connection:
+                option = poll_database.get_option(connection, option_id)
+        return cls(option[1], option[2], option[0])
+
+    def vote(self, username: str, ) -> bool:
+        """False when username has already voted in this option's poll"""
         with get_connection() as connection:
-            option = poll_database.get_option(connection, option_id)
-            return cls(option[1], option[2], option[0])
-
-    def vote(self, username: str, ):
-        with get_connection() as connection:
-            current_datetime_utc = datetime.datetime.now(tz=pytz.utc)
+            current_datetime_utc = datetime.datetime.now(tz=datetime.timezone.utc)
             current_timestamp: float = current_datetime_utc.timestamp()
-            poll_database.add_vote(connection, username, current_timestamp, self.id)
-
-    #  Retrieves Tuple(votes.username, votes.option_id)
+            counted = poll_database.add_vote(connection, username, current_timestamp, self.id, self.poll_id)
+        if counted:
+            cache.poll_tallies.invalidate(self.poll_id)
+        return counted
+
+    def draw_winners(self, winners: int = 1, seed: int = None) -> Tuple[List[poll_database.Winner], int]:
+        """draws different voters for this option inside the database; returns them and
+        the seed used, which reproduces the draw"""
+        seed = secrets.randbits(32) if seed is None else seed
+        with get_connection(read_only=True) as connection:
+            drawn = poll_database.draw_winners(connection, self.poll_id, winners, seed, self.id)
+        return drawn, seed
+
+    #  Retrieves Tuple(votes.username, votes.option_id, votes.vote_timestamp)
     @property
     def votes(self) -> List[poll_database.Vote]:
-        with get_connection() as connection:
+        with get_connection(read_only=True) as connection:
             votes = poll_database.get_votes_for_option(connection, self.id)
             return votes
 
@@ -1,4 +1,6 @@
-from typing import List
+import secrets
+from typing import List, Tuple
+import cache
 from connection_pool import get_connection
 from polls import poll_database
 from polls.Models.option import Option
@@ -25,25 +27,51 @@ class Poll:
 
     @property
     def options(self) -> List[Option]:
-        with get_connection() as connection:
-            options = poll_database.get_poll_options(connection, self.id)
-            return [Option(option[1], option[2], option[0]) for option in options]
-            # returns (option_text, poll_id, id)
+        options = cache.poll_options.get(self.id, count_miss=False)      # skips the pool checkout when cached
+        if options is None:
+            with get_connection(read_only=True) as connection:
+                options = poll_database.get_poll_options(connection, self.id)
+        return [Option(option[1], option[2], option[0]) for option in options]
+        # returns (option_text, poll_id, id)
+
+
+    def tally(self) -> Tuple[List[Tuple[Option, int]], int]:
+        """counts votes for every option (zero-vote options included) and the poll total,
+        in a single aggregated query"""
+        rows = cache.poll_tallies.get(self.id, count_miss=False)
+        if rows is None:
+            with get_connection(read_only=True) as connection:
+                rows = poll_database.get_poll_tally(connection, self.id)
+                # returns (option id, option text, option votes, poll total votes)
+        options = [(Option(row[1], self.id, row[0]), row[2]) for row in rows]
+        total_votes = rows[0][3] if rows else 0
+        return options, total_votes
+
+
+    def draw_winners(self, winners: int = 1, seed: int = None) -> Tuple[List[poll_database.Winner], int]:
+        """draws different voters from across the whole poll inside the database; returns
+        them and the seed used, which reproduces the draw"""
+        seed = secrets.randbits(32) if seed is None else seed
+        with get_connection(read_only=True) as connection:
+            drawn = poll_database.draw_winners(connection, self.id, winners, seed)
+        return drawn, seed
 
 
     @classmethod
     def get(cls, poll_id: int) -> "Poll":
         """finds poll from poll id"""
-        with get_connection() as connection:
-            poll = poll_database.get_poll(connection, poll_id)
-            # returns poll.id, poll.title, poll.owner
-            return cls(poll[1], poll[2], poll[0])
+        poll = cache.polls.get(poll_id, count_miss=False)
+        if poll is None:
+            with get_connection(read_only=True) as connection:
+                poll = poll_database.get_poll(connection, poll_id)
+        # returns poll.id, poll.title, poll.owner
+        return cls(poll[1], poll[2], poll[0])
 
 
     @classmethod
     def all(cls) -> List["Poll"]:
         """retrieves all polls created, in multiple rows"""
-        with get_connection() as connection:
+        with get_connection(read_only=True) as connection:
             polls = poll_database.get_polls(connection)
             return [cls(poll[1], poll[2], poll[0]) for poll in polls]
             # return (poll title, poll owner, poll id)
@@ -52,6 +80,6 @@ class Poll:
     @classmethod
     def latest(cls) -> "Poll":
         """retrieves latest poll created"""
-        with get_connection() as connection:
+        with get_connection(read_only=True) as connection:
             poll = poll_database.get_latest_poll(connection)
             return cls(poll[1], poll[2], poll[0])
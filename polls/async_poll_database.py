@@ -0,0 +1,116 @@
+from contextlib import asynccontextmanager
+from typing import Iterable, List, Set
+from polls.poll_database import (
+    Poll, Option, Vote, OptionTally,
+    INSERT_VOTE, INSERT_POLL_RETURN_ID, INSERT_OPTION_RETURN_ID,
+    SELECT_ALL_POLLS, SELECT_POLL, SELECT_POLL_OPTIONS, SELECT_OPTION, SELECT_EXISTING_OPTION_IDS,
+    SELECT_LATEST_POLL, SELECT_VOTES_FOR_OPTION, SELECT_POLLS_VOTE_COUNT, SELECT_POLL_OPTION_VOTES,
+    SELECT_POLL_TALLY, GET_POLL_TITLE,
+)
+
+
+# asyncio versions of the poll_database functions, for psycopg 3 async connections
+# (see async_connection_pool). They share poll_database's SQL so both stay in step.
+
+# -- Functions --
+
+@asynccontextmanager
+async def get_cursor(connection):
+    async with connection.transaction():
+        async with connection.cursor() as cursor:
+            yield cursor
+
+
+# -- Polls --
+
+async def create_poll(connection, poll_title: str, owner: str):
+    async with get_cursor(connection) as cursor:
+        await cursor.execute(INSERT_POLL_RETURN_ID, (poll_title, owner))
+        poll_id = (await cursor.fetchone())[0]
+        return poll_id
+
+
+async def get_poll_title(connection, poll_id):
+    async with get_cursor(connection) as cursor:
+        await cursor.execute(GET_POLL_TITLE, (poll_id, ))
+        return (await cursor.fetchone())[0]
+
+
+async def get_polls(connection) -> List[Poll]:
+    async with get_cursor(connection) as cursor:
+        await cursor.execute(SELECT_ALL_POLLS)
+        return await cursor.fetchall()
+
+
+async def get_poll(connection, poll_id: int) -> Poll:
+    async with get_cursor(connection) as cursor:
+        await cursor.execute(SELECT_POLL, (poll_id, ))
+        return await cursor.fetchone()
+
+
+async def get_latest_poll(connection) -> Poll:
+    async with get_cursor(connection) as cursor:
+        await cursor.execute(SELECT_LATEST_POLL)
+        return await cursor.fetchone()
+
+
+# -- Options --
+
+async def get_poll_options(connection, poll_id: int) -> List[Option]:
+    async with get_cursor(connection) as cursor:
+        await cursor.execute(SELECT_POLL_OPTIONS, (poll_id, ))
+        return await cursor.fetchall()
+
+
+async def get_option(connection, option_id: int) -> Option:
+    async with get_cursor(connection) as cursor:
+        await cursor.execute(SELECT_OPTION, (option_id, ))
+        return await cursor.fetchone()
+
+
+async def add_option(connection, option_text: str, poll_id: int):
+    async with get_cursor(connection) as cursor:
+        await cursor.execute(INSERT_OPTION_RETURN_ID, (option_text, poll_id))
+        option_id = (await cursor.fetchone())[0]
+        return option_id
+
+
+async def get_existing_option_ids(connection, option_ids: Iterable[int]) -> Set[int]:
+    async with get_cursor(connection) as cursor:
+        await cursor.execute(SELECT_EXISTING_OPTION_IDS, (list(option_ids), ))
+        return {row[0] for row in await cursor.fetchall()}
+
+
+# -- Votes --
+
+async def add_vote(connection, username: str, vote_timestamp: float, option_id: int) -> bool:
+    """whether the vote was counted; not when the user has already voted in the option's poll"""
+    async with get_cursor(connection) as cursor:
+        await cursor.execute(INSERT_VOTE, (username, option_id, vote_timestamp))
+        return cursor.rowcount == 1
+
+
+async def get_votes_for_option(connection, option_id: int) -> List[Vote]:
+    async with get_cursor(connection) as cursor:
+        await cursor.execute(SELECT_VOTES_FOR_OPTION, (option_id, ))
+        return await cursor.fetchall()
+
+
+async def get_poll_tally(connection, poll_id: int) -> List[OptionTally]:
+    async with get_cursor(connection) as cursor:
+        await cursor.execute(SELECT_POLL_TALLY, (poll_id, ))
+        return await cursor.fetchall()
+
+
+# -- Chart --
+
+async def get_polls_vote_count(connection):
+    async with get_cursor(connection) as cursor:
+        await cursor.execute(SELECT_POLLS_VOTE_COUNT)
+        return await cursor.fetchall()
+
+
+async def get_poll_option_votes(connection, poll_id: int):
+    async with get_cursor(connection) as cursor:
+        await cursor.execute(SELECT_POLL_OPTION_VOTES, (poll_id, ))
+        return await cursor.fetchall()
@@ -1,13 +1,26 @@
-import matplotlib.pyplot as plt
+import argparse
+import datetime
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import cache
 from polls import poll_database
 
 
-def get_pie_chart(connection, options: str, poll_id: int):
-    """Creates pie graph with each part based on the amount of votes each option has"""
+# matplotlib takes a while to import, so it is only imported once a chart is drawn
+
+PIE_CHART_SIZE = (10, 10)
+BAR_CHART_SIZE = (8, 5)
+LINE_CHART_SIZE = (10, 5)
 
-    title = poll_database.get_poll_title(connection, poll_id)
+# rendered chart bytes, keyed by (poll id, tally version, image format) so a poll's
+# chart is only drawn again once its votes or options change
+chart_renders = cache.TTLCache("chart_renders", maxsize=256, ttl=3600)
 
-    figure = plt.figure(figsize=(10, 10))
+
+def _draw_pie_chart(figure, options, title: str):
     axes = figure.add_subplot(1, 1, 1)
     axes.pie(
         [option[1] for option in options],
@@ -15,22 +28,170 @@ def get_pie_chart(connection, options: str, poll_id: int):
         autopct="%1.1f%%"
     )
     axes.set_title(title)
-    return figure
 
 
-def create_polls_bar_chart(polls: str):
-    """Creates a bar graph based on the amount of votes each poll has"""
-
-    figure = plt.figure(figsize=(8, 5))
+def _draw_polls_bar_chart(figure, polls):
     figure.subplots_adjust(bottom=0.2)
     axes = figure.add_subplot(1, 1, 1)
     axes.set_title("Poll Vote Counts")
     axes.set_xlabel("Polls")
-    axes.set_xlabel("Number of votes per poll")
-    axes.bar(
-        range(len(polls)),
-        [poll[1] for poll in polls],
-        tick_label=[poll[0] for poll in polls]
-    )
-    plt.xticks(rotation=20, ha="right")
+    axes.set_ylabel("Number of votes per poll")
+    axes.bar(range(len(polls)), [poll[1] for poll in polls])
+    axes.set_xticks(range(len(polls)))
+    axes.set_xticklabels([poll[0] for poll in polls], rotation=20, ha="right")
+
+
+def vote_rate_series(rates: List[poll_database.VoteRate], window: str,
+                     now: Optional[float] = None) -> Tuple[List[int], Dict[int, List[int]]]:
+    """Every bucket start in the window, and each option's votes per bucket with the
+    buckets the rollups left out (no votes) filled in as 0"""
+    now = time.time() if now is None else now
+    bucket = poll_database.WINDOWS[window][1]
+    bucket_starts = list(range(poll_database.window_start(window, now), int(now) + 1, bucket))
+    positions = {bucket_start: position for position, bucket_start in enumerate(bucket_starts)}
+    series: Dict[int, List[int]] = {}
+    for bucket_start, option_id, votes in rates:
+        if bucket_start in positions:
+            series.setdefault(option_id, [0] * len(bucket_starts))[positions[bucket_start]] = votes
+    return bucket_starts, series
+
+
+def _draw_vote_rate_chart(figure, bucket_starts: List[int], series: Dict[int, List[int]],
+                          option_texts: Dict[int, str], title: str, window: str):
+    axes = figure.add_subplot(1, 1, 1)
+    times = [datetime.datetime.fromtimestamp(bucket_start) for bucket_start in bucket_starts]
+    for option_id, votes in sorted(series.items()):
+        axes.plot(times, votes, label=option_texts.get(option_id, str(option_id)))
+    per = "hour" if poll_database.WINDOWS[window][1] == poll_database.HOUR else "day"
+    axes.set_title(f"{title}: votes per {per} over the last {window}")
+    axes.set_ylabel(f"Votes per {per}")
+    if series:
+        axes.legend()
+    figure.autofmt_xdate()
+
+
+# -- Interactive charts, shown with plt.show() --
+# The caller closes the figure with plt.close(figure) once it has been shown.
+
+def get_pie_chart(options: str, title: str):
+    """Creates pie graph with each part based on the amount of votes each option has"""
+
+    import matplotlib.pyplot as plt
+
+    figure = plt.figure(figsize=PIE_CHART_SIZE)
+    _draw_pie_chart(figure, options, title)
+    return figure
+
+
+def create_polls_bar_chart(polls: str):
+    """Creates a bar graph based on the amount of votes each poll has"""
+
+    import matplotlib.pyplot as plt
+
+    figure = plt.figure(figsize=BAR_CHART_SIZE)
+    _draw_polls_bar_chart(figure, polls)
     return figure
+
+
+def get_vote_rate_chart(bucket_starts, series, option_texts, title: str, window: str):
+    """Creates a line graph of each option's votes per hour or day"""
+
+    import matplotlib.pyplot as plt
+
+    figure = plt.figure(figsize=LINE_CHART_SIZE)
+    _draw_vote_rate_chart(figure, bucket_starts, series, option_texts, title, window)
+    return figure
+
+
+# -- Headless rendering --
+# Figures are built directly on the Agg canvas, never registered with pyplot, and cleared
+# once saved, so a long-running process doesn't keep a Figure per chart.
+
+def _new_figure(figsize):
+    from matplotlib.figure import Figure
+    return Figure(figsize=figsize)
+
+
+def render_figure(figure, image_format: str = "png") -> bytes:
+    """PNG or SVG bytes of figure, releasing the figure's contents afterwards"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    FigureCanvasAgg(figure)
+    buffer = io.BytesIO()
+    try:
+        figure.savefig(buffer, format=image_format)
+    finally:
+        figure.clear()
+    return buffer.getvalue()
+
+
+def render_pie_chart(options, title: str, image_format: str = "png") -> bytes:
+    figure = _new_figure(PIE_CHART_SIZE)
+    _draw_pie_chart(figure, options, title)
+    return render_figure(figure, image_format)
+
+
+def render_polls_bar_chart(polls, image_format: str = "png") -> bytes:
+    figure = _new_figure(BAR_CHART_SIZE)
+    _draw_polls_bar_chart(figure, polls)
+    return render_figure(figure, image_format)
+
+
+def render_vote_rate_chart(bucket_starts, series, option_texts, title: str, window: str,
+                           image_format: str = "png") -> bytes:
+    figure = _new_figure(LINE_CHART_SIZE)
+    _draw_vote_rate_chart(figure, bucket_starts, series, option_texts, title, window)
+    return render_figure(figure, image_format)
+
+
+def render_poll_chart(poll_id: int, title: str, tally: List[poll_database.OptionTally],
+                      image_format: str = "png") -> Optional[bytes]:
+    """Pie chart of a poll's tally, from the render cache when the tally hasn't changed.
+    None when the poll has no votes to chart"""
+    options = [(option_text, votes) for _, option_text, votes, _ in tally if votes]
+    if not options:
+        return None
+    key = (poll_id, poll_database.tally_version(tally), image_format)
+    return chart_renders.get_or_load(key, lambda: render_pie_chart(options, title, image_format))
+
+
+# -- Batch rendering --
+
+def _render_poll_chart_job(job: Tuple[int, str, list, str]) -> Tuple[int, Optional[bytes]]:
+    """runs in a worker process, so it only draws; the database work stays in the parent"""
+    poll_id, title, tally, image_format = job
+    options = [(option_text, votes) for _, option_text, votes, _ in tally if votes]
+    return poll_id, render_pie_chart(options, title, image_format) if options else None
+
+
+def render_all_poll_charts(output_dir: str, image_format: str = "png", workers: Optional[int] = None) -> int:
+    """Renders every poll's pie chart into output_dir across a process pool.
+    Returns how many chart files were written"""
+    from connection_pool import get_connection     # worker processes never open connections
+
+    with get_connection(read_only=True) as connection:
+        jobs = [
+            (poll[0], poll[1], poll_database.get_poll_tally(connection, poll[0]), image_format)
+            for poll in poll_database.get_polls(connection)
+        ]
+
+    os.makedirs(output_dir, exist_ok=True)
+    written = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for poll_id, image in executor.map(_render_poll_chart_job, jobs, chunksize=8):
+            if image is not None:
+                with open(os.path.join(output_dir, f"poll_{poll_id}.{image_format}"), "wb") as file:
+                    file.write(image)
+                written += 1
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render every poll's pie chart to image files")
+    parser.add_argument("output_dir")
+    parser.add_argument("--format", choices=["png", "svg"], default="png")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    count = render_all_poll_charts(args.output_dir, args.format, args.workers)
+    print(f"Rendered {count} poll charts to {args.output_dir}")
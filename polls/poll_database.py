@@ -1,5 +1,20 @@
+import csv
+import datetime
+import gzip
+import hashlib
+import io
+import os
+import random
+import time
 from contextlib import contextmanager
-from typing import List, Tuple
+from typing import IO, Iterable, Iterator, List, Optional, Set, Tuple
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+import cache
+import instrumentation
+import prepared_statements
+import storage
+import vote_filter
+from prepared_statements import execute
 
 
 # -- Function Hints --
@@ -8,7 +23,21 @@ Poll = Tuple[int, str, str]     # polls.id, polls.title, polls.owner
 
 Option = Tuple[int, str, int]       # options.id, options.option_text, options.poll_id
 
-Vote = Tuple[str, int]      # votes.username, votes.option_id
+Vote = Tuple[str, int, int]      # votes.username, votes.option_id, votes.vote_timestamp
+
+OptionTally = Tuple[int, str, int, int]     # options.id, options.option_text, option votes, poll total votes
+
+CountDrift = Tuple[int, int, int]       # option or poll id, counted votes, actual votes
+
+VoteLogEntry = Tuple[str, str, str]     # options.option_text, votes.username, local vote time
+
+Winner = Tuple[str, int]        # votes.username, votes.option_id
+
+TrendingPoll = Tuple[int, str, int]     # polls.id, polls.title, votes in the window
+
+VoteRate = Tuple[int, int, int]     # bucket start timestamp, options.id, votes in the bucket
+
+ArchivedPartition = Tuple[str, int, str]      # partition table name, votes archived, archive file path
 
 
 # -- PostGreSQL Queries --
@@ -33,7 +62,160 @@ CREATE_VOTES_TABLE = """CREATE TABLE IF NOT EXISTS votes
     FOREIGN KEY (option_id) REFERENCES options (id)
 );"""
 
-INSERT_VOTE = "INSERT INTO votes (username, option_id, vote_timestamp) VALUES (%s, %s, %s);"
+# Vote counters are kept up to date by a statement level trigger on votes, so they are
+# written in the same transaction as the votes themselves, one upsert per statement.
+CREATE_OPTION_VOTE_COUNTS_TABLE = """CREATE TABLE IF NOT EXISTS option_vote_counts
+    (option_id INTEGER PRIMARY KEY,
+    votes BIGINT NOT NULL DEFAULT 0,
+    FOREIGN KEY (option_id) REFERENCES options (id)
+);"""
+
+CREATE_POLL_VOTE_COUNTS_TABLE = """CREATE TABLE IF NOT EXISTS poll_vote_counts
+    (poll_id INTEGER PRIMARY KEY,
+    votes BIGINT NOT NULL DEFAULT 0,
+    FOREIGN KEY (poll_id) REFERENCES polls (id)
+);"""
+
+CREATE_COUNT_VOTES_FUNCTION = """CREATE OR REPLACE FUNCTION count_new_votes() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO option_vote_counts (option_id, votes)
+        SELECT option_id, COUNT(*) FROM new_votes
+        WHERE option_id IS NOT NULL
+        GROUP BY option_id
+        ORDER BY option_id
+    ON CONFLICT (option_id) DO UPDATE SET votes = option_vote_counts.votes + EXCLUDED.votes;
+
+    INSERT INTO poll_vote_counts (poll_id, votes)
+        SELECT options.poll_id, COUNT(*) FROM new_votes
+        JOIN options ON options.id = new_votes.option_id
+        WHERE options.poll_id IS NOT NULL
+        GROUP BY options.poll_id
+        ORDER BY options.poll_id
+    ON CONFLICT (poll_id) DO UPDATE SET votes = poll_vote_counts.votes + EXCLUDED.votes;
+
+    INSERT INTO vote_rollups_hourly (poll_id, bucket_start, option_id, votes)
+        SELECT options.poll_id, new_votes.vote_timestamp - new_votes.vote_timestamp % 3600, new_votes.option_id, COUNT(*)
+        FROM new_votes
+        JOIN options ON options.id = new_votes.option_id
+        WHERE options.poll_id IS NOT NULL AND new_votes.vote_timestamp IS NOT NULL
+        GROUP BY 1, 2, 3
+        ORDER BY 1, 2, 3
+    ON CONFLICT (poll_id, bucket_start, option_id) DO UPDATE SET votes = vote_rollups_hourly.votes + EXCLUDED.votes;
+
+    INSERT INTO vote_rollups_daily (poll_id, bucket_start, option_id, votes)
+        SELECT options.poll_id, new_votes.vote_timestamp - new_votes.vote_timestamp % 86400, new_votes.option_id, COUNT(*)
+        FROM new_votes
+        JOIN options ON options.id = new_votes.option_id
+        WHERE options.poll_id IS NOT NULL AND new_votes.vote_timestamp IS NOT NULL
+        GROUP BY 1, 2, 3
+        ORDER BY 1, 2, 3
+    ON CONFLICT (poll_id, bucket_start, option_id) DO UPDATE SET votes = vote_rollups_daily.votes + EXCLUDED.votes;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;"""
+
+# Votes per option per hour and per (UTC) day, folded in by the same trigger. Trending polls and
+# vote rate charts read only these, so their cost follows the number of buckets, not votes.
+CREATE_VOTE_ROLLUPS_HOURLY_TABLE = """CREATE TABLE IF NOT EXISTS vote_rollups_hourly
+    (poll_id INTEGER NOT NULL,
+    bucket_start INTEGER NOT NULL,
+    option_id INTEGER NOT NULL,
+    votes BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (poll_id, bucket_start, option_id),
+    FOREIGN KEY (option_id) REFERENCES options (id)
+);"""
+CREATE_VOTE_ROLLUPS_DAILY_TABLE = """CREATE TABLE IF NOT EXISTS vote_rollups_daily
+    (poll_id INTEGER NOT NULL,
+    bucket_start INTEGER NOT NULL,
+    option_id INTEGER NOT NULL,
+    votes BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (poll_id, bucket_start, option_id),
+    FOREIGN KEY (option_id) REFERENCES options (id)
+);"""
+# trending scans one window of buckets across every poll
+CREATE_VOTE_ROLLUPS_HOURLY_BUCKET_INDEX = """CREATE INDEX IF NOT EXISTS idx_vote_rollups_hourly_bucket
+    ON vote_rollups_hourly (bucket_start) INCLUDE (poll_id, votes);"""
+CREATE_VOTE_ROLLUPS_DAILY_BUCKET_INDEX = """CREATE INDEX IF NOT EXISTS idx_vote_rollups_daily_bucket
+    ON vote_rollups_daily (bucket_start) INCLUDE (poll_id, votes);"""
+
+# only created when missing, so databases set up before schema migrations keep theirs
+CREATE_COUNT_VOTES_TRIGGER = """DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'count_votes' AND tgrelid = 'votes'::regclass) THEN
+        CREATE TRIGGER count_votes AFTER INSERT ON votes
+            REFERENCING NEW TABLE AS new_votes
+            FOR EACH STATEMENT EXECUTE FUNCTION count_new_votes();
+    END IF;
+END;
+$$;"""
+
+# -- One vote per user per poll --
+# votes is partitioned by time, so a unique index on it would have to include vote_timestamp.
+# poll_voters holds a row per user per poll voted in instead, and a vote only goes into votes
+# when its poll_voters row could be added, in the same statement. poll_id comes from the voted
+# option's row, so it needs no foreign key check of its own.
+CREATE_POLL_VOTERS_TABLE = """CREATE TABLE IF NOT EXISTS poll_voters
+    (poll_id INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    PRIMARY KEY (poll_id, username)
+);"""
+# users who voted more than once before the rule keep those votes, but can't add more
+INSERT_POLL_VOTERS_FROM_VOTES = """
+    INSERT INTO poll_voters (poll_id, username)
+    SELECT DISTINCT options.poll_id, votes.username FROM votes
+    JOIN options ON options.id = votes.option_id
+    WHERE options.poll_id IS NOT NULL AND votes.username IS NOT NULL
+    ON CONFLICT (poll_id, username) DO NOTHING
+;"""
+# inserts nothing when the user has already voted in the poll. A missing option gives a NULL
+# poll_id, which fails as the foreign key on votes did
+INSERT_VOTE = """
+    WITH vote AS (SELECT %s::TEXT AS username, %s::INTEGER AS option_id, %s::BIGINT AS vote_timestamp),
+    voter AS (
+        INSERT INTO poll_voters (poll_id, username)
+        SELECT (SELECT poll_id FROM options WHERE options.id = vote.option_id), vote.username FROM vote
+        ON CONFLICT (poll_id, username) DO NOTHING
+        RETURNING username
+    )
+    INSERT INTO votes (username, option_id, vote_timestamp)
+    SELECT username, option_id, vote_timestamp FROM vote WHERE EXISTS (SELECT 1 FROM voter)
+;"""
+# bulk loads COPY into a per-session staging table, then keep each user's earliest vote in
+# every poll they haven't voted in yet. Votes for options that don't exist are dropped
+CREATE_VOTES_STAGING = """CREATE TEMP TABLE IF NOT EXISTS votes_staging
+    (username TEXT,
+    option_id INTEGER,
+    vote_timestamp BIGINT
+);"""
+CLEAR_VOTES_STAGING = "TRUNCATE votes_staging;"
+COPY_VOTES = "COPY votes_staging (username, option_id, vote_timestamp) FROM STDIN WITH (FORMAT csv);"
+INSERT_STAGED_VOTES = """
+    WITH staged AS (
+        SELECT DISTINCT ON (options.poll_id, votes_staging.username)
+            options.poll_id, votes_staging.username, votes_staging.option_id, votes_staging.vote_timestamp
+        FROM votes_staging
+        JOIN options ON options.id = votes_staging.option_id
+        WHERE options.poll_id IS NOT NULL
+        ORDER BY options.poll_id, votes_staging.username, votes_staging.vote_timestamp
+    ), voters AS (
+        INSERT INTO poll_voters (poll_id, username)
+        SELECT poll_id, username FROM staged
+        ON CONFLICT (poll_id, username) DO NOTHING
+        RETURNING poll_id, username
+    )
+    INSERT INTO votes (username, option_id, vote_timestamp)
+    SELECT staged.username, staged.option_id, staged.vote_timestamp
+    FROM staged
+    JOIN voters ON voters.poll_id = staged.poll_id AND voters.username = staged.username
+;"""
+# who voted in each poll since a time, for warming up the recent voter filter. It scans the
+# partitions from that time on rather than an index (see migrations.CHECKED_QUERIES)
+SELECT_RECENT_POLL_VOTERS = """
+    SELECT DISTINCT options.poll_id, votes.username FROM votes
+    JOIN options ON options.id = votes.option_id
+    WHERE votes.vote_timestamp >= %s AND options.poll_id IS NOT NULL AND votes.username IS NOT NULL
+;"""
+
 INSERT_POLL_RETURN_ID = "INSERT INTO polls (title, owner) VALUES (%s, %s) RETURNING id;"
 INSERT_OPTION_RETURN_ID = "INSERT INTO options (option_text, poll_id) VALUES (%s, %s) RETURNING id;"
 
@@ -41,115 +223,737 @@ SELECT_ALL_POLLS = "SELECT * FROM polls"
 SELECT_POLL = "SELECT * FROM polls WHERE id = %s;"
 SELECT_POLL_OPTIONS = "SELECT * FROM options WHERE poll_id = %s;"
 SELECT_OPTION = "SELECT * FROM options WHERE id = %s;"
+SELECT_EXISTING_OPTION_IDS = "SELECT id FROM options WHERE id = ANY(%s);"
 SELECT_LATEST_POLL = "SELECT * FROM polls WHERE id = (SELECT id FROM polls ORDER BY id DESC LIMIT 1);"
-SELECT_VOTES_FOR_OPTION = "SELECT * FROM votes WHERE option_id = %s;"
+SELECT_VOTES_FOR_OPTION = "SELECT username, option_id, vote_timestamp FROM votes WHERE option_id = %s;"
+# the time bound lets PostGreSQL skip the partitions holding older votes
+SELECT_VOTES_FOR_OPTION_SINCE = """SELECT username, option_id, vote_timestamp FROM votes
+    WHERE option_id = %s AND vote_timestamp >= %s;"""
 SELECT_POLLS_VOTE_COUNT = """
-    SELECT polls.title, COUNT(votes.option_id) FROM polls
-    JOIN options ON options.poll_id = polls.id
-    JOIN votes ON options.id = votes.option_id
-    GROUP BY polls.title
+    SELECT polls.title, COALESCE(poll_vote_counts.votes, 0) FROM polls
+    LEFT JOIN poll_vote_counts ON poll_vote_counts.poll_id = polls.id
+    ORDER BY polls.id
 ;"""
 SELECT_POLL_OPTION_VOTES = """
-    SELECT option_text, COUNT(votes.option_id) FROM options 
-    JOIN polls ON options.poll_id = polls.id
-    JOIN votes ON options.id = votes.option_id
-    WHERE poll_id = %s
-    GROUP BY options.id
+    SELECT options.option_text, option_vote_counts.votes FROM options
+    JOIN option_vote_counts ON option_vote_counts.option_id = options.id
+    WHERE options.poll_id = %s
+    ORDER BY options.id
+;"""
+SELECT_POLL_TALLY = """
+    SELECT options.id, options.option_text, COALESCE(option_vote_counts.votes, 0),
+        SUM(COALESCE(option_vote_counts.votes, 0)) OVER ()
+    FROM options
+    LEFT JOIN option_vote_counts ON option_vote_counts.option_id = options.id
+    WHERE options.poll_id = %s
+    ORDER BY options.id
 ;"""
 GET_POLL_TITLE = "SELECT title FROM polls WHERE id = %s;"
 
+# Every vote in a poll in time order, with the time converted to a local time zone by
+# PostGreSQL. No trailing ';' so COPY can wrap it for CSV export
+POLL_VOTE_LOG = """
+    SELECT options.option_text AS option, votes.username AS username,
+        to_char(to_timestamp(votes.vote_timestamp) AT TIME ZONE %s, 'YYYY-MM-DD HH24:MI') AS voted_at
+    FROM votes
+    JOIN options ON options.id = votes.option_id
+    WHERE options.poll_id = %s
+    ORDER BY votes.vote_timestamp, votes.id
+"""
+# -- Winner draws --
+# A draw picks random positions among a poll's votes (ordered by option id, then vote id)
+# and reads the voter at each one, so only the winning rows ever leave the database.
+SET_REPEATABLE_READ = "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;"    # counts and votes from one snapshot
+SELECT_POLL_OPTION_VOTE_COUNTS = """
+    SELECT options.id, COALESCE(option_vote_counts.votes, 0) FROM options
+    LEFT JOIN option_vote_counts ON option_vote_counts.option_id = options.id
+    WHERE options.poll_id = %s
+    ORDER BY options.id
+;"""
+# the offset is walked on the (option_id, id) index alone, then one row is read by primary key;
+# the key includes vote_timestamp, so only the partition holding that row is searched
+SELECT_VOTER_AT_OFFSET = """
+    SELECT username FROM votes
+    WHERE (id, vote_timestamp) = (
+        SELECT id, vote_timestamp FROM votes WHERE option_id = %s ORDER BY id OFFSET %s LIMIT 1
+    )
+;"""
+COPY_POLL_VOTE_LOG = f"COPY ({POLL_VOTE_LOG}) TO STDOUT WITH (FORMAT csv, HEADER)"
+
+# -- Trending and vote rates, from the rollups --
+# Windows are rounded out to whole buckets: the last hour and day are summed from hourly
+# buckets, the last week and month from daily ones.
+SELECT_TRENDING_POLLS_HOURLY = """
+    SELECT polls.id, polls.title, trending.votes FROM (
+        SELECT poll_id, SUM(votes) AS votes FROM vote_rollups_hourly
+        WHERE bucket_start >= %s
+        GROUP BY poll_id
+        ORDER BY votes DESC, poll_id
+        LIMIT %s
+    ) AS trending
+    JOIN polls ON polls.id = trending.poll_id
+    ORDER BY trending.votes DESC, polls.id
+;"""
+SELECT_TRENDING_POLLS_DAILY = SELECT_TRENDING_POLLS_HOURLY.replace("vote_rollups_hourly", "vote_rollups_daily")
+SELECT_POLL_VOTE_RATE_HOURLY = """
+    SELECT bucket_start, option_id, votes FROM vote_rollups_hourly
+    WHERE poll_id = %s AND bucket_start >= %s
+    ORDER BY bucket_start, option_id
+;"""
+SELECT_POLL_VOTE_RATE_DAILY = SELECT_POLL_VOTE_RATE_HOURLY.replace("vote_rollups_hourly", "vote_rollups_daily")
+
+# -- Vote Counter Maintenance --
+
+SELECT_VOTE_COUNTS_EXIST = "SELECT EXISTS (SELECT 1 FROM option_vote_counts) OR NOT EXISTS (SELECT 1 FROM votes);"
+LOCK_VOTES = "LOCK TABLE votes IN SHARE MODE;"       # holds off new votes while counting
+DELETE_OPTION_VOTE_COUNTS = "DELETE FROM option_vote_counts;"
+DELETE_POLL_VOTE_COUNTS = "DELETE FROM poll_vote_counts;"
+# the rollups from a timestamp on; the buckets before it can hold archived votes, which are
+# no longer in the votes table to be counted again
+DELETE_VOTE_ROLLUPS_HOURLY = "DELETE FROM vote_rollups_hourly WHERE bucket_start >= %s;"
+DELETE_VOTE_ROLLUPS_DAILY = "DELETE FROM vote_rollups_daily WHERE bucket_start >= %s;"
+INSERT_OPTION_VOTE_COUNTS_FROM_VOTES = """
+    INSERT INTO option_vote_counts (option_id, votes)
+    SELECT option_id, COUNT(*) FROM votes
+    WHERE option_id IS NOT NULL
+    GROUP BY option_id
+;"""
+INSERT_POLL_VOTE_COUNTS_FROM_VOTES = """
+    INSERT INTO poll_vote_counts (poll_id, votes)
+    SELECT options.poll_id, COUNT(*) FROM votes
+    JOIN options ON options.id = votes.option_id
+    WHERE options.poll_id IS NOT NULL
+    GROUP BY options.poll_id
+;"""
+INSERT_VOTE_ROLLUPS_HOURLY_FROM_VOTES = """
+    INSERT INTO vote_rollups_hourly (poll_id, bucket_start, option_id, votes)
+    SELECT options.poll_id, votes.vote_timestamp - votes.vote_timestamp %% 3600, votes.option_id, COUNT(*)
+    FROM votes
+    JOIN options ON options.id = votes.option_id
+    WHERE options.poll_id IS NOT NULL AND votes.vote_timestamp >= %s
+    GROUP BY 1, 2, 3
+;"""
+INSERT_VOTE_ROLLUPS_DAILY_FROM_VOTES = """
+    INSERT INTO vote_rollups_daily (poll_id, bucket_start, option_id, votes)
+    SELECT options.poll_id, votes.vote_timestamp - votes.vote_timestamp %% 86400, votes.option_id, COUNT(*)
+    FROM votes
+    JOIN options ON options.id = votes.option_id
+    WHERE options.poll_id IS NOT NULL AND votes.vote_timestamp >= %s
+    GROUP BY 1, 2, 3
+;"""
+# -- Vote Partitions --
+# votes is range partitioned by month of vote_timestamp (UTC), in tables named votes_yYYYYmMM,
+# with votes_default catching anything outside them. Partitions are created a few months
+# ahead; old ones are detached, dumped to gzipped CSV files and dropped.
+
+CREATE_PARTITIONED_VOTES_TABLE = """CREATE TABLE votes
+    (id BIGINT NOT NULL DEFAULT nextval('votes_id_seq'),
+    username TEXT,
+    option_id INTEGER,
+    vote_timestamp BIGINT NOT NULL,
+    PRIMARY KEY (id, vote_timestamp),
+    FOREIGN KEY (option_id) REFERENCES options (id)
+) PARTITION BY RANGE (vote_timestamp);"""
+CREATE_DEFAULT_VOTE_PARTITION = "CREATE TABLE IF NOT EXISTS votes_default PARTITION OF votes DEFAULT;"
+CREATE_VOTES_OPTION_INDEX = "CREATE INDEX IF NOT EXISTS idx_votes_option_id ON votes (option_id, id);"
+LOCK_VOTE_PARTITIONS = "SELECT pg_advisory_xact_lock(hashtext('vote_partitions'));"     # one creator at a time
+SELECT_VOTE_PARTITIONS = """
+    SELECT child.relname, child.reltuples::BIGINT FROM pg_inherits
+    JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+    WHERE pg_inherits.inhparent = 'votes'::regclass
+    ORDER BY child.relname
+;"""
+# partitions detached by an archive run that stopped before dumping and dropping them
+SELECT_DETACHED_VOTE_PARTITIONS = """
+    SELECT relname FROM pg_class
+    WHERE relkind = 'r' AND NOT relispartition AND relname ~ '^votes_y[0-9]{4}m[0-9]{2}$'
+    ORDER BY relname
+;"""
+# a month's votes that arrived before its partition existed are moved out of votes_default
+CREATE_VOTE_PARTITION_TABLE = "CREATE TABLE {name} (LIKE votes INCLUDING DEFAULTS);"
+MOVE_DEFAULT_VOTES = """
+    WITH moved AS (
+        DELETE FROM votes_default WHERE vote_timestamp >= %s AND vote_timestamp < %s
+        RETURNING id, username, option_id, vote_timestamp
+    )
+    INSERT INTO {name} (id, username, option_id, vote_timestamp) SELECT * FROM moved
+;"""
+ATTACH_VOTE_PARTITION = "ALTER TABLE votes ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s);"
+DETACH_VOTE_PARTITION = "ALTER TABLE votes DETACH PARTITION {name};"
+# archived votes are taken off the counters, which must match the votes table for winner draws.
+# The hourly and daily rollups keep them, so trends and vote rate charts still cover them
+SUBTRACT_ARCHIVED_OPTION_VOTE_COUNTS = """
+    UPDATE option_vote_counts SET votes = option_vote_counts.votes - archived.votes
+    FROM (SELECT option_id, COUNT(*) AS votes FROM {name} GROUP BY option_id) AS archived
+    WHERE option_vote_counts.option_id = archived.option_id
+;"""
+SUBTRACT_ARCHIVED_POLL_VOTE_COUNTS = """
+    UPDATE poll_vote_counts SET votes = poll_vote_counts.votes - archived.votes
+    FROM (
+        SELECT options.poll_id, COUNT(*) AS votes FROM {name}
+        JOIN options ON options.id = {name}.option_id
+        GROUP BY options.poll_id
+    ) AS archived
+    WHERE poll_vote_counts.poll_id = archived.poll_id
+;"""
+COPY_VOTE_PARTITION = "COPY {name} (id, username, option_id, vote_timestamp) TO STDOUT WITH (FORMAT csv, HEADER);"
+DROP_VOTE_PARTITION = "DROP TABLE {name};"
+
+SELECT_OPTION_VOTE_COUNT_DRIFT = """
+    SELECT COALESCE(counted.option_id, actual.option_id), COALESCE(counted.votes, 0), COALESCE(actual.votes, 0)
+    FROM option_vote_counts AS counted
+    FULL JOIN (
+        SELECT option_id, COUNT(*) AS votes FROM votes
+        WHERE option_id IS NOT NULL
+        GROUP BY option_id
+    ) AS actual ON actual.option_id = counted.option_id
+    WHERE COALESCE(counted.votes, 0) <> COALESCE(actual.votes, 0)
+    ORDER BY 1
+;"""
+SELECT_POLL_VOTE_COUNT_DRIFT = """
+    SELECT COALESCE(counted.poll_id, actual.poll_id), COALESCE(counted.votes, 0), COALESCE(actual.votes, 0)
+    FROM poll_vote_counts AS counted
+    FULL JOIN (
+        SELECT options.poll_id, COUNT(*) AS votes FROM votes
+        JOIN options ON options.id = votes.option_id
+        WHERE options.poll_id IS NOT NULL
+        GROUP BY options.poll_id
+    ) AS actual ON actual.poll_id = counted.poll_id
+    WHERE COALESCE(counted.votes, 0) <> COALESCE(actual.votes, 0)
+    ORDER BY 1
+;"""
+
+VOTE_LOG_TIMEZONE = os.environ.get("VOTE_LOG_TIMEZONE", "Europe/London")
+ITERSIZE = 2000     # vote log rows fetched per round trip
+HOUR = 3600
+DAY = 24 * HOUR
+# window -> (seconds, bucket size, trending query, vote rate query)
+WINDOWS = {
+    "hour": (HOUR, HOUR, SELECT_TRENDING_POLLS_HOURLY, SELECT_POLL_VOTE_RATE_HOURLY),
+    "day": (DAY, HOUR, SELECT_TRENDING_POLLS_HOURLY, SELECT_POLL_VOTE_RATE_HOURLY),
+    "week": (7 * DAY, DAY, SELECT_TRENDING_POLLS_DAILY, SELECT_POLL_VOTE_RATE_DAILY),
+    "month": (30 * DAY, DAY, SELECT_TRENDING_POLLS_DAILY, SELECT_POLL_VOTE_RATE_DAILY),
+}
+TRENDING_LIMIT = 10
+DRAW_ATTEMPTS_PER_WINNER = 20       # vote positions draw_winners tries per winner before it gives up
+PARTITION_MONTHS_AHEAD = int(os.environ.get("VOTE_PARTITION_MONTHS_AHEAD", 3))
+
+# -- Prepared Statements --
+
+prepared_statements.register({
+    "insert_poll_return_id": INSERT_POLL_RETURN_ID,
+    "select_all_polls": SELECT_ALL_POLLS,
+    "select_poll": SELECT_POLL,
+    "select_poll_options": SELECT_POLL_OPTIONS,
+    "select_option": SELECT_OPTION,
+    "insert_option_return_id": INSERT_OPTION_RETURN_ID,
+    "select_existing_option_ids": SELECT_EXISTING_OPTION_IDS,
+    "insert_vote": INSERT_VOTE,
+    "select_votes_for_option": SELECT_VOTES_FOR_OPTION,
+    "select_votes_for_option_since": SELECT_VOTES_FOR_OPTION_SINCE,
+    "select_poll_tally": SELECT_POLL_TALLY,
+    "select_latest_poll": SELECT_LATEST_POLL,
+    "select_polls_vote_count": SELECT_POLLS_VOTE_COUNT,
+    "select_poll_option_votes": SELECT_POLL_OPTION_VOTES,
+    "get_poll_title": GET_POLL_TITLE,
+    "select_poll_option_vote_counts": SELECT_POLL_OPTION_VOTE_COUNTS,
+    "select_voter_at_offset": SELECT_VOTER_AT_OFFSET,
+    "select_trending_polls_hourly": SELECT_TRENDING_POLLS_HOURLY,
+    "select_trending_polls_daily": SELECT_TRENDING_POLLS_DAILY,
+    "select_poll_vote_rate_hourly": SELECT_POLL_VOTE_RATE_HOURLY,
+    "select_poll_vote_rate_daily": SELECT_POLL_VOTE_RATE_DAILY,
+})
+
+# -- SQLite --
+# The schema the migrations leave on PostGreSQL, for STORAGE_BACKEND=sqlite, and the
+# statements SQLite spells differently (see storage.py). SQLite has no statement level
+# triggers, so the counters and rollups are added to one vote at a time.
+
+# BEFORE INSERT, so a repeat vote is skipped (RAISE(IGNORE) drops just that row) before the
+# counting trigger sees it. A missing option fails on the NULL poll_id, as in PostGreSQL
+SQLITE_POLL_VOTERS_SCHEMA = [
+    CREATE_POLL_VOTERS_TABLE,
+    INSERT_POLL_VOTERS_FROM_VOTES,
+    """CREATE TRIGGER IF NOT EXISTS one_vote_per_poll BEFORE INSERT ON votes
+    BEGIN
+        SELECT RAISE(IGNORE) FROM poll_voters
+            WHERE poll_id = (SELECT poll_id FROM options WHERE id = NEW.option_id) AND username = NEW.username;
+        INSERT INTO poll_voters (poll_id, username)
+            VALUES ((SELECT poll_id FROM options WHERE id = NEW.option_id), NEW.username);
+    END;""",
+]
+
+SQLITE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS polls
+        (id INTEGER PRIMARY KEY,
+        title TEXT,
+        owner TEXT);
+    """,
+    """CREATE TABLE IF NOT EXISTS options
+        (id INTEGER PRIMARY KEY,
+        option_text TEXT,
+        poll_id INTEGER,
+        FOREIGN KEY (poll_id) REFERENCES polls (id)
+    );""",
+    "CREATE INDEX IF NOT EXISTS idx_options_poll_id ON options (poll_id);",
+    """CREATE TABLE IF NOT EXISTS votes
+        (id INTEGER PRIMARY KEY,
+        username TEXT,
+        option_id INTEGER,
+        vote_timestamp INTEGER NOT NULL,
+        FOREIGN KEY (option_id) REFERENCES options (id)
+    );""",
+    CREATE_VOTES_OPTION_INDEX,
+    CREATE_OPTION_VOTE_COUNTS_TABLE,
+    CREATE_POLL_VOTE_COUNTS_TABLE,
+    CREATE_VOTE_ROLLUPS_HOURLY_TABLE,
+    CREATE_VOTE_ROLLUPS_DAILY_TABLE,
+    "CREATE INDEX IF NOT EXISTS idx_vote_rollups_hourly_bucket ON vote_rollups_hourly (bucket_start, poll_id, votes);",
+    "CREATE INDEX IF NOT EXISTS idx_vote_rollups_daily_bucket ON vote_rollups_daily (bucket_start, poll_id, votes);",
+    """CREATE TRIGGER IF NOT EXISTS count_votes AFTER INSERT ON votes
+    BEGIN
+        INSERT INTO option_vote_counts (option_id, votes)
+            SELECT NEW.option_id, 1 WHERE NEW.option_id IS NOT NULL
+        ON CONFLICT (option_id) DO UPDATE SET votes = votes + 1;
+
+        INSERT INTO poll_vote_counts (poll_id, votes)
+            SELECT poll_id, 1 FROM options WHERE id = NEW.option_id AND poll_id IS NOT NULL
+        ON CONFLICT (poll_id) DO UPDATE SET votes = votes + 1;
+
+        INSERT INTO vote_rollups_hourly (poll_id, bucket_start, option_id, votes)
+            SELECT poll_id, NEW.vote_timestamp - NEW.vote_timestamp % 3600, NEW.option_id, 1 FROM options
+            WHERE id = NEW.option_id AND poll_id IS NOT NULL
+        ON CONFLICT (poll_id, bucket_start, option_id) DO UPDATE SET votes = votes + 1;
+
+        INSERT INTO vote_rollups_daily (poll_id, bucket_start, option_id, votes)
+            SELECT poll_id, NEW.vote_timestamp - NEW.vote_timestamp % 86400, NEW.option_id, 1 FROM options
+            WHERE id = NEW.option_id AND poll_id IS NOT NULL
+        ON CONFLICT (poll_id, bucket_start, option_id) DO UPDATE SET votes = votes + 1;
+    END;""",
+    *SQLITE_POLL_VOTERS_SCHEMA,
+]
+
+# vote_log_time is a Python function storage.py adds to each SQLite connection
+SQLITE_POLL_VOTE_LOG = """
+    SELECT options.option_text AS option, votes.username AS username,
+        vote_log_time(votes.vote_timestamp, %s) AS voted_at
+    FROM votes
+    JOIN options ON options.id = votes.option_id
+    WHERE options.poll_id = %s
+    ORDER BY votes.vote_timestamp, votes.id
+"""
+
+storage.register_sqlite({
+    # whole seconds, as PostGreSQL stores them in the BIGINT column. The one_vote_per_poll
+    # trigger skips repeat votes, leaving rowcount 0 as in PostGreSQL
+    INSERT_VOTE: "INSERT INTO votes (username, option_id, vote_timestamp) VALUES (%s, %s, CAST(round(%s) AS INTEGER));",
+    CLEAR_VOTES_STAGING: "DELETE FROM votes_staging;",
+    # earliest first, so the trigger keeps each user's earliest vote in a poll
+    INSERT_STAGED_VOTES: """
+        INSERT INTO votes (username, option_id, vote_timestamp)
+        SELECT votes_staging.username, votes_staging.option_id, votes_staging.vote_timestamp FROM votes_staging
+        JOIN options ON options.id = votes_staging.option_id
+        WHERE options.poll_id IS NOT NULL
+        ORDER BY votes_staging.vote_timestamp
+    ;""",
+    SELECT_EXISTING_OPTION_IDS: "SELECT id FROM options WHERE id IN (SELECT value FROM json_each(%s));",
+    SELECT_VOTER_AT_OFFSET: """
+        SELECT username FROM votes
+        WHERE id = (SELECT id FROM votes WHERE option_id = %s ORDER BY id LIMIT 1 OFFSET %s)
+    ;""",
+    POLL_VOTE_LOG: SQLITE_POLL_VOTE_LOG,
+    COPY_POLL_VOTE_LOG: f"COPY ({SQLITE_POLL_VOTE_LOG}) TO STDOUT WITH (FORMAT csv, HEADER)",
+    SET_REPEATABLE_READ: None,      # SQLite transactions always read from one snapshot
+    LOCK_VOTES: None,       # rebuilding is a write transaction, which already keeps votes out
+})
+
 # -- Functions --
 
 @contextmanager
 def get_cursor(connection):
-    with connection:
-        with connection.cursor() as cursor:
-            yield cursor
-
+    """One transaction; its cursor's statements are timed and labelled by instrumentation"""
+    with instrumentation.timed_transaction():
+        with connection:
+            with connection.cursor() as cursor:
+                yield instrumentation.wrap_cursor(cursor)
 
-def create_tables(connection):
-    with get_cursor(connection) as cursor:
-        cursor.execute(CREATE_POLLS_TABLE)
-        cursor.execute(CREATE_POLL_OPTIONS_TABLE)
-        cursor.execute(CREATE_VOTES_TABLE)
 
 # -- Polls --
 
 def create_poll(connection, poll_title: str, owner: str):
     with get_cursor(connection) as cursor:
-        cursor.execute(INSERT_POLL_RETURN_ID, (poll_title, owner))
+        execute(cursor, INSERT_POLL_RETURN_ID, (poll_title, owner))
         poll_id = cursor.fetchone()[0]
-        return poll_id
+    cache.polls.invalidate(poll_id)
+    return poll_id
 
 
 def get_poll_title(connection, poll_id):
-    with get_cursor(connection) as cursor:
-        cursor.execute(GET_POLL_TITLE, (poll_id, ))
-        return cursor.fetchone()[0]
+    """read from the cached poll row"""
+    return get_poll(connection, poll_id)[1]
 
 
 def get_polls(connection) -> List[Poll]:
     with get_cursor(connection) as cursor:
-        cursor.execute(SELECT_ALL_POLLS)
+        execute(cursor, SELECT_ALL_POLLS)
         return cursor.fetchall()
 
 
 def get_poll(connection, poll_id: int) -> Poll:
     """Poll Type = Tuple[int, str, int] and not the Models class Poll"""
-    with get_cursor(connection) as cursor:
-        cursor.execute(SELECT_POLL, (poll_id,))
-        return cursor.fetchone()
+    def load():
+        with get_cursor(connection) as cursor:
+            execute(cursor, SELECT_POLL, (poll_id,))
+            return cursor.fetchone()
+    return cache.polls.get_or_load(poll_id, load)
 
 
 # -- Options --
 
 def get_poll_options(connection, poll_id: int) -> List[Option]:
-    with get_cursor(connection) as cursor:
-        cursor.execute(SELECT_POLL_OPTIONS, (poll_id,))
-        return cursor.fetchall()
+    def load():
+        with get_cursor(connection) as cursor:
+            execute(cursor, SELECT_POLL_OPTIONS, (poll_id,))
+            return cursor.fetchall()
+    return cache.poll_options.get_or_load(poll_id, load)
 
 
 def get_option(connection, option_id: int) -> Option:
-    with get_cursor(connection) as cursor:
-        cursor.execute(SELECT_OPTION, (option_id,))
-        return cursor.fetchone()
+    def load():
+        with get_cursor(connection) as cursor:
+            execute(cursor, SELECT_OPTION, (option_id,))
+            return cursor.fetchone()
+    return cache.options.get_or_load(option_id, load)
 
 
 def add_option(connection, option_text: str, poll_id: int) -> Option:
     with get_cursor(connection) as cursor:
-        cursor.execute(INSERT_OPTION_RETURN_ID, (option_text, poll_id))
+        execute(cursor, INSERT_OPTION_RETURN_ID, (option_text, poll_id))
         option_id = cursor.fetchone()[0]
-        return option_id
+    # the poll's option list and tally now include the new option
+    cache.poll_options.invalidate(poll_id)
+    cache.poll_tallies.invalidate(poll_id)
+    return option_id
 
 
-# -- Votes --
-
-def add_vote(connection, username: str, vote_timestamp: float, option_id: int):
+def get_existing_option_ids(connection, option_ids: Iterable[int]) -> Set[int]:
+    """Which of the given option ids exist, checked in one query"""
     with get_cursor(connection) as cursor:
-        cursor.execute(INSERT_VOTE, (username, option_id, vote_timestamp))
+        execute(cursor, SELECT_EXISTING_OPTION_IDS, (list(option_ids), ))
+        return {row[0] for row in cursor.fetchall()}
+
 
+# -- Votes --
+
+def add_vote(connection, username: str, vote_timestamp: float, option_id: int,
+             poll_id: Optional[int] = None) -> bool:
+    """Records the vote unless the user has already voted in the option's poll, and returns
+    whether it was counted. Repeat votes the recent voter filter knows of are turned away
+    without a query; poll_id saves looking the option up for it when the caller knows it"""
+    if poll_id is None:
+        option = get_option(connection, option_id)      # cached; a missing option fails in the INSERT
+        poll_id = option[2] if option else None
+    checked = vote_filter.recent_voters.check(poll_id, username) if poll_id is not None else vote_filter.NEW
+    if checked == vote_filter.REPEAT:
+        return False
 
-def get_votes_for_option(connection, option_id: int) -> List[Vote]:
     with get_cursor(connection) as cursor:
-        cursor.execute(SELECT_VOTES_FOR_OPTION, (option_id, ))
+        execute(cursor, INSERT_VOTE, (username, option_id, vote_timestamp))
+        counted = cursor.rowcount == 1
+    if poll_id is not None:
+        vote_filter.recent_voters.record(poll_id, username, counted, checked)
+    return counted
+
+
+def copy_votes(connection, votes: Iterable[Tuple[str, int, int]]) -> int:
+    """Bulk inserts (username, option_id, vote_timestamp) rows in one transaction, with one
+    COPY into the staging table and one INSERT from it, and returns the votes added. Only each
+    user's earliest vote in a poll they haven't voted in is added. The vote counters are
+    updated once for the whole batch by their statement trigger"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(votes)
+    buffer.seek(0)
+    with get_cursor(connection) as cursor:
+        cursor.execute(CREATE_VOTES_STAGING)
+        cursor.execute(CLEAR_VOTES_STAGING)
+        cursor.copy_expert(COPY_VOTES, buffer)
+        cursor.execute(INSERT_STAGED_VOTES)
+        added = cursor.rowcount
+    cache.poll_tallies.clear()
+    return added
+
+
+def warm_vote_filter(connection, since: Optional[float] = None) -> int:
+    """Loads who voted in each poll since the timestamp (VOTE_FILTER_WARM_DAYS ago by default)
+    into the recent voter filter, streamed through a server-side cursor. Returns the pairs loaded"""
+    since = time.time() - vote_filter.WARM_DAYS * DAY if since is None else since
+    loaded = 0
+    with connection:
+        with connection.cursor(name="warm_vote_filter") as cursor:
+            cursor.itersize = ITERSIZE
+            cursor.execute(SELECT_RECENT_POLL_VOTERS, (int(since), ))
+            for poll_id, username in cursor:
+                vote_filter.recent_voters.add(poll_id, username)
+                loaded += 1
+    return loaded
+
+
+def get_votes_for_option(connection, option_id: int, since: Optional[int] = None) -> List[Vote]:
+    """An option's votes, only those cast at or after the since timestamp when it's given,
+    which only reads the partitions that can hold them"""
+    with get_cursor(connection) as cursor:
+        if since is None:
+            execute(cursor, SELECT_VOTES_FOR_OPTION, (option_id, ))
+        else:
+            execute(cursor, SELECT_VOTES_FOR_OPTION_SINCE, (option_id, since))
         return cursor.fetchall()
 
 
+def get_poll_tally(connection, poll_id: int) -> List[OptionTally]:
+    """Vote count for every option of a poll, including options with no votes,
+    and the poll total on each row. Read from the vote counters in one query,
+    and cached for a few seconds so busy result pages share it"""
+    def load():
+        with get_cursor(connection) as cursor:
+            execute(cursor, SELECT_POLL_TALLY, (poll_id, ))
+            return cursor.fetchall()
+    return cache.poll_tallies.get_or_load(poll_id, load)
+
+
+def tally_version(tally: List[OptionTally]) -> str:
+    """Changes whenever a poll gains an option or a vote, for cache keys and ETags"""
+    counts = ",".join(f"{option_id}:{votes}" for option_id, _, votes, _ in tally)
+    return hashlib.sha1(counts.encode()).hexdigest()[:16]
+
+
 def get_latest_poll(connection) -> Poll:
     with get_cursor(connection) as cursor:
-        cursor.execute(SELECT_LATEST_POLL)
-        cursor.fetchone()
+        execute(cursor, SELECT_LATEST_POLL)
+        return cursor.fetchone()
+
+
+def iter_poll_vote_log(connection, poll_id: int, timezone: str = VOTE_LOG_TIMEZONE,
+                       itersize: int = ITERSIZE) -> Iterator[VoteLogEntry]:
+    """Streams a poll's votes in time order through a server-side cursor, itersize rows
+    per round trip, so memory stays flat however many votes there are"""
+    with connection:
+        with connection.cursor(name="iter_poll_vote_log") as cursor:
+            cursor.itersize = itersize
+            cursor.execute(POLL_VOTE_LOG, (timezone, poll_id))
+            yield from cursor
+
+
+def export_poll_vote_log(connection, poll_id: int, file: IO[str], timezone: str = VOTE_LOG_TIMEZONE):
+    """Writes a poll's vote log to file as CSV, streamed from COPY ... TO STDOUT"""
+    with get_cursor(connection) as cursor:
+        copy_query = cursor.mogrify(COPY_POLL_VOTE_LOG, (timezone, poll_id)).decode()
+        cursor.copy_expert(copy_query, file)
+
+
+def draw_winners(connection, poll_id: int, winners: int, seed: int,
+                 option_id: Optional[int] = None) -> List[Winner]:
+    """Draws up to `winners` different voters from a poll, or from one of its options.
+
+    Positions are picked by random.Random(seed) over the vote counters, so the same seed
+    against the same votes always draws the same winners. A position whose voter was
+    already drawn is skipped, and at most DRAW_ATTEMPTS_PER_WINNER positions per winner are
+    tried, so memory and queries grow with the number of winners, not the number of votes.
+    Fewer winners come back when the voters run out, or when most positions belong to voters
+    already drawn (only if the counters have drifted, as each user votes once per poll)."""
+    rng = random.Random(seed)
+    drawn: List[Winner] = []
+    with get_cursor(connection) as cursor:
+        # only a transaction's first statement can set its isolation level, and not inside a
+        # savepoint, so in a longer transaction (script mode) the draw reads from that one
+        if connection.get_transaction_status() == TRANSACTION_STATUS_IDLE:
+            cursor.execute(SET_REPEATABLE_READ)
+        execute(cursor, SELECT_POLL_OPTION_VOTE_COUNTS, (poll_id, ))
+        vote_counts = [row for row in cursor.fetchall() if option_id is None or row[0] == option_id]
+        total_votes = sum(votes for _, votes in vote_counts)
+
+        tried = set()
+        usernames = set()
+        attempts = min(total_votes, winners * DRAW_ATTEMPTS_PER_WINNER)
+        while len(drawn) < winners and len(tried) < attempts:
+            position = rng.randrange(total_votes)
+            if position in tried:
+                continue
+            tried.add(position)
+
+            for draw_option_id, votes in vote_counts:       # which option the position falls in
+                if position < votes:
+                    break
+                position -= votes
+            execute(cursor, SELECT_VOTER_AT_OFFSET, (draw_option_id, position))
+            voter = cursor.fetchone()       # None only if the counters have drifted from votes
+            if voter and voter[0] not in usernames:
+                usernames.add(voter[0])
+                drawn.append((voter[0], draw_option_id))
+    return drawn
 
 
 # -- Chart --
 
 def get_polls_vote_count(connection):
     with get_cursor(connection) as cursor:
-        cursor.execute(SELECT_POLLS_VOTE_COUNT)
+        execute(cursor, SELECT_POLLS_VOTE_COUNT)
         return cursor.fetchall()
 
 
 def get_poll_option_votes(connection, poll_id: int):
     with get_cursor(connection) as cursor:
-        cursor.execute(SELECT_POLL_OPTION_VOTES, (poll_id, ))
+        execute(cursor, SELECT_POLL_OPTION_VOTES, (poll_id, ))
+        return cursor.fetchall()
+
+
+# -- Trending --
+
+def window_start(window: str, now: Optional[float] = None) -> int:
+    """Start of the first bucket inside the window ending now"""
+    seconds, bucket, _, _ = WINDOWS[window]
+    since = int(time.time() if now is None else now) - seconds
+    return since - since % bucket
+
+
+def get_trending_polls(connection, window: str = "day", limit: int = TRENDING_LIMIT) -> List[TrendingPoll]:
+    """Polls with the most votes in the last hour, day, week or month, busiest first.
+    Cached briefly, as every reader of a window sees the same list"""
+    def load():
+        with get_cursor(connection) as cursor:
+            execute(cursor, WINDOWS[window][2], (window_start(window), limit))
+            return cursor.fetchall()
+    return cache.trending_polls.get_or_load((window, limit), load)
+
+
+def get_poll_vote_rate(connection, poll_id: int, window: str = "day") -> List[VoteRate]:
+    """Votes per option per bucket over the window: hourly buckets for an hour or day,
+    daily ones for a week or month. Buckets without votes are left out"""
+    with get_cursor(connection) as cursor:
+        execute(cursor, WINDOWS[window][3], (poll_id, window_start(window)))
         return cursor.fetchall()
+
+
+# -- Vote Partitions --
+
+def vote_partition_name(year: int, month: int) -> str:
+    return f"votes_y{year:04d}m{month:02d}"
+
+
+def vote_partition_bounds(name: str) -> Tuple[int, int]:
+    """First timestamp in a partition's month and the first one after it"""
+    year, month = int(name[7:11]), int(name[12:14])
+    start = datetime.datetime(year, month, 1, tzinfo=datetime.timezone.utc)
+    end = datetime.datetime(year + month // 12, month % 12 + 1, 1, tzinfo=datetime.timezone.utc)
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def vote_partition_months(first_timestamp: float, last_timestamp: float) -> Iterator[str]:
+    """Names of the monthly partitions from first_timestamp's month to last_timestamp's"""
+    first = datetime.datetime.fromtimestamp(first_timestamp, tz=datetime.timezone.utc)
+    last = datetime.datetime.fromtimestamp(last_timestamp, tz=datetime.timezone.utc)
+    year, month = first.year, first.month
+    while (year, month) <= (last.year, last.month):
+        yield vote_partition_name(year, month)
+        year, month = year + month // 12, month % 12 + 1
+
+
+def create_vote_partitions_in(cursor, first_timestamp: float, last_timestamp: float) -> List[str]:
+    """Creates the missing monthly partitions between the two timestamps on an open cursor,
+    moving any of their votes out of votes_default. Returns the names created"""
+    cursor.execute(LOCK_VOTE_PARTITIONS)
+    cursor.execute(SELECT_VOTE_PARTITIONS)
+    existing = {row[0] for row in cursor.fetchall()}
+    created = []
+    for name in vote_partition_months(first_timestamp, last_timestamp):
+        if name not in existing:
+            start, end = vote_partition_bounds(name)
+            cursor.execute(CREATE_VOTE_PARTITION_TABLE.format(name=name))
+            cursor.execute(MOVE_DEFAULT_VOTES.format(name=name), (start, end))
+            cursor.execute(ATTACH_VOTE_PARTITION.format(name=name), (start, end))
+            created.append(name)
+    return created
+
+
+def create_vote_partitions(connection, months_ahead: int = PARTITION_MONTHS_AHEAD) -> List[str]:
+    """Makes sure this month's partition and the next months_ahead exist"""
+    now = time.time()
+    with get_cursor(connection) as cursor:
+        return create_vote_partitions_in(cursor, now, now + months_ahead * 31 * DAY)
+
+
+def get_vote_partitions(connection) -> List[Tuple[str, int]]:
+    """(partition name, estimated votes) for every attached partition"""
+    with get_cursor(connection) as cursor:
+        cursor.execute(SELECT_VOTE_PARTITIONS)
+        return cursor.fetchall()
+
+
+def archive_vote_partitions(connection, before: int, output_dir: str) -> List[ArchivedPartition]:
+    """Detaches the monthly partitions that end at or before the `before` timestamp and takes
+    their votes off the counters in one transaction. Then it dumps each one to
+    <output_dir>/<partition>.csv.gz and drops it. A partition that was detached by an earlier
+    run but never dropped is dumped and dropped too."""
+    with get_cursor(connection) as cursor:
+        cursor.execute(LOCK_VOTE_PARTITIONS)
+        cursor.execute(SELECT_VOTE_PARTITIONS)
+        for name, _ in cursor.fetchall():
+            if name != "votes_default" and vote_partition_bounds(name)[1] <= before:
+                cursor.execute(DETACH_VOTE_PARTITION.format(name=name))
+                cursor.execute(SUBTRACT_ARCHIVED_OPTION_VOTE_COUNTS.format(name=name))
+                cursor.execute(SUBTRACT_ARCHIVED_POLL_VOTE_COUNTS.format(name=name))
+        cursor.execute(SELECT_DETACHED_VOTE_PARTITIONS)
+        detached = [row[0] for row in cursor.fetchall()]
+    cache.poll_tallies.clear()
+
+    os.makedirs(output_dir, exist_ok=True)
+    archived = []
+    for name in detached:
+        path = os.path.join(output_dir, f"{name}.csv.gz")
+        with get_cursor(connection) as cursor:
+            with gzip.open(path, "wt", newline="") as file:
+                cursor.copy_expert(COPY_VOTE_PARTITION.format(name=name), file)
+            votes = cursor.rowcount
+            cursor.execute(DROP_VOTE_PARTITION.format(name=name))       # only once the file is written
+        archived.append((name, votes, path))
+    return archived
+
+
+# -- Vote Counters --
+
+def live_votes_start(cursor) -> int:
+    """First timestamp of the oldest attached monthly partition; the months before it have
+    been archived, or never had a partition. 0 when votes isn't partitioned (SQLite)"""
+    if storage.is_sqlite(cursor.connection):
+        return 0
+    cursor.execute(SELECT_VOTE_PARTITIONS)
+    starts = [vote_partition_bounds(name)[0] for name, _ in cursor.fetchall() if name != "votes_default"]
+    return min(starts, default=0)
+
+
+def rebuild_vote_counts(connection):
+    """Recomputes every option and poll counter from the votes table, e.g. after a bulk load,
+    and the vote rollups from the oldest partition's month on. The rollups of archived months
+    are kept, as their votes are gone"""
+    with get_cursor(connection) as cursor:
+        cursor.execute(LOCK_VOTES)
+        since = live_votes_start(cursor)
+        cursor.execute(DELETE_OPTION_VOTE_COUNTS)
+        cursor.execute(DELETE_POLL_VOTE_COUNTS)
+        cursor.execute(DELETE_VOTE_ROLLUPS_HOURLY, (since, ))
+        cursor.execute(DELETE_VOTE_ROLLUPS_DAILY, (since, ))
+        cursor.execute(INSERT_OPTION_VOTE_COUNTS_FROM_VOTES)
+        cursor.execute(INSERT_POLL_VOTE_COUNTS_FROM_VOTES)
+        cursor.execute(INSERT_VOTE_ROLLUPS_HOURLY_FROM_VOTES, (since, ))
+        cursor.execute(INSERT_VOTE_ROLLUPS_DAILY_FROM_VOTES, (since, ))
+    cache.poll_tallies.clear()
+    cache.trending_polls.clear()
+
+
+def get_vote_count_drift(connection) -> Tuple[List[CountDrift], List[CountDrift]]:
+    """Options and polls whose counter doesn't match the votes table"""
+    with get_cursor(connection) as cursor:
+        cursor.execute(SELECT_OPTION_VOTE_COUNT_DRIFT)
+        option_drift = cursor.fetchall()
+        cursor.execute(SELECT_POLL_VOTE_COUNT_DRIFT)
+        poll_drift = cursor.fetchall()
+        return option_drift, poll_drift
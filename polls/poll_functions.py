@@ -1,8 +1,6 @@
-import datetime
-import random
 from typing import List
-import pytz
-import matplotlib.pyplot as plt
+import instrumentation
+import migrations
 from connection_pool import get_connection
 from polls import poll_database, charts
 from polls.Models.option import Option
@@ -18,6 +16,8 @@ POLL_MENU = """\nPlease pick an option:
     5) Select a random vote as a winner (tbc if value)
     6) View a bar chart of votes counts on all polls
     7) Select a poll to make into a pie chart
+    8) View trending polls
+    9) View a chart of a poll's votes over time
 
     Or press Enter to go back
   
@@ -25,6 +25,7 @@ Your selection:
 """
 
 NEW_OPTION_PROMPT = "Enter a new option text (or leave empty to stop adding options): "
+WINDOW_PROMPT = "Over the last hour, day, week or month? (default day) "
 
 
 # -- Functions --
@@ -52,7 +53,8 @@ def prompt_vote_poll():
 
     option_id = int(input("Enter the option id you want to vote for: "))
     username = input("Enter the username you want to vote as: ")
-    Option.get(option_id).vote(username)
+    if not Option.get(option_id).vote(username):
+        print(f"{username} has already voted in this poll")
 
 
 
@@ -65,16 +67,11 @@ def _print_poll_options(options: List[Option]):
 
 def show_poll_votes():
     poll_id = int(input("Enter the poll id you want to see votes for: "))
-    poll = Poll.get(poll_id)
-    options = poll.options
-
-    votes_per_option = [len(option.votes) for option in options]
-    total_votes = sum(votes_per_option)
+    options, total_votes = Poll.get(poll_id).tally()
 
     try:
         print("-- Poll votes --")
-        # zip() function to aggregate tuples crossing over values.
-        for option, votes in zip(options, votes_per_option):
+        for option, votes in options:
             percentage = votes / total_votes * 100
             print(f"{option.text}: {votes} votes   ({percentage:.2f}%)")
     except ZeroDivisionError:
@@ -83,57 +80,125 @@ def show_poll_votes():
     vote_log = input("\nWould you like to see the vote log? (y/N) ")
 
 
-    if vote_log == "y":     # retrieves username and timecode for each vote
-        _print_votes_for_options(options)
+    if vote_log == "y":     # retrieves username and local time for each vote
+        export_path = input("Enter a CSV file name to export it to, or press Enter to print it: ")
+        with get_connection(read_only=True) as connection:
+            if export_path:
+                with open(export_path, "w", newline="") as file:
+                    poll_database.export_poll_vote_log(connection, poll_id, file)
+                print(f"Vote log saved to {export_path}")
+            else:
+                _print_vote_log(poll_database.iter_poll_vote_log(connection, poll_id))
 
 
-def _print_votes_for_options(options: List[Option]):
-    for option in options:
-        print(f"{option.text}:")
-        for vote in option.votes:       # convert from timestamp to London time
-            native_datetime = datetime.datetime.utcfromtimestamp(vote[2])
-            utc_date = pytz.utc.localize(native_datetime)
-            local_date = utc_date.astimezone(pytz.timezone("Europe/London"))
-            local_date_as_str = local_date.strftime( "%Y-%m-%d %H:%M")
-            print(f"\t{vote[0]} at {local_date_as_str}")
+def _print_vote_log(vote_log):
+    for option_text, username, voted_at in vote_log:
+        print(f"\t{option_text}: {username} at {voted_at}")
 
 
 def randomise_poll_winner():
-    """selects a random voted option row, from a chosen poll & option"""
+    """draws random voters as winners, from a whole poll or one of its options"""
     poll_id = int(input("Enter a poll id you want to select a winner from: "))
     poll = Poll.get(poll_id)
-    _print_poll_options(poll.options)
+    options, _ = poll.tally()
+    for option, votes in options:
+        print(f"{option.id}: {option.text} ({votes} votes)")
+
+    option_id = input("Enter an option id to draw from (or leave empty for the whole poll): ")
+    winners = int(input("How many winners? (default 1) ") or 1)
+    seed = input("Enter a seed to repeat an earlier draw (or leave empty): ")
+    seed = int(seed) if seed else None
+
+    if option_id:
+        drawn, seed = Option.get(int(option_id)).draw_winners(winners, seed)
+    else:
+        drawn, seed = poll.draw_winners(winners, seed)
 
-    option_id = int(input("Enter an option id you want to select a winner from: "))
-    votes = Option.get(option_id).votes
-    winner = random.choice(votes)
-    print(f"The randomly selected winner is '{winner[0]}'")
+    if not drawn:
+        print("There are no votes to select a winner from")
+        return
+    option_texts = {option.id: option.text for option, _ in options}
+    for username, winning_option_id in drawn:
+        print(f"The randomly selected winner is '{username}' (voted {option_texts.get(winning_option_id)})")
+    print(f"Draw seed: {seed}")
 
 
 def _chart_options_for_poll(poll_id: int):
-    with get_connection() as connection:
-        options = poll_database.get_poll_option_votes(connection, poll_id)
+    import matplotlib.pyplot as plt     # only loaded when a chart is first shown
 
-        figure = charts.get_pie_chart(options)
-        plt.show()
+    poll = Poll.get(poll_id)
+    tally, _ = poll.tally()
+    # pie wedges only for options that have votes
+    options = [(option.text, votes) for option, votes in tally if votes]
+    if not options:
+        print("This poll has no votes to chart yet")
+        return
+
+    figure = charts.get_pie_chart(options, poll.title)
+    plt.show()
+    plt.close(figure)
 
 
 def prompt_select_poll():
-    with get_connection() as connection:
+    # the connection goes back to the pool before the prompt and the chart window wait on the user
+    with get_connection(read_only=True) as connection:
         polls = poll_database.get_polls(connection)
-        print("-- Polls --")
-        for poll in polls:
-            print(f"{poll[0]}: {poll[1]}")
+    print("-- Polls --")
+    for poll in polls:
+        print(f"{poll[0]}: {poll[1]}")
 
-        selected_poll = int(input("Enter poll id to create a pie chart: "))
-        _chart_options_for_poll(selected_poll)
+    selected_poll = int(input("Enter poll id to create a pie chart: "))
+    _chart_options_for_poll(selected_poll)
 
 
 def create_polls_bar_chart():
-    with get_connection() as connection:
+    import matplotlib.pyplot as plt
+
+    with get_connection(read_only=True) as connection:
         polls = poll_database.get_polls_vote_count(connection)
-        charts.create_polls_bar_chart(polls)
-        plt.show()
+        figure = charts.create_polls_bar_chart(polls)
+    plt.show()
+    plt.close(figure)
+
+
+def _prompt_window() -> str:
+    window = input(WINDOW_PROMPT).strip().lower() or "day"
+    if window not in poll_database.WINDOWS:
+        print(f"Unknown window '{window}', showing the last day")
+        window = "day"
+    return window
+
+
+def show_trending_polls():
+    """the polls with the most votes recently, read from the hourly and daily vote rollups"""
+    window = _prompt_window()
+    with get_connection(read_only=True) as connection:
+        trending = poll_database.get_trending_polls(connection, window)
+    if not trending:
+        print(f"No votes in the last {window}")
+        return
+    print(f"-- Trending polls, last {window} --")
+    for poll_id, title, votes in trending:
+        print(f"{poll_id}: {title} ({votes} votes)")
+
+
+def show_vote_rate_chart():
+    import matplotlib.pyplot as plt
+
+    poll_id = int(input("Enter poll id to chart its votes over time: "))
+    window = _prompt_window()
+    poll = Poll.get(poll_id)
+    with get_connection(read_only=True) as connection:
+        rates = poll_database.get_poll_vote_rate(connection, poll_id, window)
+    if not rates:
+        print(f"This poll has no votes in the last {window}")
+        return
+
+    bucket_starts, series = charts.vote_rate_series(rates, window)
+    option_texts = {option.id: option.text for option in poll.options}
+    figure = charts.get_vote_rate_chart(bucket_starts, series, option_texts, poll.title, window)
+    plt.show()
+    plt.close(figure)
 
 
 # -- Menu --
@@ -147,14 +212,16 @@ MENU_OPTIONS = {
     "5": randomise_poll_winner,
     "6": create_polls_bar_chart,
     "7": prompt_select_poll,
+    "8": show_trending_polls,
+    "9": show_vote_rate_chart,
 }
 
 def menu_poll():
-    with get_connection() as connection:
-        poll_database.create_tables(connection)
+    migrations.ensure_schema()       # only migrates on the first menu visit
 
     while len(selection := input(POLL_MENU)) != 0:
         try:
-            MENU_OPTIONS[selection]()       # turns the menu mapped value into a function()
+            with instrumentation.action(MENU_OPTIONS[selection].__name__):      # labels its queries
+                MENU_OPTIONS[selection]()       # turns the menu mapped value into a function()
         except KeyError:
             print("Invalid input selected. Please try again.")
@@ -0,0 +1,40 @@
+import argparse
+import sys
+from connection_pool import get_connection
+from polls import poll_database
+
+
+# Rebuilds or checks the option/poll vote counters against the votes table.
+#   python -m polls.vote_counts verify
+#   python -m polls.vote_counts rebuild
+
+def verify() -> bool:
+    with get_connection() as connection:
+        option_drift, poll_drift = poll_database.get_vote_count_drift(connection)
+
+    for label, drift in (("option", option_drift), ("poll", poll_drift)):
+        for _id, counted, actual in drift:
+            print(f"{label} {_id}: counter says {counted} votes, votes table has {actual}")
+
+    if option_drift or poll_drift:
+        print("Vote counters have drifted, run 'rebuild' to fix them")
+        return False
+    print("Vote counters match the votes table")
+    return True
+
+
+def rebuild():
+    with get_connection() as connection:
+        poll_database.rebuild_vote_counts(connection)
+    print("Vote counters rebuilt from the votes table")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the poll vote counters")
+    parser.add_argument("command", choices=["verify", "rebuild"])
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        rebuild()
+    elif not verify():
+        sys.exit(1)
@@ -0,0 +1,106 @@
+import argparse
+import csv
+import datetime
+import json
+import sys
+import time
+from itertools import islice
+from typing import Iterator, List, Optional, Set, Tuple
+from connection_pool import get_connection
+from polls import poll_database
+
+
+# Streams a kiosk vote file into the votes table in batches, one COPY per batch.
+#   python -m polls.vote_import votes.csv      (header: username,option_id,vote_timestamp)
+#   python -m polls.vote_import votes.jsonl    (one {"username", "option_id", "vote_timestamp"} per line)
+# Only one batch is held in memory at a time. Only a user's earliest vote in a poll is imported,
+# and none if they had already voted in it.
+
+BATCH_SIZE = 10_000
+MAX_REPORTED_ERRORS = 20
+
+VoteRow = Tuple[str, int, int]      # votes.username, votes.option_id, votes.vote_timestamp
+
+
+def _parse_timestamp(value) -> int:
+    """Unix seconds, or an ISO 8601 date time (UTC when no offset is given)"""
+    try:
+        return int(float(value))
+    except ValueError:
+        parsed = datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+        return int(parsed.timestamp())
+
+
+def _read_records(path: str) -> Iterator[dict]:
+    with open(path, newline="", encoding="utf-8") as file:
+        if path.endswith((".jsonl", ".ndjson", ".json")):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(file)
+
+
+def read_votes(path: str, errors: List[str]) -> Iterator[VoteRow]:
+    """Yields parsed vote rows, recording unparseable lines in errors instead of stopping"""
+    for line_number, record in enumerate(_read_records(path), start=1):
+        try:
+            yield record["username"], int(record["option_id"]), _parse_timestamp(record["vote_timestamp"])
+        except (KeyError, TypeError, ValueError) as e:
+            errors.append(f"record {line_number}: {e!r}")
+
+
+def import_votes(path: str, batch_size: int = BATCH_SIZE) -> Tuple[int, int, float]:
+    """Imports the file and returns (imported rows, rejected rows, seconds taken). Repeat votes,
+    by a user in a poll they have already voted in, are rejected rows too"""
+    errors: List[str] = []
+    valid_option_ids: Set[int] = set()
+    invalid_option_ids: Set[int] = set()
+    imported = rejected = repeats = 0
+    started = time.perf_counter()
+
+    votes = read_votes(path, errors)
+    with get_connection() as connection:
+        while batch := list(islice(votes, batch_size)):
+            # option ids not seen before are checked against options in one query per batch
+            unchecked = {vote[1] for vote in batch} - valid_option_ids - invalid_option_ids
+            if unchecked:
+                existing = poll_database.get_existing_option_ids(connection, unchecked)
+                valid_option_ids |= existing
+                invalid_option_ids |= unchecked - existing
+
+            accepted = [vote for vote in batch if vote[1] in valid_option_ids]
+            rejected += len(batch) - len(accepted)
+            if accepted:
+                added = poll_database.copy_votes(connection, accepted)
+                imported += added
+                repeats += len(accepted) - added
+
+            elapsed = time.perf_counter() - started
+            print(f"{imported} votes imported ({imported / elapsed:,.0f} rows/sec)", file=sys.stderr)
+
+    elapsed = time.perf_counter() - started
+    for error in errors[:MAX_REPORTED_ERRORS]:
+        print(f"Skipped {error}", file=sys.stderr)
+    if invalid_option_ids:
+        print(f"Unknown option ids: {sorted(invalid_option_ids)[:MAX_REPORTED_ERRORS]}", file=sys.stderr)
+    if repeats:
+        print(f"Skipped {repeats} repeat votes", file=sys.stderr)
+    return imported, rejected + repeats + len(errors), elapsed
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Bulk import votes from a CSV or JSON lines file")
+    parser.add_argument("path")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    imported, rejected, elapsed = import_votes(args.path, args.batch_size)
+    rate = imported / elapsed if elapsed else 0
+    print(f"Imported {imported} votes, rejected {rejected}, in {elapsed:.1f}s ({rate:,.0f} rows/sec)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import datetime
+import os
+import sys
+import storage
+from connection_pool import get_connection
+from polls import poll_database
+
+
+# Maintains the monthly partitions of the votes table.
+#   python -m polls.vote_partitions list
+#   python -m polls.vote_partitions create [--months-ahead 3]
+#   python -m polls.vote_partitions archive [--keep-months 12] [--output-dir vote_archive]
+# archive detaches every partition older than --keep-months, writes it to a gzipped CSV file in
+# --output-dir and drops it. Run create and archive from cron; the app also creates partitions
+# ahead when it starts.
+
+KEEP_MONTHS = int(os.environ.get("VOTE_RETENTION_MONTHS", 12))
+ARCHIVE_DIR = os.environ.get("VOTE_ARCHIVE_DIR", "vote_archive")
+
+
+def months_ago(months: int) -> int:
+    """Timestamp of the start of the month `months` before this one (UTC)"""
+    today = datetime.datetime.now(tz=datetime.timezone.utc)
+    year, month = divmod(today.year * 12 + today.month - 1 - months, 12)
+    return int(datetime.datetime(year, month + 1, 1, tzinfo=datetime.timezone.utc).timestamp())
+
+
+def list_partitions():
+    with get_connection() as connection:
+        for name, estimated_votes in poll_database.get_vote_partitions(connection):
+            if name == "votes_default":
+                span = "anything else"
+            else:
+                start, end = poll_database.vote_partition_bounds(name)
+                since = datetime.datetime.fromtimestamp(start, tz=datetime.timezone.utc)
+                until = datetime.datetime.fromtimestamp(end, tz=datetime.timezone.utc)
+                span = f"{since:%Y-%m-%d} to {until:%Y-%m-%d}"
+            print(f"{name:<16}{span:<28}~{estimated_votes} votes")
+
+
+def create(months_ahead: int):
+    with get_connection() as connection:
+        created = poll_database.create_vote_partitions(connection, months_ahead)
+    print(f"Created partitions {', '.join(created)}" if created else "Every partition already exists")
+
+
+def archive(keep_months: int, output_dir: str):
+    with get_connection() as connection:
+        archived = poll_database.archive_vote_partitions(connection, months_ago(keep_months), output_dir)
+    for name, votes, path in archived:
+        print(f"Archived {votes} votes from {name} to {path}")
+    if not archived:
+        print(f"No partitions older than {keep_months} months")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the monthly partitions of the votes table")
+    parser.add_argument("command", choices=["list", "create", "archive"])
+    parser.add_argument("--months-ahead", type=int, default=poll_database.PARTITION_MONTHS_AHEAD)
+    parser.add_argument("--keep-months", type=int, default=KEEP_MONTHS,
+                        help="whole months of votes kept before this month")
+    parser.add_argument("--output-dir", default=ARCHIVE_DIR)
+    args = parser.parse_args()
+
+    if storage.BACKEND == "sqlite":
+        sys.exit("Vote partitions are PostGreSQL only; an SQLite votes table isn't partitioned")
+    if args.command == "list":
+        list_partitions()
+    elif args.command == "create":
+        create(args.months_ahead)
+    else:
+        archive(args.keep_months, args.output_dir)
@@ -0,0 +1,77 @@
+import os
+import re
+import weakref
+from typing import Dict, Optional
+import storage
+
+
+# -- Per-connection prepared statements --
+# Registered queries are PREPAREd the first time they run on a connection and from then on
+# run with EXECUTE, so PostGreSQL parses and plans them once per connection instead of on
+# every call. Prepared statements live as long as the database session, so a connection
+# the pool replaces or recycles starts with none and prepares them again when first used.
+# Set DATABASE_PREPARED_STATEMENTS=0 to send plain query text instead (e.g. behind a
+# transaction-pooling proxy such as pgbouncer, which doesn't keep sessions). SQLite caches
+# its own compiled statements, so on that backend queries always go as text.
+
+PREPARED_BY_DEFAULT = os.environ.get("DATABASE_PREPARED_STATEMENTS", "1") != "0"
+enabled = PREPARED_BY_DEFAULT
+
+_statement_names: Dict[str, str] = {}       # query text -> statement name
+_queries: Dict[str, str] = {}       # statement name -> query text
+_prepared_on = weakref.WeakKeyDictionary()  # connection -> names prepared in its session
+
+_PLACEHOLDER = re.compile(r"%%|%s")
+
+
+def register(queries: Dict[str, str]):
+    """Registers {statement name: query} so execute() runs them as prepared statements"""
+    for name, query in queries.items():
+        _statement_names[query] = name
+        _queries[name] = query
+
+
+def statement_name(query: str) -> Optional[str]:
+    return _statement_names.get(query)
+
+
+def registered_query(name: str) -> Optional[str]:
+    return _queries.get(name)
+
+
+def _to_prepare_sql(name: str, query: str) -> str:
+    """PREPARE takes $1, $2... placeholders rather than psycopg2's %s"""
+    count = 0
+
+    def numbered(match):
+        nonlocal count
+        if match.group() == "%%":
+            return "%"
+        count += 1
+        return f"${count}"
+
+    return f"PREPARE {name} AS {_PLACEHOLDER.sub(numbered, query)}"
+
+
+def execute(cursor, query: str, params: tuple = ()):
+    """cursor.execute(query, params), through the query's prepared statement when it has one"""
+    name = _statement_names.get(query)
+    if name is None or not enabled or storage.is_sqlite(cursor.connection):
+        cursor.execute(query, params or None)
+        return
+
+    prepared = _prepared_on.setdefault(cursor.connection, set())
+    if name not in prepared:
+        cursor.execute(_to_prepare_sql(name, query))
+        prepared.add(name)
+
+    if params:
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cursor.execute(f"EXECUTE {name}")
+
+
+def set_enabled(value: bool):
+    """Switches prepared statements on or off for the whole process, e.g. for benchmarking"""
+    global enabled
+    enabled = value
@@ -0,0 +1,249 @@
+import csv
+import datetime
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+from zoneinfo import ZoneInfo
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+from psycopg2.pool import PoolError
+
+
+# -- Storage backends --
+# STORAGE_BACKEND picks where the app's data lives:
+#   postgres    (default) the PostGreSQL server at DATABASE_URI, through connection_pool's pool
+#   sqlite      an embedded SQLite database at SQLITE_PATH, in WAL mode, or in memory with
+#               SQLITE_PATH=:memory: (one connection, shared by turns, gone when the process exits)
+# The data modules and models are the same for both. SQLite connections take the psycopg2 calls
+# they make: %s placeholders become ?, statements PostGreSQL spells differently run the SQLite
+# version their data module registered with register_sqlite, COPY is carried out row by row,
+# and errors are raised as the psycopg2 exceptions. Vote partitions and the index check are
+# PostGreSQL only.
+
+BACKEND = os.environ.get("STORAGE_BACKEND", "postgres")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "movie_polls.db")
+SQLITE_TIMEOUT = float(os.environ.get("SQLITE_TIMEOUT", 30))      # seconds to wait for a lock
+
+_sqlite_queries: Dict[str, Optional[str]] = {}      # PostGreSQL query text -> SQLite text, None to skip it
+
+_PLACEHOLDER = re.compile(r"%%|%s")
+_COPY_FROM_STDIN = re.compile(r"COPY (\w+) \(([^)]*)\) FROM STDIN", re.IGNORECASE)
+_COPY_TO_STDOUT = re.compile(r"COPY \((.*)\) TO STDOUT WITH \(FORMAT csv(, HEADER)?\)", re.IGNORECASE | re.DOTALL)
+
+
+def register_sqlite(queries: Dict[str, Optional[str]]):
+    """Registers {PostGreSQL query: SQLite query} for statements SQLite spells differently.
+    None skips the statement on SQLite, e.g. table locks SQLite's own locking covers"""
+    _sqlite_queries.update(queries)
+
+
+def is_sqlite(connection) -> bool:
+    return isinstance(connection, SQLiteConnection)
+
+
+def _vote_log_time(timestamp, timezone: str) -> Optional[str]:
+    """to_char(to_timestamp(timestamp) AT TIME ZONE timezone, 'YYYY-MM-DD HH24:MI') for SQLite"""
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp, tz=ZoneInfo(timezone)).strftime("%Y-%m-%d %H:%M")
+
+
+@contextmanager
+def _psycopg2_errors():
+    """sqlite3 errors raised as the psycopg2 classes the callers already handle"""
+    try:
+        yield
+    except sqlite3.IntegrityError as error:
+        raise psycopg2.IntegrityError(str(error)) from error
+    except sqlite3.OperationalError as error:
+        raise psycopg2.OperationalError(str(error)) from error
+    except sqlite3.ProgrammingError as error:
+        raise psycopg2.ProgrammingError(str(error)) from error
+    except sqlite3.DatabaseError as error:
+        raise psycopg2.DatabaseError(str(error)) from error
+
+
+class SQLiteConnection:
+    """The parts of a psycopg2 connection the data modules use, over an sqlite3 connection.
+    As with psycopg2 a transaction starts with the first statement, and `with connection:`
+    commits it (or rolls it back on an error) without closing the connection"""
+
+    def __init__(self, path: str):
+        with _psycopg2_errors():
+            self._connection = sqlite3.connect(path, timeout=SQLITE_TIMEOUT, isolation_level=None,
+                                               check_same_thread=False)
+            self._connection.execute("PRAGMA foreign_keys = ON;")
+            if path != ":memory:":
+                self._connection.execute("PRAGMA journal_mode = WAL;")     # readers don't wait for the writer
+                self._connection.execute("PRAGMA synchronous = NORMAL;")
+            self._connection.create_function("vote_log_time", 2, _vote_log_time, deterministic=True)
+        self.closed = 0
+
+    def cursor(self, name: Optional[str] = None):
+        """name (a psycopg2 server-side cursor) is ignored: SQLite cursors already step through rows"""
+        return SQLiteCursor(self)
+
+    def _begin(self, query: str):
+        # a transaction that starts by writing takes the write lock up front, so two of them
+        # can't both read and then deadlock upgrading to write
+        if not self._connection.in_transaction:
+            immediate = not query.lstrip().upper().startswith(("SELECT", "WITH", "SAVEPOINT"))
+            self._connection.execute("BEGIN IMMEDIATE;" if immediate else "BEGIN;")
+
+    def get_transaction_status(self) -> int:
+        return TRANSACTION_STATUS_INTRANS if self._connection.in_transaction else TRANSACTION_STATUS_IDLE
+
+    def commit(self):
+        if self._connection.in_transaction:
+            with _psycopg2_errors():
+                self._connection.execute("COMMIT;")
+
+    def rollback(self):
+        if self._connection.in_transaction:
+            self._connection.execute("ROLLBACK;")
+
+    def close(self):
+        self._connection.close()
+        self.closed = 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+
+class SQLiteCursor:
+    def __init__(self, connection: SQLiteConnection):
+        self.connection = connection
+        self._cursor = connection._connection.cursor()
+        self.itersize = 2000        # psycopg2 named cursor setting; SQLite steps through rows anyway
+        self.rowcount = -1
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def _translate(self, query: str, params) -> str:
+        query = _sqlite_queries.get(query, query)
+        if query is None or params is None:
+            return query
+        return _PLACEHOLDER.sub(lambda match: "%" if match.group() == "%%" else "?", query)
+
+    @staticmethod
+    def _adapt(params) -> tuple:
+        # lists (e.g. for = ANY(%s)) are passed as JSON, read back with json_each
+        return tuple(json.dumps(param) if isinstance(param, (list, tuple)) else param for param in params)
+
+    def execute(self, query: str, params=None):
+        query = self._translate(query, params)
+        if query is None:
+            return
+        with _psycopg2_errors():
+            self.connection._begin(query)
+            self._cursor.execute(query, self._adapt(params or ()))
+        self.rowcount = self._cursor.rowcount
+
+    def mogrify(self, query: str, params=None) -> bytes:
+        """query with params written in as SQLite literals"""
+        query = self._translate(query, params)
+        literals = iter(params or ())
+        quoted = self.connection._connection.execute
+        return re.sub(r"\?", lambda _: quoted("SELECT quote(?);", self._adapt([next(literals)])).fetchone()[0],
+                      query).encode()
+
+    def copy_expert(self, query: str, file, size: int = 8192):
+        """COPY table (columns) FROM STDIN and COPY (query) TO STDOUT, in CSV"""
+        query = _sqlite_queries.get(query, query)
+        copy_from = _COPY_FROM_STDIN.match(query)
+        copy_to = _COPY_TO_STDOUT.match(query)
+        with _psycopg2_errors():
+            if copy_from:
+                table, columns = copy_from.groups()
+                insert = f"INSERT INTO {table} ({columns}) VALUES ({', '.join('?' * (columns.count(',') + 1))})"
+                self.connection._begin(insert)
+                # an unquoted empty CSV field is NULL, as in PostGreSQL
+                rows = ([field if field != "" else None for field in row] for row in csv.reader(file))
+                self._cursor.executemany(insert, rows)
+            elif copy_to:
+                self.connection._begin(copy_to.group(1))
+                self._cursor.execute(copy_to.group(1))
+                writer = csv.writer(file)
+                if copy_to.group(2):
+                    writer.writerow(column[0] for column in self._cursor.description)
+                self.rowcount = 0
+                for row in self._cursor:
+                    writer.writerow(row)
+                    self.rowcount += 1
+                return
+            else:
+                raise psycopg2.NotSupportedError(f"SQLite can't run {query.split(' (')[0]}")
+        self.rowcount = self._cursor.rowcount
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size: Optional[int] = None):
+        return self._cursor.fetchmany(size or self.itersize)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# A file database keeps idle connections for reuse, opening another whenever every one is in
+# use (WAL lets them all read while one writes). An in-memory database exists only inside its
+# one connection, so threads take turns with it; a thread already holding it gets it again.
+_sqlite_lock = threading.Lock()
+_idle_sqlite_connections = []
+_memory_connection: Optional[SQLiteConnection] = None
+_memory_turn = threading.RLock()
+_memory_depth = 0       # get_sqlite_connection blocks the holding thread is inside
+
+
+@contextmanager
+def get_sqlite_connection(timeout: Optional[float] = None):
+    global _memory_connection, _memory_depth
+    if SQLITE_PATH == ":memory:":
+        if not _memory_turn.acquire(timeout=SQLITE_TIMEOUT if timeout is None else timeout):
+            raise PoolError("the in-memory SQLite connection stayed in use")
+        _memory_depth += 1
+        try:
+            if _memory_connection is None:
+                _memory_connection = SQLiteConnection(":memory:")
+            yield _memory_connection
+        finally:
+            _memory_depth -= 1
+            if _memory_depth == 0:
+                _memory_connection.rollback()       # anything left open, as the pool does
+            _memory_turn.release()
+        return
+
+    with _sqlite_lock:
+        connection = _idle_sqlite_connections.pop() if _idle_sqlite_connections else None
+    if connection is None:
+        connection = SQLiteConnection(SQLITE_PATH)
+    try:
+        yield connection
+    finally:
+        connection.rollback()
+        with _sqlite_lock:
+            _idle_sqlite_connections.append(connection)
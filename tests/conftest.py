@@ -0,0 +1,47 @@
+import os
+import time
+import pytest
+import cache
+import migrations
+import storage
+import vote_filter
+from connection_pool import get_connection
+from polls import poll_database
+
+
+# Every test that takes the backend (or connection) fixture runs once per storage backend:
+# on an in-memory SQLite database, and on the PostGreSQL server at DATABASE_URI when it's set.
+#   python -m pytest tests
+#   DATABASE_URI=... python -m pytest tests
+# The tests make their own rows, named after their tag, so they can run on a database that
+# already has data; a scratch database is still the better choice, as nothing is cleaned up.
+
+BACKENDS = ["sqlite", "postgres"]
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, monkeypatch) -> str:
+    if request.param == "postgres" and not os.environ.get("DATABASE_URI"):
+        pytest.skip("set DATABASE_URI to run the tests on PostGreSQL")
+    monkeypatch.setattr(storage, "BACKEND", request.param)
+    monkeypatch.setattr(storage, "SQLITE_PATH", ":memory:")
+    for named_cache in cache.CACHES.values():       # rows cached from the other backend
+        named_cache.clear()
+    vote_filter.recent_voters.clear()
+    with get_connection() as connection:
+        migrations.migrate(connection)
+        if request.param == "postgres":
+            poll_database.create_vote_partitions(connection)
+    return request.param
+
+
+@pytest.fixture
+def connection(backend):
+    with get_connection() as connection:
+        yield connection
+
+
+@pytest.fixture
+def tag() -> str:
+    """prefix for the rows a test makes, different on every run"""
+    return f"t{time.time_ns()}"
@@ -0,0 +1,89 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from typing import Optional
+import pytest
+import api
+from connection_pool import get_connection
+from polls import poll_database
+
+
+@pytest.fixture
+def base_url(backend):
+    server = api.make_server(port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://{api.HOST}:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def create_poll(tag: str) -> int:
+    # released before the requests, as SQLite in memory has the one connection
+    with get_connection() as connection:
+        return poll_database.create_poll(connection, f"{tag} poll", f"{tag}-owner")
+
+
+def call(url: str, body: Optional[dict] = None):
+    """GET url, or POST body to it as JSON"""
+    data = None if body is None else json.dumps(body).encode()
+    request = urllib.request.Request(url, data, {"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as error:
+        return error.code, json.load(error)
+
+
+@pytest.mark.parametrize("path", ["/movies?page_size={}", "/movies/search?q=a&limit={}",
+                                  "/movies/1/reviews?page_size={}", "/movies/1/reviews?since=0:0&limit={}",
+                                  "/polls/trending?limit={}", "/polls/{poll_id}/winners?winners={}"])
+@pytest.mark.parametrize("value", [0, -5])
+def test_sizes_below_one_are_rejected(base_url, tag, path, value):
+    poll_id = create_poll(tag)
+    status, body = call(base_url + path.format(value, poll_id=poll_id))
+    assert status == 400 and "at least 1" in body["error"]
+
+
+def test_winners_from_an_option_of_another_poll(base_url, tag):
+    poll_id, other_poll_id = create_poll(tag), create_poll(tag)
+    with get_connection() as connection:
+        other_option_id = poll_database.add_option(connection, "A", other_poll_id)
+    for option_id in (other_option_id, other_option_id + 1000):
+        status, body = call(f"{base_url}/polls/{poll_id}/winners?option={option_id}")
+        assert status == 404 and f"no option {option_id}" in body["error"]
+    status, _ = call(f"{base_url}/polls/{other_poll_id}/winners?option={other_option_id}")
+    assert status == 200
+
+
+def test_a_negative_seed_is_allowed(base_url, tag):
+    poll_id = create_poll(tag)
+    status, body = call(f"{base_url}/polls/{poll_id}/winners?seed=-5")
+    assert status == 200 and body == {"seed": -5, "winners": []}
+
+
+@pytest.mark.parametrize("path", ["/movies?cursor={}", "/movies/1/reviews?cursor={}", "/movies/1/reviews?since={}"])
+@pytest.mark.parametrize("cursor", ["garbage", "1.5:x", "x:1"])
+def test_malformed_cursors_are_rejected(base_url, path, cursor):
+    status, body = call(base_url + path.format(cursor))
+    assert status == 400 and "cursor" in body["error"]
+
+
+@pytest.mark.parametrize("body", [{"owner": ["x"]}, {"options": "AB"}, {"options": ["A", None]},
+                                  {"options": ["A", 1]}, {"options": ["A", ""]}])
+def test_create_poll_checks_the_body_first(base_url, tag, body):
+    status, _ = call(f"{base_url}/polls", {"title": f"{tag} poll", "owner": f"{tag}-owner", **body})
+    assert status == 400
+    with get_connection() as connection:
+        assert f"{tag} poll" not in [title for _, title, _ in poll_database.get_polls(connection)], "nothing saved"
+
+
+def test_usernames_and_reviews_must_be_strings(base_url, tag):
+    poll_id = create_poll(tag)
+    with get_connection() as connection:
+        option_id = poll_database.add_option(connection, "A", poll_id)
+    assert call(f"{base_url}/options/{option_id}/votes", {"username": ["x"]})[0] == 400
+    assert call(f"{base_url}/users", {"username": 5})[0] == 400
+    assert call(f"{base_url}/movies/1/reviews", {"username": f"{tag}-user", "review": {"a": 1}})[0] == 400
+    assert call(f"{base_url}/options/{option_id}/votes", {"username": f"{tag}-voter"})[0] == 201
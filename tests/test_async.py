@@ -0,0 +1,62 @@
+import asyncio
+import os
+import pytest
+
+if not os.environ.get("DATABASE_URI"):
+    pytest.skip("set DATABASE_URI to test the async layer, which is PostGreSQL only", allow_module_level=True)
+
+import async_connection_pool
+from async_connection_pool import get_async_connection
+from movies import async_movie_database
+from polls import async_poll_database
+from polls.Models.async_option import AsyncOption
+from polls.Models.async_poll import AsyncPoll
+
+# Smoke tests of the asyncio data modules and models, on the PostGreSQL server at DATABASE_URI.
+# The backend fixture migrates it first; each test runs in its own event loop and pool.
+
+pytestmark = pytest.mark.parametrize("backend", ["postgres"], indirect=True)
+
+
+def run(coroutine):
+    async def run_and_close():
+        try:
+            return await coroutine
+        finally:
+            await async_connection_pool.close_async_pool()      # the pool belongs to this loop
+    return asyncio.run(run_and_close())
+
+
+def test_create_poll_and_vote(backend, tag):
+    async def create_and_vote():
+        poll = AsyncPoll(f"{tag} poll", f"{tag}-owner")
+        await poll.save()
+        await poll.add_option("A")
+        option = (await poll.options())[0]
+        counted = [await option.vote(f"{tag}-voter"), await option.vote(f"{tag}-voter")]
+        return poll, option, counted, await poll.tally()
+
+    poll, option, counted, (tally, total_votes) = run(create_and_vote())
+    assert counted == [True, False], "a repeat vote isn't counted"
+    assert [(tallied.id, votes) for tallied, votes in tally] == [(option.id, 1)] and total_votes == 1
+    assert run(AsyncPoll.get(poll.id)).title == f"{tag} poll"
+    assert run(AsyncOption.get(option.id)).text == "A"
+
+
+def test_add_vote_to_another_option_of_the_poll(backend, tag):
+    async def vote_twice():
+        async with get_async_connection() as connection:
+            poll_id = await async_poll_database.create_poll(connection, f"{tag} poll", f"{tag}-owner")
+            first = await async_poll_database.add_option(connection, "A", poll_id)
+            second = await async_poll_database.add_option(connection, "B", poll_id)
+            return [await async_poll_database.add_vote(connection, f"{tag}-voter", 0, option_id)
+                    for option_id in (first, second)]
+    assert run(vote_twice()) == [True, False], "one vote per user per poll"
+
+
+def test_search_movie(backend, tag):
+    async def add_and_search():
+        async with get_async_connection() as connection:
+            await async_movie_database.add_movie(connection, f"{tag} Async", 2_000_000_000, "")
+            return await async_movie_database.search_movie(connection, f"{tag} async", limit=10)
+    assert f"{tag} Async" in [movie[1] for movie in run(add_and_search())]
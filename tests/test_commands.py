@@ -0,0 +1,37 @@
+import pytest
+import commands
+from polls import poll_database
+
+
+@pytest.mark.parametrize("continue_on_error", [False, True])
+def test_script_draws_winners_after_another_command(connection, tag, capsys, continue_on_error):
+    """draw-winners shares the script's transaction, which has already run a statement,
+    and with --continue-on-error runs inside a savepoint"""
+    poll_id = poll_database.create_poll(connection, f"{tag} poll", f"{tag}-owner")
+    option_id = poll_database.add_option(connection, "A", poll_id)
+    lines = [f"vote {option_id} {tag}-voter{number}" for number in range(3)]
+    lines.append(f"draw-winners {poll_id} --winners 3 --seed 1")
+
+    stats = commands.run_script(connection, lines, continue_on_error=continue_on_error)
+    assert stats["draw-winners"].errors == 0
+    drawn = [line.split("\t")[0] for line in capsys.readouterr().out.splitlines() if line.startswith(tag)]
+    assert sorted(drawn) == [f"{tag}-voter{number}" for number in range(3)]
+
+
+@pytest.mark.parametrize("continue_on_error", [False, True])
+def test_script_malformed_line(connection, tag, continue_on_error):
+    """a line argparse can't parse fails as its command instead of exiting the script"""
+    poll_id = poll_database.create_poll(connection, f"{tag} poll", f"{tag}-owner")
+    option_id = poll_database.add_option(connection, "A", poll_id)
+    lines = [f"vote {option_id} {tag}-voter0", f"vote {option_id} --bogus", f"vote {option_id} {tag}-voter1"]
+    poll_database.get_poll_tally(connection, poll_id)       # cached, until a vote invalidates it
+
+    if continue_on_error:
+        stats = commands.run_script(connection, lines, continue_on_error=True)
+        assert (stats["vote"].count, stats["vote"].errors) == (3, 1)
+        expected_votes = 2
+    else:
+        with pytest.raises(ValueError):
+            commands.run_script(connection, lines)
+        expected_votes = 0        # the whole batch is rolled back
+    assert [votes for _, _, votes, _ in poll_database.get_poll_tally(connection, poll_id)] == [expected_votes]
@@ -0,0 +1,152 @@
+import threading
+import time
+import psycopg2
+import pytest
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+from psycopg2.pool import PoolError
+import connection_pool
+from connection_pool import ConnectionPool
+
+
+# The pool on its own, with psycopg2.connect handing out fake connections, so no server is needed.
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.alive = True
+        self.in_transaction = False
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return TRANSACTION_STATUS_INTRANS if self.in_transaction else TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeCursor:
+    def __init__(self, connection: FakeConnection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, query, params=None):
+        if not self.connection.alive:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    """every fake connection psycopg2.connect has made, in order; set fail_next to make it raise"""
+    made = []
+
+    def connect(dsn):
+        if connect.fail_next:
+            connect.fail_next = False
+            raise psycopg2.OperationalError("could not connect to server")
+        made.append(FakeConnection())
+        return made[-1]
+    connect.fail_next = False
+    monkeypatch.setattr(connection_pool.psycopg2, "connect", connect)
+    return connect, made
+
+
+def make_pool(**options) -> ConnectionPool:
+    return ConnectionPool("fake", **{"minconn": 0, "maxconn": 1, "timeout": 1, **options})
+
+
+def test_checkout_waits_for_a_connection_to_be_returned(connections):
+    pool = make_pool()
+    held = pool.getconn()
+    returner = threading.Timer(0.1, pool.putconn, (held, ))
+    returner.start()
+    assert pool.getconn(timeout=5) is held
+    returner.join()
+
+    stats = pool.stats()
+    assert (stats.in_use, stats.idle, stats.waiting, stats.checkouts) == (1, 0, 0, 2)
+    assert 0.05 < stats.max_wait_seconds <= stats.total_wait_seconds < 5
+
+
+def test_checkout_times_out_when_every_connection_is_in_use(connections):
+    pool = make_pool()
+    pool.getconn()
+    started = time.monotonic()
+    with pytest.raises(PoolError):
+        pool.getconn(timeout=0.05)
+    assert time.monotonic() - started >= 0.05
+    assert pool.stats().timeouts == 1 and pool.busy() == 1
+
+
+def test_stats_count_connections_and_checkouts(connections):
+    _, made = connections
+    pool = make_pool(minconn=2, maxconn=3)
+    first, second = pool.getconn(), pool.getconn()
+    assert pool.stats()[:4] == (2, 0, 0, 2)
+    third = pool.getconn()
+    assert len(made) == 3, "one more opened once the idle ones were taken"
+    for connection in (first, second, third):
+        pool.putconn(connection)
+    stats = pool.stats()
+    assert (stats.in_use, stats.idle, stats.checkouts) == (0, 3, 3)
+    assert stats.checkouts_per_second == 3 / connection_pool.RATE_WINDOW
+
+
+def test_a_failed_connect_frees_its_place(connections):
+    connect, _ = connections
+    pool = make_pool()
+    connect.fail_next = True
+    with pytest.raises(psycopg2.OperationalError):
+        pool.getconn()
+    assert pool.busy() == 0
+    assert pool.getconn(timeout=0.1) is not None, "the failed connect doesn't count against maxconn"
+
+
+def test_connections_past_their_lifetime_are_recycled(connections):
+    _, made = connections
+    pool = make_pool(max_lifetime=0.01)
+    connection = pool.getconn()
+    time.sleep(0.02)
+    pool.putconn(connection)
+    assert connection.closed and pool.stats().recycled == 1 and pool.stats().idle == 0
+    assert pool.getconn() is made[1]
+
+
+def test_dead_idle_connections_are_replaced(connections):
+    _, made = connections
+    pool = make_pool(validate_after=0)
+    connection = pool.getconn()
+    pool.putconn(connection)
+    connection.alive = False        # e.g. the server restarted while it was idle
+    assert pool.getconn() is made[1]
+    assert connection.closed and pool.stats().replaced == 1
+
+
+def test_returned_connections_are_rolled_back(connections):
+    pool = make_pool()
+    connection = pool.getconn()
+    connection.in_transaction = True
+    pool.putconn(connection)
+    assert connection.rollbacks == 1 and pool.getconn() is connection
+
+
+def test_closeall_fails_waiting_checkouts(connections):
+    pool = make_pool()
+    connection = pool.getconn()
+    closer = threading.Timer(0.05, pool.closeall)
+    closer.start()
+    with pytest.raises(PoolError):
+        pool.getconn(timeout=5)
+    closer.join()
+    assert connection.closed
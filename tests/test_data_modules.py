@@ -0,0 +1,181 @@
+import io
+import time
+import psycopg2
+import pytest
+import cache
+import vote_filter
+from movies import movie_database
+from polls import poll_database
+
+
+# -- Movies --
+
+def test_import_and_search_movies(connection, tag):
+    titles = [f"{tag} Alpha", f"{tag} Beta", f"{tag} Gamma"]
+    movies = [(title, 2_000_000_000 + number, f"https://example.com/{tag}/{number}")
+              for number, title in enumerate(titles)]
+    assert movie_database.import_movies(connection, movies) == 3
+    assert movie_database.import_movies(connection, movies) == 0, "movies already there are skipped"
+    movie_database.add_movie(connection, f"{tag} Delta", 2_000_000_003, f"https://example.com/{tag}/3")
+
+    # PostGreSQL's typo tolerance can also find the titles of earlier runs, which are left out
+    found = [movie for movie in movie_database.search_movie(connection, tag.upper(), limit=10) if tag in movie[1]]
+    assert {movie[1] for movie in found} == set(titles) | {f"{tag} Delta"}
+    completed = movie_database.autocomplete_movie(connection, f"{tag} b".lower())
+    assert [movie[1] for movie in completed] == [f"{tag} Beta"]
+    assert movie_database.get_trailer_url(connection, titles[2].upper()) == (f"https://example.com/{tag}/2", )
+    assert movie_database.get_movie_title(connection, found[0][0]) == found[0][1]
+
+
+def test_movies_page_through_a_shared_timestamp(connection, tag):
+    """the movies share a timestamp a float4 can't hold exactly, so each page boundary falls
+    inside the tie"""
+    release_timestamp = 4_102_444_801.0
+    movie_database.import_movies(connection, [(f"{tag} Same Day {number}", release_timestamp, "")
+                                              for number in range(5)])
+    titles = []
+    cursor_token = f"{release_timestamp - 100_000!r}:0"
+    for _ in range(10):
+        movies, cursor_token = movie_database.get_movies_page(connection, 2, cursor_token)
+        titles += [title for _, title, _, _ in movies if title.startswith(tag)]
+        if cursor_token is None:
+            break
+    assert cursor_token is None, "the pages reach the end"
+    assert sorted(titles) == [f"{tag} Same Day {number}" for number in range(5)], "each movie shown once"
+
+
+# -- Reviews --
+
+@pytest.fixture
+def reviewed(connection, tag):
+    """a user who has reviewed three movies, in order; returns the username and movie ids"""
+    username = f"{tag}-reviewer"
+    movie_database.add_user(connection, username)
+    movie_database.import_movies(connection, [(f"{tag} Review {number}", 2_000_000_000 + number, "")
+                                              for number in range(3)])
+    movie_ids = sorted(movie[0] for movie in movie_database.search_movie(connection, f"{tag} Review", limit=10)
+                       if tag in movie[1])
+    for movie_id in movie_ids:
+        movie_database.review_movie(connection, username, movie_id, f"review of {movie_id}")
+    return username, movie_ids
+
+
+def test_add_user_rejects_a_taken_username(connection, tag):
+    movie_database.add_user(connection, f"{tag}-user")
+    with pytest.raises(psycopg2.IntegrityError):
+        movie_database.add_user(connection, f"{tag}-user")
+
+
+def test_reviewed_movies_are_newest_first(connection, tag, reviewed):
+    username, movie_ids = reviewed
+    titles = [title for title, _, _ in movie_database.get_reviewed_movies(connection, username)]
+    assert titles == [f"{tag} Review {number}" for number in (2, 1, 0)]
+    assert len(movie_database.get_movie_reviews(connection, movie_ids[0])) == 1
+
+
+def test_review_feed_pages_and_since(connection, reviewed):
+    username, _ = reviewed
+    page, cursor_token = movie_database.get_user_review_feed(connection, username, page_size=2)
+    assert len(page) == 2 and cursor_token is not None, "a full page has a next cursor"
+    rest, last_token = movie_database.get_user_review_feed(connection, username, 2, cursor_token)
+    assert len(rest) == 1 and last_token is None, "the last page has no next cursor"
+    newer, _ = movie_database.get_user_reviews_since(connection, username, movie_database.review_cursor_token(rest[0]))
+    assert [review[0] for review in newer] == [review[0] for review in reversed(page)]
+
+
+def test_review_movie_rejects_an_unknown_user(connection, tag, reviewed):
+    _, movie_ids = reviewed
+    with pytest.raises(psycopg2.IntegrityError):
+        movie_database.review_movie(connection, f"{tag}-nobody", movie_ids[0], "no such user")
+
+
+# -- Polls and votes --
+
+@pytest.fixture
+def voted_poll(connection, tag):
+    """a poll with options A, B and C and six voters: three for A, three for B"""
+    poll_id = poll_database.create_poll(connection, f"{tag} poll", f"{tag}-owner")
+    option_ids = [poll_database.add_option(connection, text, poll_id) for text in ("A", "B", "C")]
+    now = time.time()
+    for number in range(3):
+        assert poll_database.add_vote(connection, f"{tag}-voter{number}", now, option_ids[0])
+    assert poll_database.add_vote(connection, f"{tag}-voter3", now, option_ids[1])
+    assert poll_database.copy_votes(connection, [(f"{tag}-voter{number}", option_ids[1], int(now))
+                                                 for number in (4, 5)]) == 2
+    cache.poll_tallies.invalidate(poll_id)
+    return poll_id, option_ids, now
+
+
+def test_polls_and_options(connection, tag, voted_poll):
+    poll_id, option_ids, _ = voted_poll
+    assert poll_database.get_poll(connection, poll_id)[1] == f"{tag} poll"
+    assert [option[0] for option in poll_database.get_poll_options(connection, poll_id)] == option_ids
+    assert poll_database.get_existing_option_ids(connection, [option_ids[0], option_ids[2], -1]) \
+        == {option_ids[0], option_ids[2]}
+
+
+def test_tally_and_votes(connection, voted_poll):
+    poll_id, option_ids, now = voted_poll
+    tally = poll_database.get_poll_tally(connection, poll_id)
+    assert [(option_id, votes, total) for option_id, _, votes, total in tally] \
+        == [(option_ids[0], 3, 6), (option_ids[1], 3, 6), (option_ids[2], 0, 6)]
+    assert len(poll_database.get_votes_for_option(connection, option_ids[0])) == 3
+    assert len(poll_database.get_votes_for_option(connection, option_ids[0], since=int(now) + 60)) == 0
+
+
+def test_one_vote_per_user_per_poll(connection, tag, voted_poll):
+    poll_id, option_ids, now = voted_poll
+    assert not poll_database.add_vote(connection, f"{tag}-voter3", now, option_ids[2]), "turned away by the filter"
+    vote_filter.recent_voters.clear()
+    assert not poll_database.add_vote(connection, f"{tag}-voter0", now, option_ids[2]), "turned away by poll_voters"
+    copied = [(f"{tag}-voter6", option_ids[2], int(now)), (f"{tag}-voter6", option_ids[1], int(now) + 1),
+              (f"{tag}-voter1", option_ids[2], int(now))]
+    assert poll_database.copy_votes(connection, copied) == 1, "only the first vote of a new voter is copied"
+    cache.poll_tallies.invalidate(poll_id)
+    assert [votes for _, _, votes, _ in poll_database.get_poll_tally(connection, poll_id)] == [3, 3, 1]
+
+
+def test_draw_winners(connection, voted_poll):
+    poll_id, _, _ = voted_poll
+    winners = poll_database.draw_winners(connection, poll_id, 3, seed=7)
+    assert len({username for username, _ in winners}) == 3, "different voters"
+    assert winners == poll_database.draw_winners(connection, poll_id, 3, seed=7), "repeats with a seed"
+    assert len(poll_database.draw_winners(connection, poll_id, 10, seed=7)) == 6, "every voter, when there are fewer"
+
+
+def test_trending_and_vote_rate(connection, tag, voted_poll):
+    poll_id, _, _ = voted_poll
+    assert sum(votes for _, _, votes in poll_database.get_poll_vote_rate(connection, poll_id, "day")) == 6
+    cache.trending_polls.clear()
+    trending = poll_database.get_trending_polls(connection, "hour", limit=100_000)
+    assert (poll_id, f"{tag} poll", 6) in [tuple(poll) for poll in trending]
+
+
+def test_vote_log(connection, voted_poll):
+    poll_id, _, _ = voted_poll
+    vote_log = io.StringIO()
+    poll_database.export_poll_vote_log(connection, poll_id, vote_log)
+    assert len(vote_log.getvalue().splitlines()) == 7, "a header and every vote"
+    assert len(list(poll_database.iter_poll_vote_log(connection, poll_id))) == 6
+
+
+def test_vote_counters_match_the_votes(connection, voted_poll):
+    poll_id, option_ids, _ = voted_poll
+    option_drift, poll_drift = poll_database.get_vote_count_drift(connection)
+    assert not [row for row in option_drift if row[0] in option_ids]
+    assert not [row for row in poll_drift if row[0] == poll_id]
+
+
+def test_rebuild_keeps_archived_rollups(connection, backend, voted_poll):
+    poll_id, option_ids, _ = voted_poll
+    with connection, connection.cursor() as cursor:
+        archived_bucket = poll_database.live_votes_start(cursor) - poll_database.DAY
+        if backend == "postgres":       # a day of votes from a month that has been archived
+            cursor.execute("INSERT INTO vote_rollups_daily (poll_id, bucket_start, option_id, votes) "
+                           "VALUES (%s, %s, %s, 4);", (poll_id, archived_bucket, option_ids[2]))
+    poll_database.rebuild_vote_counts(connection)
+    with connection, connection.cursor() as cursor:
+        cursor.execute("SELECT bucket_start, SUM(votes) FROM vote_rollups_daily WHERE poll_id = %s "
+                       "GROUP BY bucket_start ORDER BY bucket_start;", (poll_id, ))
+        buckets = cursor.fetchall()
+    assert [votes for _, votes in buckets] == ([4, 6] if backend == "postgres" else [6])
@@ -0,0 +1,80 @@
+import os
+import threading
+import time
+import pytest
+import connection_pool
+import storage
+from connection_pool import get_connection
+from movies import movie_database
+
+
+# Read/write routing against a primary and its streaming replicas. Two local instances are
+# enough: a primary, and a standby made with
+#   pg_basebackup -D replica -R -d "$DATABASE_URI" && pg_ctl -D replica -o "-p 5433" start
+#   DATABASE_URI=... DATABASE_REPLICA_URIS=... python -m pytest tests/test_replica_routing.py
+# Each run adds a user (test-replica-<time>) to the primary.
+
+LAG_TIMEOUT = 10       # seconds to wait for a write to reach a replica
+
+pytestmark = pytest.mark.skipif(not (os.environ.get("DATABASE_URI") and os.environ.get("DATABASE_REPLICA_URIS")),
+                                reason="set DATABASE_URI and DATABASE_REPLICA_URIS to test replica routing")
+
+
+def in_recovery(connection) -> bool:
+    """True on a replica"""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_is_in_recovery();")
+        in_recovery_now = cursor.fetchone()[0]
+    connection.rollback()
+    return in_recovery_now
+
+
+def user_exists(connection, username: str) -> bool:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM users WHERE username = %s;", (username, ))
+        found = cursor.fetchone() is not None
+    connection.rollback()
+    return found
+
+
+def in_new_session(function):
+    """runs function on its own thread, so it starts with no read-your-writes pinning"""
+    result = []
+    thread = threading.Thread(target=lambda: result.append(function()))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+@pytest.fixture(autouse=True)
+def postgres(monkeypatch):
+    monkeypatch.setattr(storage, "BACKEND", "postgres")
+    assert connection_pool.get_replica_pools()
+
+
+def test_read_only_reads_go_to_a_replica():
+    def read():
+        with get_connection(read_only=True) as connection:
+            return in_recovery(connection)
+    assert in_new_session(read)
+
+
+def test_reads_after_a_write_stay_on_the_primary():
+    username = f"test-replica-{time.time_ns()}"
+
+    def write_then_read():
+        with get_connection() as connection:
+            movie_database.add_user(connection, username)
+        with get_connection(read_only=True) as connection:
+            return not in_recovery(connection) and user_exists(connection, username)
+    assert in_new_session(write_then_read)
+
+    def replicated() -> bool:
+        deadline = time.monotonic() + LAG_TIMEOUT
+        while time.monotonic() < deadline:
+            with get_connection(read_only=True) as connection:
+                if user_exists(connection, username):
+                    return True
+            time.sleep(0.01)
+        return False
+    assert in_new_session(replicated), f"the write reaches a replica within {LAG_TIMEOUT}s"
@@ -0,0 +1,139 @@
+import hashlib
+import math
+import os
+import random
+import threading
+from typing import List, NamedTuple
+
+
+# -- Recent voter filter --
+# A Bloom filter of the (poll id, username) pairs that have voted recently, checked before a
+# vote goes to the database. A pair it hasn't seen is never taken for a repeat, so first votes
+# go straight to the one INSERT that records them; a pair it has seen is almost always a repeat
+# vote and is turned away without a query. The poll_voters key in the database still has the
+# final say, for voters the filter hasn't seen (older votes, or votes through another process).
+#   VOTE_FILTER_ENABLED=0           every vote goes to the database
+#   VOTE_FILTER_CAPACITY=1000000    pairs per generation
+#   VOTE_FILTER_ERROR_RATE=0.001    chance a new pair is taken for a repeat, per generation
+#   VOTE_FILTER_VERIFY_RATE=0.01    share of repeats sent to the database anyway, to count the
+#                                   false positives; 1 sends every one, so no first vote is ever
+#                                   turned away, and 0 none
+#   VOTE_FILTER_WARM_DAYS=7         days of votes poll_database.warm_vote_filter loads
+# Two generations are kept: once the newest holds CAPACITY pairs it becomes the older one and
+# the oldest is dropped, so memory stays fixed and voters not seen for a while age out.
+
+FILTER_ENABLED = os.environ.get("VOTE_FILTER_ENABLED", "1") != "0"
+CAPACITY = int(os.environ.get("VOTE_FILTER_CAPACITY", 1_000_000))
+ERROR_RATE = float(os.environ.get("VOTE_FILTER_ERROR_RATE", 0.001))
+VERIFY_RATE = float(os.environ.get("VOTE_FILTER_VERIFY_RATE", 0.01))
+WARM_DAYS = float(os.environ.get("VOTE_FILTER_WARM_DAYS", 7))
+
+# what check() says about a pair
+NEW = "new"         # not seen; the vote goes to the database
+REPEAT = "repeat"       # seen; the vote is turned away
+VERIFY = "verify"       # seen, but sampled to go to the database to measure false positives
+
+
+class VoteFilterStats(NamedTuple):
+    pairs: int          # pairs held in the two generations
+    checks: int
+    rejected: int       # repeat votes turned away without a query
+    verified: int       # repeats sent to the database anyway
+    false_positives: int        # verified repeats the database counted as first votes
+    missed: int         # repeat votes only the database caught
+
+
+class RecentVoterFilter:
+    """Thread-safe Bloom filter of recent (poll id, username) pairs, in two generations"""
+
+    def __init__(self, capacity: int, error_rate: float, verify_rate: float):
+        self.enabled = FILTER_ENABLED and capacity > 0
+        self.capacity = capacity
+        self.verify_rate = verify_rate
+        # the optimal size and number of hashes for the capacity and error rate
+        self.size_bits = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size_bits / max(capacity, 1) * math.log(2)))
+        self._lock = threading.Lock()
+        self._current = bytearray((self.size_bits + 7) // 8 if self.enabled else 0)
+        self._previous = bytearray(len(self._current))
+        self._current_pairs = self._previous_pairs = 0
+        self._checks = self._rejected = self._verified = self._false_positives = self._missed = 0
+
+    def _positions(self, poll_id: int, username: str) -> List[int]:
+        # two 64 bit hashes from one digest, combined into `hashes` bit positions
+        digest = hashlib.blake2b(f"{poll_id}:{username}".encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(first + number * second) % self.size_bits for number in range(self.hashes)]
+
+    @staticmethod
+    def _has(bits: bytearray, positions: List[int]) -> bool:
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in positions)
+
+    def check(self, poll_id: int, username: str) -> str:
+        """NEW, REPEAT or VERIFY for a vote by username in the poll"""
+        if not self.enabled:
+            return NEW
+        positions = self._positions(poll_id, username)
+        with self._lock:
+            self._checks += 1
+            if not (self._has(self._current, positions) or self._has(self._previous, positions)):
+                return NEW
+            if random.random() < self.verify_rate:
+                self._verified += 1
+                return VERIFY
+            self._rejected += 1
+            return REPEAT
+
+    def record(self, poll_id: int, username: str, counted: bool, checked: str = NEW):
+        """Adds the pair once the database has taken or refused its vote, counting the
+        times the check was wrong"""
+        if not self.enabled:
+            return
+        positions = self._positions(poll_id, username)
+        with self._lock:
+            self._false_positives += counted and checked == VERIFY
+            self._missed += not counted and checked == NEW
+            if self._has(self._current, positions):
+                return
+            if self._current_pairs >= self.capacity:
+                self._previous, self._previous_pairs = self._current, self._current_pairs
+                self._current, self._current_pairs = bytearray(len(self._previous)), 0
+            for position in positions:
+                self._current[position >> 3] |= 1 << (position & 7)
+            self._current_pairs += 1
+
+    def add(self, poll_id: int, username: str):
+        """Adds a pair known to have voted, e.g. while warming up"""
+        self.record(poll_id, username, counted=True)
+
+    def clear(self):
+        with self._lock:
+            self._current = bytearray(len(self._current))
+            self._previous = bytearray(len(self._previous))
+            self._current_pairs = self._previous_pairs = 0
+
+    def stats(self) -> VoteFilterStats:
+        with self._lock:
+            return VoteFilterStats(self._current_pairs + self._previous_pairs, self._checks, self._rejected,
+                                   self._verified, self._false_positives, self._missed)
+
+
+recent_voters = RecentVoterFilter(CAPACITY, ERROR_RATE, VERIFY_RATE)
+
+
+def prometheus_text() -> str:
+    """The filter's counters in the Prometheus text exposition format"""
+    stats = recent_voters.stats()
+    lines = ["# HELP app_vote_filter_pairs (poll, voter) pairs held by the recent voter filter.",
+             "# TYPE app_vote_filter_pairs gauge",
+             f"app_vote_filter_pairs {stats.pairs}"]
+    for field, help_text in (
+            ("checks", "Votes checked against the recent voter filter."),
+            ("rejected", "Repeat votes turned away by the filter without a query."),
+            ("verified", "Filter hits sent to the database to measure false positives."),
+            ("false_positives", "Verified filter hits that were first votes."),
+            ("missed", "Repeat votes the filter didn't know of, caught by the database.")):
+        lines += [f"# HELP app_vote_filter_{field}_total {help_text}",
+                  f"# TYPE app_vote_filter_{field}_total counter",
+                  f"app_vote_filter_{field}_total {getattr(stats, field)}"]
+    return "\n".join(lines) + "\n"